@@ -0,0 +1,127 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+'''
+BEGIN
+function:
+    Connections opened and checkout latency of the pool under contention,
+    for a PooledDB per thread (the former pool mode), one PooledDB shared
+    by all threads, and the SharedPool of a DB handle. The driver is an
+    in-process stand-in with a fixed connect and query latency.
+usage:
+    python benchmark/bench_pool.py [threads] [checkouts per thread]
+END
+'''
+
+from __future__ import print_function
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from DBUtils.PooledDB import PooledDB
+from crystaldb.pool import SharedPool
+
+CONNECT_SECONDS = 0.005
+QUERY_SECONDS = 0.0005
+
+
+class LocalDriver(object):
+    """A DB-API module whose connections only sleep."""
+    threadsafety = 1
+    paramstyle = "pyformat"
+    OperationalError = InternalError = type("Error", (Exception, ), {})
+
+    def __init__(self):
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def connect(self, **params):
+        time.sleep(CONNECT_SECONDS)
+        with self.lock:
+            self.opened += 1
+        return LocalConnection()
+
+
+class LocalConnection(object):
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        time.sleep(QUERY_SECONDS)
+
+    def ping(self, *args):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def per_thread(driver, **kwargs):
+    local = threading.local()
+
+    def connection():
+        if not hasattr(local, "pool"):
+            local.pool = PooledDB(driver, **kwargs)
+        return local.pool.connection()
+
+    return connection
+
+
+def shared(cls):
+    return lambda driver, **kwargs: cls(driver, **kwargs).connection
+
+
+def run(make_pool, threads, checkouts):
+    driver = LocalDriver()
+    connection = make_pool(driver,
+                           maxcached=16,
+                           maxconnections=16,
+                           blocking=True)
+    waits = []
+
+    def work():
+        mine = []
+        for _ in range(checkouts):
+            start = time.time()
+            conn = connection()
+            mine.append(time.time() - start)
+            conn.cursor().execute("SELECT 1")
+            conn.close()
+        waits.extend(mine)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    cost = time.time() - start
+    waits.sort()
+    return (driver.opened, waits[len(waits) // 2] * 1000,
+            waits[int(len(waits) * 0.99)] * 1000, len(waits) / cost)
+
+
+def main(threads, checkouts):
+    print("{} threads x {} checkouts, maxconnections=16".format(
+        threads, checkouts))
+    print("{:>12} {:>12} {:>10} {:>10} {:>12}".format(
+        "pool", "connections", "p50(ms)", "p99(ms)", "checkouts/s"))
+    for name, make_pool in (("per-thread", per_thread),
+                            ("PooledDB", shared(PooledDB)),
+                            ("SharedPool", shared(SharedPool))):
+        opened, p50, p99, rate = run(make_pool, threads, checkouts)
+        print("{:>12} {:>12} {:>10.3f} {:>10.3f} {:>12.0f}".format(
+            name, opened, p50, p99, rate))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 64,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 200)
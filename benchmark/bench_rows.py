@@ -0,0 +1,57 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+'''
+BEGIN
+function:
+    Memory per row and build time of each row factory, on rows shaped
+    like a fetchall() result. No database connection is made.
+usage:
+    python benchmark/bench_rows.py [rows]
+END
+'''
+
+from __future__ import print_function
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from crystaldb.utils import row_converter
+
+NAMES = ["id", "gender", "name", "birthday", "age", "score"]
+
+
+def fetched(rows):
+    return tuple((i, "girl", "name%d" % i, "1982-08-02", i % 90, i * 0.5)
+                 for i in range(rows))
+
+
+def measure(kind, rows):
+    data = fetched(rows)
+    start = time.time()
+    make_row = row_converter(kind, NAMES)
+    out = list(map(make_row, data))
+    cost = (time.time() - start) * 1000
+    del out
+
+    tracemalloc.start()
+    make_row = row_converter(kind, NAMES)
+    out = list(map(make_row, data))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del out
+    return cost, float(size) / rows
+
+
+def main(rows):
+    print("{} rows x {} columns".format(rows, len(NAMES)))
+    print("{:>10} {:>12} {:>14}".format("factory", "build(ms)", "bytes/row"))
+    for kind in ("storage", "row", "tuple"):
+        cost, per_row = measure(kind, rows)
+        print("{:>10} {:>12.1f} {:>14.1f}".format(kind, cost, per_row))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,71 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+'''
+BEGIN
+function:
+    Microbenchmark of SQLQuery building cost for wide filters.
+    No database connection is made, queries are only rendered.
+usage:
+    python benchmark/bench_sqlquery.py [terms ...]
+END
+'''
+
+from __future__ import print_function
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import crystaldb
+from crystaldb.db import SQLQuery, sqlparam
+
+
+def timeit(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        cost = time.time() - start
+        best = cost if best is None else min(best, cost)
+    return best * 1000
+
+
+def concat_chain(terms):
+    q = SQLQuery("SELECT * FROM user WHERE 1 = 1")
+    for i in range(terms):
+        q = q + " AND c{} = ".format(i) + sqlparam(i)
+    return q.query(), q.values()
+
+
+def select_filters(db_handle, terms):
+    select = db_handle.select("user")
+    for i in range(terms):
+        select.gt(**{"c{}".format(i): i})
+    select.in_(id=list(range(terms)))
+    q = select.query()
+    return q.query(), q.values()
+
+
+def rendered_twice(terms):
+    q = SQLQuery("SELECT * FROM user WHERE 1 = 1")
+    for i in range(terms):
+        q += " AND c{} = ".format(i) + sqlparam(i)
+    q.query("pyformat")
+    return q.query("pyformat"), q.values(), len(q)
+
+
+def main(sizes):
+    db_handle = crystaldb.database(dbn="mysql", host="127.0.0.1", db="test")
+    db_handle.raw_sql_flag = True
+    print("{:>8} {:>14} {:>14} {:>14}".format("terms", "concat(ms)",
+                                              "select(ms)", "render x2(ms)"))
+    for terms in sizes:
+        print("{:>8} {:>14.3f} {:>14.3f} {:>14.3f}".format(
+            terms, timeit(lambda: concat_chain(terms)),
+            timeit(lambda: select_filters(db_handle, terms)),
+            timeit(lambda: rendered_twice(terms))))
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [100, 1000, 10000])
@@ -14,9 +14,13 @@ except ImportError:
     from urlparse import urlparse
     from urllib import unquote
 
-from .exception import UnknownDB
+from .exception import UnknownDB, MemoryLimitExceeded
 from .db import MySQLDB
 from .db import Table
+from .db import bindparam
+from .utils import LazyRows
+from .shard import ShardRouter
+from .partition import PartitionedTable
 
 __version__ = "1.1.0"
 
@@ -55,3 +55,48 @@ JOIN = AttrDict(
     FULL_JOIN='FULL JOIN')
 
 TOKEN = '[ \\f\\t]*(\\\\\\r?\\n[ \\f\\t]*)*(#[^\\r\\n]*)?(((\\d+[jJ]|((\\d+\\.\\d*|\\.\\d+)([eE][-+]?\\d+)?|\\d+[eE][-+]?\\d+)[jJ])|((\\d+\\.\\d*|\\.\\d+)([eE][-+]?\\d+)?|\\d+[eE][-+]?\\d+)|(0[xX][\\da-fA-F]+[lL]?|0[bB][01]+[lL]?|(0[oO][0-7]+)|(0[0-7]*)[lL]?|[1-9]\\d*[lL]?))|((\\*\\*=?|>>=?|<<=?|<>|!=|//=?|[+\\-*/%&|^=<>]=?|~)|[][(){}]|(\\r?\\n|[:;.,`@]))|([uUbB]?[rR]?\'[^\\n\'\\\\]*(?:\\\\.[^\\n\'\\\\]*)*\'|[uUbB]?[rR]?"[^\\n"\\\\]*(?:\\\\.[^\\n"\\\\]*)*")|[a-zA-Z_]\\w*)'
+
+# MySQL column type codes, as found in `cursor.description[i][1]`.
+FIELD_TYPE = AttrDict(
+    DECIMAL=0,
+    TINY=1,
+    SHORT=2,
+    LONG=3,
+    FLOAT=4,
+    DOUBLE=5,
+    NULL=6,
+    TIMESTAMP=7,
+    LONGLONG=8,
+    INT24=9,
+    DATE=10,
+    TIME=11,
+    DATETIME=12,
+    YEAR=13,
+    NEWDATE=14,
+    VARCHAR=15,
+    BIT=16,
+    JSON=245,
+    NEWDECIMAL=246,
+    ENUM=247,
+    SET=248,
+    TINY_BLOB=249,
+    MEDIUM_BLOB=250,
+    LONG_BLOB=251,
+    BLOB=252,
+    VAR_STRING=253,
+    STRING=254,
+    GEOMETRY=255)
+
+# MySQL column flags, see `crystaldb.utils.column_flags`.
+FIELD_FLAG = AttrDict(
+    NOT_NULL=1,
+    PRI_KEY=2,
+    UNIQUE_KEY=4,
+    MULTIPLE_KEY=8,
+    BLOB=16,
+    UNSIGNED=32,
+    ZEROFILL=64,
+    BINARY=128)
+
+# the charset number of binary strings and blobs.
+BINARY_CHARSET = 63
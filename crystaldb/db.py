@@ -13,12 +13,26 @@ import os
 import time
 import datetime
 import re
-from DBUtils.PooledDB import PooledDB
+import copy
+import fnmatch
+import threading
+try:
+    from threading import get_ident
+except ImportError:
+    from thread import get_ident
 from .utils import (threadeddict, safestr, safeunicode, storage, iterbetter,
-                    add_space)
-from .exception import UnknownParamstyle, _ItplError
+                    add_space, LRUCache, row_converter)
+from .exception import UnknownParamstyle, _ItplError, MemoryLimitExceeded
 from .compat import string_types, numeric_types, PY2, iteritems
 from .config import TOKEN, OP, JOIN
+from .columnar import fetch_columns, to_dataframe
+from .export import export_cursor
+from .spill import MemoryStats, fetch_budgeted
+from .pool import SharedPool, PoolStats
+from .maintenance import ConnRecord, Maintenance
+from .replica import Replica, ReplicaSet, Primary, is_read, is_write
+from .hedge import Hedger
+from . import forksafe
 
 try:
     from urllib import parse as urlparse
@@ -43,6 +57,12 @@ __all__ = [
     "Delete",
     "Table",
     "Transaction",
+    "PreparedCursor",
+    "BindParam",
+    "CompiledSelect",
+    "CompiledTemplate",
+    "compile_template",
+    "template_cache",
 ]
 
 tokenprog = re.compile(TOKEN)
@@ -110,6 +130,25 @@ def sqlwhere(data, grouping=' AND '):
     return SQLQuery.join([k + ' = ' + sqlparam(v) for k, v in data], grouping)
 
 
+def _iterparts(parts):
+    """
+    Iterates over the nested part lists of a `SQLQuery` without recursion,
+    so long `+` chains do not hit the recursion limit.
+    :example:
+        >>> list(_iterparts(['a', ['b', ['c']], 'd']))
+        ['a', 'b', 'c', 'd']
+    """
+    stack = [iter(parts)]
+    while stack:
+        for x in stack[-1]:
+            if type(x) is list:
+                stack.append(iter(x))
+                break
+            yield x
+        else:
+            stack.pop()
+
+
 class SQLParam(object):
     """
     Parameter in SQLQuery.
@@ -166,8 +205,14 @@ class SQLQuery(object):
 
     Internally, consists of `items`, which is a list of strings and
     SQLParams, which get concatenated to produce the actual query.
+
+    Concatenation does not copy: the parts of both operands are shared
+    by reference and only flattened when `items` is read. A query copies
+    its own list before it is mutated if that list has been shared, so
+    `a + b` never sees later changes to `a`. The rendered query string and
+    values are cached until the next mutation.
     """
-    __slots__ = ["items"]
+    __slots__ = ["_parts", "_shared", "_cache"]
 
     # tested in sqlquote's docstring
     def __init__(self, items=None):
@@ -185,49 +230,84 @@ class SQLQuery(object):
             >>> SQLQuery(SQLParam(1))
             <sql: '1'>
         """
+        self._shared = False
+        self._cache = None
         if items is None:
-            self.items = []
+            self._parts = []
         elif isinstance(items, list):
-            self.items = items
+            self._parts = items
         elif isinstance(items, SQLParam):
-            self.items = [items]
+            self._parts = [items]
         elif isinstance(items, SQLQuery):
-            self.items = list(items.items)
+            self._parts = [items._share()]
         else:
-            self.items = [items]
+            self._parts = [items]
 
         # Take care of SQLLiterals
-        for i, item in enumerate(self.items):
+        for i, item in enumerate(self._parts):
             if isinstance(item, SQLParam) and isinstance(
                     item.value, SQLLiteral):
-                self.items[i] = item.value.v
+                self._parts[i] = item.value.v
+
+    def _share(self):
+        """Returns the parts list for embedding in another query."""
+        self._shared = True
+        return self._parts
+
+    def _own(self):
+        """Prepares the parts list for an in-place mutation."""
+        if self._shared:
+            self._parts = list(self._parts)
+            self._shared = False
+        self._cache = None
+        return self._parts
+
+    def _get_items(self):
+        parts = self._parts
+        for x in parts:
+            if type(x) is list:
+                break
+        else:
+            if self._shared:
+                # the caller may mutate the list, hand out our own copy.
+                self._parts = parts = list(parts)
+                self._shared = False
+            return parts
+        self._parts = list(_iterparts(parts))
+        self._shared = False
+        return self._parts
+
+    def _set_items(self, items):
+        self._parts = items
+        self._shared = False
+        self._cache = None
+
+    items = property(_get_items, _set_items)
 
     def append(self, value):
-        self.items.append(value)
+        self._own().append(value)
 
     def __add__(self, other):
-        if isinstance(other, string_types):
-            items = [other]
-        elif isinstance(other, SQLQuery):
-            items = other.items
-        else:
+        if isinstance(other, SQLQuery):
+            other = other._share()
+        elif not isinstance(other, string_types):
             return NotImplemented
-        return SQLQuery(self.items + items)
+        return SQLQuery([self._share(), other])
 
     def __radd__(self, other):
-        if isinstance(other, string_types):
-            items = [other]
-        elif isinstance(other, SQLQuery):
-            items = other.items
-        else:
+        if isinstance(other, SQLQuery):
+            other = other._share()
+        elif not isinstance(other, string_types):
             return NotImplemented
-        return SQLQuery(items + self.items)
+        return SQLQuery([other, self._share()])
 
     def __iadd__(self, other):
         if isinstance(other, (string_types, SQLParam)):
-            self.items.append(other)
+            self._own().append(other)
         elif isinstance(other, SQLQuery):
-            self.items.extend(other.items)
+            # share before owning, so `q += q` does not nest q in itself.
+            parts = other._share()
+            self._own().append(parts)
         else:
             return NotImplemented
         return self
@@ -235,33 +315,62 @@ class SQLQuery(object):
     def __len__(self):
         return len(self.query())
 
+    def __nonzero__(self):
+        # same as `len(self) != 0`, without rendering the whole query.
+        for x in _iterparts(self._parts):
+            if isinstance(x, SQLParam) or safestr(x):
+                return True
+        return False
+
+    __bool__ = __nonzero__
+
     def __eq__(self, other):
         return isinstance(other, SQLQuery) and other.items == self.items
 
-    def query(self, paramstyle=None):
-        """
-        Returns the query part of the sql query.
-        :example:
-            >>> q = SQLQuery(["SELECT * FROM test WHERE name=", SQLParam('joe')])
-            >>> q.query()
-            'SELECT * FROM test WHERE name=%s'
-            >>> q.query(paramstyle='qmark')
-            'SELECT * FROM test WHERE name=?'
+    def _render(self, paramstyle):
+        """Renders the query string and values in one pass over the items.
         """
+        parts = self.items
+        cache = self._cache
+        if cache is not None and cache[0] is parts and \
+                cache[1] == len(parts):
+            if paramstyle in cache[3]:
+                return cache[3][paramstyle], cache[2]
+        else:
+            cache = None
+
+        escape = paramstyle in ['format', 'pyformat']
         s = []
-        for x in self.items:
+        values = []
+        for x in parts:
             if isinstance(x, SQLParam):
-                x = x.get_marker(paramstyle)
-                s.append(safestr(x))
+                s.append(safestr(x.get_marker(paramstyle)))
+                values.append(x.value)
             else:
                 x = safestr(x)
                 # automatically escape % characters in the query
                 # For backward compatability, ignore escaping when the query looks already escaped
-                if paramstyle in ['format', 'pyformat']:
+                if escape:
                     if '%' in x and '%%' not in x:
                         x = x.replace('%', '%%')
                 s.append(x)
-        return "".join(s)
+        query = "".join(s)
+        if cache is None:
+            cache = self._cache = (parts, len(parts), values, {})
+        cache[3][paramstyle] = query
+        return query, cache[2]
+
+    def query(self, paramstyle=None):
+        """
+        Returns the query part of the sql query.
+        :example:
+            >>> q = SQLQuery(["SELECT * FROM test WHERE name=", SQLParam('joe')])
+            >>> q.query()
+            'SELECT * FROM test WHERE name=%s'
+            >>> q.query(paramstyle='qmark')
+            'SELECT * FROM test WHERE name=?'
+        """
+        return self._render(paramstyle)[0]
 
     def values(self):
         """
@@ -271,7 +380,7 @@ class SQLQuery(object):
             >>> q.values()
             ['joe']
         """
-        return [i.value for i in self.items if isinstance(i, SQLParam)]
+        return list(self._render(None)[1])
 
     def join(items, sep=' ', prefix=None, suffix=None, target=None):
         """
@@ -291,7 +400,7 @@ class SQLQuery(object):
         if target is None:
             target = SQLQuery()
 
-        target_items = target.items
+        target_items = target._own()
 
         if prefix:
             target_items.append(prefix)
@@ -299,8 +408,10 @@ class SQLQuery(object):
         for i, item in enumerate(items):
             if i != 0 and sep != "":
                 target_items.append(sep)
-            if isinstance(item, SQLQuery):
-                target_items.extend(item.items)
+            if item is target:
+                target_items.append(list(target_items))
+            elif isinstance(item, SQLQuery):
+                target_items.append(item._share())
             elif item == "":  # joins with empty strings
                 continue
             else:
@@ -459,9 +570,7 @@ class SafeEval(object):
     """Safe evaluator for binding params to db queries.
     """
     def safeeval(self, text, mapping, _format="$"):
-        nodes = Parser().parse(text, _format)
-        return SQLQuery.join([self.eval_node(node, mapping) for node in nodes],
-                             "")
+        return compile_template(text, _format).bind(mapping)
 
     def eval_node(self, node, mapping):
         if node.type == "text":
@@ -470,15 +579,87 @@ class SafeEval(object):
             return sqlquote(self.eval_expr(node, mapping))
 
     def eval_expr(self, node, mapping):
-        if node.type == "literal":
+        if node.type == "param":
+            return mapping[node.first]
+        elif node.type == "const":
+            return node.first
+        elif node.type == "literal":
             return ast.literal_eval(node.first)
         elif node.type == "getattr":
             return getattr(self.eval_expr(node.first, mapping), node.second)
         elif node.type == "getitem":
             return self.eval_expr(node.first, mapping)[self.eval_expr(
                 node.second, mapping)]
-        elif node.type == "param":
-            return mapping[node.first]
+
+
+class CompiledTemplate(object):
+    """
+    A string template parsed once into a node list, which can then be
+    bound to many dictionaries without running the parser again.
+    :example:
+        >>> t = CompiledTemplate("SELECT * FROM user WHERE id = $id")
+        >>> t.bind(dict(id=3))
+        <sql: 'SELECT * FROM user WHERE id = 3'>
+        >>> t.bind(dict(id=[1, 2])).query()
+        'SELECT * FROM user WHERE id = (%s, %s)'
+    """
+    __slots__ = ["text", "nodes"]
+
+    _evaluator = SafeEval()
+
+    def __init__(self, text, _format="$"):
+        self.text = text
+        self.nodes = [
+            self._fold(node) for node in Parser().parse(text, _format)
+            if not (node.type == "text" and node.first == "")
+        ]
+
+    def _fold(self, node):
+        """Evaluates literals once, at compile time."""
+        if node.type == "literal":
+            return _Node("const", ast.literal_eval(node.first))
+        elif node.type == "getattr":
+            return _Node(node.type, self._fold(node.first), node.second)
+        elif node.type == "getitem":
+            return _Node(node.type, self._fold(node.first),
+                         self._fold(node.second))
+        return node
+
+    def bind(self, mapping):
+        """Binds `mapping` to the template and returns an `SQLQuery`."""
+        items = []
+        eval_expr = self._evaluator.eval_expr
+        for node in self.nodes:
+            if node.type == "text":
+                items.append(node.first)
+                continue
+            value = eval_expr(node, mapping)
+            if isinstance(value, list):
+                items.extend(_sqllist(value).items)
+            else:
+                items.append(sqlparam(value))
+        return SQLQuery(items)
+
+    def __repr__(self):
+        return "<template: %r>" % self.text
+
+
+# Parsed templates, keyed by (text, format). `template_cache.stats()`
+# reports hits and misses, `template_cache.resize(n)` changes the bound.
+template_cache = LRUCache(maxsize=512)
+
+
+def compile_template(text, _format="$"):
+    """
+    Returns the `CompiledTemplate` of `text`, parsing it only on the first
+    use.
+    """
+    key = (text, _format)
+    compiled = template_cache.get(key)
+    if compiled is None:
+        compiled = CompiledTemplate(text, _format)
+        template_cache.set(key, compiled)
+    return compiled
 
 
 class SQLLiteral:
@@ -500,6 +681,119 @@ class SQLLiteral:
 sqlliteral = SQLLiteral
 
 
+class BindParam(object):
+    """
+    Named placeholder for a value supplied when a compiled select runs.
+    :example:
+        >>> q = SQLQuery(["SELECT * FROM user WHERE age=", SQLParam(BindParam('age'))])
+        >>> q
+        <sql: 'SELECT * FROM user WHERE age=:age'>
+        >>> q.query()
+        'SELECT * FROM user WHERE age=%s'
+    """
+    __slots__ = ["name"]
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, BindParam) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return ":%s" % self.name
+
+
+bindparam = BindParam
+
+
+class CompiledQuery(object):
+    """
+    A rendered query of a `CompiledSelect` with its bound values. It has
+    the `query` and `values` methods of `SQLQuery`, so it can be executed
+    directly, but nothing is rebuilt.
+    """
+    __slots__ = ["template", "params"]
+
+    def __init__(self, template, params):
+        self.template = template
+        self.params = params
+
+    def query(self, paramstyle=None):
+        # rendered once, the render is cached by the template `SQLQuery`.
+        return self.template.query(paramstyle)
+
+    def values(self):
+        return self.params
+
+    def __str__(self):
+        try:
+            return self.query() % tuple([sqlify(x) for x in self.params])
+        except (ValueError, TypeError):
+            return self.query()
+
+    def __repr__(self):
+        return '<sql: %s>' % repr(str(self))
+
+
+class CompiledSelect(object):
+    """
+    An immutable select statement with named placeholders, made by
+    `Select.compile()`. The sql is rendered once, executing it only
+    binds the values.
+    :example:
+        select = db_handle.select("user").filter(
+            age=bindparam("age"), gender=bindparam("gender"))
+        stmt = select.compile(limit=10)
+        stmt.execute(age=36, gender='girl')
+        stmt.first(age=37, gender='boy')
+    """
+    __slots__ = [
+        "database", "template", "names", "row_factory", "_values", "_binds"
+    ]
+
+    def __init__(self, database, template, row_factory=None):
+        self.database = database
+        self.template = template
+        self.row_factory = row_factory
+        self._values = template.values()
+        self._binds = [(i, v.name) for i, v in enumerate(self._values)
+                       if isinstance(v, BindParam)]
+        self.names = frozenset(name for _, name in self._binds)
+
+    def bind(self, **params):
+        """Returns the `CompiledQuery` of this statement with `params`."""
+        for name in params:
+            if name not in self.names:
+                raise ValueError("unknown bind parameter: %s" % name)
+        values = list(self._values)
+        for i, name in self._binds:
+            try:
+                values[i] = params[name]
+            except KeyError:
+                raise ValueError("missing bind parameter: %s" % name)
+        return CompiledQuery(self.template, values)
+
+    def execute(self, **params):
+        return self.database.query(self.bind(**params),
+                                   processed=True,
+                                   row_factory=self.row_factory)
+
+    all = execute
+
+    def first(self, **params):
+        query_result = self.execute(**params)
+        return query_result[0] if query_result else None
+
+    def __str__(self):
+        return str(self.template)
+
+    def __repr__(self):
+        return '<compiled: %s>' % repr(str(self))
+
+
 def _sqllist(values):
     """
     Convert list object to `SQLQuery` object.
@@ -527,8 +821,14 @@ def reparam(string_, dictionary):
         >>> reparam("s IN $s", dict(s=[1, 2]))
         <sql: 's IN (1, 2)'>
     """
-    _format = ":" if ":" in string_ else "$"
-    return SafeEval().safeeval(string_, dictionary, _format)
+    if ":" in string_:
+        _format = ":"
+    elif "$" in string_:
+        _format = "$"
+    else:
+        # nothing to interpolate, skip the parser entirely.
+        return SQLQuery([string_] if string_ else [])
+    return compile_template(string_, _format).bind(dictionary)
 
 
 class Transaction:
@@ -540,19 +840,32 @@ class Transaction:
         class transaction_engine:
             """Transaction Engine used in top level transactions."""
             def do_transact(self):
-                ctx.commit(unload=False)
+                # with pool, one connection is pinned for the whole
+                # transaction, nested savepoints included, and stays in
+                # the transaction its `begin()` opened; a commit here
+                # would end it, and on an autocommit session every
+                # statement would then commit on its own.
+                if not ctx.pin():
+                    ctx.commit()
 
             def do_commit(self):
-                ctx.commit()
+                try:
+                    ctx.commit()
+                finally:
+                    ctx.unpin()
 
             def do_rollback(self):
-                ctx.rollback()
+                try:
+                    ctx.rollback()
+                finally:
+                    ctx.unpin()
 
         class subtransaction_engine:
             """Transaction Engine used in sub transactions."""
             def query(self, q):
-                db_cursor = ctx.db.cursor()
+                db_cursor = ctx.connection().cursor()
                 ctx.db_execute(db_cursor, SQLQuery(q % transaction_count))
+                db_cursor.close()
 
             def do_transact(self):
                 self.query('SAVEPOINT webpy_sp_%s')
@@ -602,6 +915,79 @@ class Transaction:
                                                           transaction_count]
 
 
+class PreparedCursor(object):
+    """
+    Cursor that runs every query as a server side prepared statement.
+    One driver cursor is prepared per distinct query text and kept in the
+    per-connection `statements` cache, so executing the same statement
+    again only sends the parameters. Evicted statements are closed.
+    A statement executed again before the result of its cached cursor was
+    released (e.g. by a query nested in the iteration of that result)
+    runs on a fresh cursor instead, closed once released.
+    """
+    # prepared statements always take `?` markers.
+    paramstyle = 'qmark'
+
+    def __init__(self, conn, statements, busy):
+        """
+        :param busy: the set of the cached cursors of `conn` whose result
+            is not released yet, shared by its `PreparedCursor`s.
+        """
+        self._conn = conn
+        self._statements = statements
+        self._busy = busy
+        self._cursor = None
+        self._fresh = False
+
+    def execute(self, query, params=None):
+        self.close()
+        cursor = self._statements.get(query)
+        if cursor is None:
+            cursor = self._conn.cursor(prepared=True)
+            self._statements.set(query, cursor)
+        elif cursor in self._busy:
+            cursor = self._conn.cursor(prepared=True)
+            self._fresh = True
+        if not self._fresh:
+            self._busy.add(cursor)
+        self._cursor = cursor
+        return cursor.execute(query, params)
+
+    def __getattr__(self, name):
+        # description, rowcount, lastrowid, fetchone, fetchall...
+        return getattr(self._cursor, name)
+
+    def close(self):
+        """Releases the last statement without closing it, so that it
+        can be executed again."""
+        cursor, self._cursor = self._cursor, None
+        if cursor is None:
+            return
+        if cursor.description:
+            try:
+                cursor.fetchall()
+            except Exception:
+                pass
+        if self._fresh:
+            self._fresh = False
+            _close_statement(None, cursor)
+        else:
+            self._busy.discard(cursor)
+
+
+def _query_text(sql_query):
+    if isinstance(sql_query, SQLQuery):
+        return sql_query.query()
+    return str(sql_query)
+
+
+def _close_statement(query, cursor):
+    try:
+        cursor.close()
+    except Exception:
+        pass
+
+
 class DB(object):
     """Database, which implement sql related operation method."""
     def __init__(self, db_module, params, pool=False, **kwargs):
@@ -637,6 +1023,75 @@ class DB(object):
         failures: an optional exception class or a tuple of exception classes
             for which the connection failover mechanism shall be applied,
             if the default (OperationalError, InternalError) is not adequate
+        prepared: run queries as server side prepared statements when the
+            driver supports them (mysql.connector), otherwise fall back to
+            plain cursors
+        statement_cache_size: the maximum number of prepared statements
+            kept open per connection (the default is 64)
+        query_log: an optional `crystaldb.querylog.QueryLog` that samples
+            executed queries into the `logging` module
+        row_factory: the default type of result rows, "storage" for
+            `Storage` dicts (the default), "row" for `Row` tuples with
+            attribute access, "dict" for plain dicts, "tuple" for raw
+            tuples, or "lazy" (or a `crystaldb.utils.LazyRows`) for
+            `LazyRow` dicts decoding their JSON/BLOB/TEXT columns on first
+            access
+        memory_limit: an optional budget in bytes for the rows of one
+            result set, counted as they are read from an unbuffered
+            cursor; the default of None means unbounded
+        memory_policy: what a query does past `memory_limit`, "raise" a
+            `MemoryLimitExceeded` (the default) or "spill" the remaining
+            rows to a temp file, returning a `SpilledResult`
+        spill_dir: the directory of the spill files, the default is the
+            system temp directory
+        pool_events: an optional callable `pool_events(event, value)`
+            called on every connection event, see `pool_stats`
+        ping_idle: without pool, ping a thread's connection before using
+            it when it sat idle for more than this many seconds, and
+            reopen it if the ping fails (the default None never pings)
+        maintenance_interval: without pool, run `maintain` every this many
+            seconds on a background thread (the default None runs none)
+        max_idle: the maximum number of thread connections idle for more
+            than `idle_timeout` that `maintain` keeps open
+        idle_timeout: the seconds after which an unused connection counts
+            as idle for `max_idle` (the default is 60)
+        after_fork: an optional callable `after_fork(db)` run in a forked
+            child once the connections inherited from the parent were
+            dropped, e.g. to warm up the pool of the child
+        replicas: a list of replicas, each a dict of the connection
+            params that differ from the primary's (e.g. dict(host="r1"))
+            or a "host[:port]" string. Reads go to the replicas, writes
+            and transactions to the primary
+        read_your_writes: the seconds after a write during which the reads
+            of the same thread stay on the primary (the default is 2)
+        replica_gtid: within `read_your_writes`, read from a replica that
+            has applied the primary's `@@gtid_executed` of the write
+            instead of from the primary
+        max_replica_lag: leave out the replicas lagging behind the primary
+            by more than this many seconds (the default None never checks)
+        replica_check_interval: the seconds between two lag checks of a
+            replica (the default is 5)
+        eject_errors: eject a replica after this many failed statements
+            in a row (the default is 3)
+        eject_spike: eject a replica whose average statement time is over
+            this many times the best of the other replicas (the default
+            is 5, None never compares)
+        eject_time: the seconds a replica stays ejected, doubled when it
+            fails again right after (the default is 10)
+        hedge: hedge the replica reads of `first()` and `get()`: when the
+            replica has not answered within `hedge_delay`, the read also
+            goes to a second replica, the first answer wins and the other
+            read is cancelled with KILL QUERY
+        hedge_delay: the seconds before hedging, the default None uses the
+            p95 of the recent hedgeable reads
+        hedge_budget: the extra reads allowed per hedgeable read (the
+            default 0.05 is at most 5% more reads)
+        hedge_workers: the threads running hedged reads (the default is 8)
+        id_generators: a dict of table name (or fnmatch pattern, e.g.
+            "user_*" for the tables of a shard router) to (key column,
+            generator), the generator a `crystaldb.idgen.Snowflake` or
+            `HiLo`. Inserts without the key take it from the generator,
+            and `seqname` returns it without asking the database
         """
 
         if 'driver' in params:
@@ -647,8 +1102,52 @@ class DB(object):
         self.kwargs = kwargs
         self.raw_sql_flag = False
         self.autocommit = kwargs.get("autocommit", False)
+        self.prepared = kwargs.get("prepared", False)
+        self.statement_cache_size = kwargs.get("statement_cache_size", 64)
+        self.query_log = kwargs.get("query_log")
+        self.row_factory = kwargs.get("row_factory")
+        self.memory_limit = kwargs.get("memory_limit")
+        self.memory_policy = kwargs.get("memory_policy") or "raise"
+        self.spill_dir = kwargs.get("spill_dir")
+        # bytes per query fingerprint, for queries run with a budget.
+        self.memory_stats = MemoryStats()
 
         self._ctx = threadeddict()
+        # with pool, one pool for all the threads, built on first use.
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_stats = PoolStats(kwargs.get("pool_events"))
+        self.ping_idle = kwargs.get("ping_idle")
+        self.maintenance_interval = kwargs.get("maintenance_interval")
+        self.max_idle = kwargs.get("max_idle")
+        self.idle_timeout = kwargs.get("idle_timeout", 60)
+        # without pool, thread ident -> `ConnRecord` of its connection.
+        self._conns = {}
+        self._conns_lock = threading.Lock()
+        self._maintenance = None
+        # a child process drops the connections of its parent, see
+        # `_after_fork`.
+        self.after_fork = kwargs.get("after_fork")
+        self._pid = os.getpid()
+        forksafe.register(self)
+        # replica handles, built on the first read.
+        self._replica_params = kwargs.get("replicas") or []
+        self.read_your_writes = kwargs.get("read_your_writes", 2)
+        self.replica_gtid = kwargs.get("replica_gtid", False)
+        self.max_replica_lag = kwargs.get("max_replica_lag")
+        self.replica_check_interval = kwargs.get("replica_check_interval", 5)
+        self.eject_errors = kwargs.get("eject_errors", 3)
+        self.eject_spike = kwargs.get("eject_spike", 5)
+        self.eject_time = kwargs.get("eject_time", 10)
+        self._replica_set = None
+        self._replica_lock = threading.Lock()
+        # on a replica handle, the `Replica` timing its statements.
+        self._host = None
+        self.hedge = kwargs.get("hedge", False)
+        self._hedger = None
+        # table name -> (key column, generator), patterns resolved once.
+        self.id_generators = kwargs.get("id_generators") or {}
+        self._id_generators = {}
         # flag to enable/disable printing queries
         self.print_flag = False
         if "debug" in params:
@@ -668,6 +1167,11 @@ class DB(object):
         self.supports_multiple_insert = False
 
     def _getctx(self):
+        if not forksafe.HOOKED and self._pid != os.getpid():
+            # no fork hook on this python, the pid tells.
+            self._after_fork()
+            if self.after_fork is not None:
+                self.after_fork(self)
         if not self._ctx.get('db'):
             self._load_context(self._ctx)
         return self._ctx
@@ -677,9 +1181,13 @@ class DB(object):
     def _load_context(self, ctx):
         ctx.dbq_count = 0
         ctx.transactions = []  # stack of transactions
+        # the pooled connection held by the running transaction.
+        ctx.pinned = None
 
         ctx.db = self._connect(self.params)
         ctx.db_execute = self._db_execute
+        if not self.pool:
+            self._track(ctx.db)
 
         if not hasattr(ctx.db, 'commit'):
             ctx.db.commit = lambda: None
@@ -687,53 +1195,451 @@ class DB(object):
         if not hasattr(ctx.db, 'rollback'):
             ctx.db.rollback = lambda: None
 
+        def connection():
+            return ctx.db if ctx.pinned is None else ctx.pinned
+
         def commit():
-            return ctx.db.commit()
+            if ctx.get('wrote'):
+                # the reads after the transaction stay on the primary.
+                ctx.wrote = False
+                ctx.last_write = time.time()
+                ctx.write_gtid = None
+            return connection().commit()
 
         def rollback():
-            return ctx.db.rollback()
-
+            return connection().rollback()
+
+        def pin():
+            """Returns True when a pooled connection was pinned and its
+            transaction begun."""
+            if self.pool and ctx.pinned is None:
+                ctx.pinned = ctx.db.connection(shareable=False)
+                ctx.pinned.begin()
+                return True
+            elif not self.pool:
+                # the transaction starts on an open connection.
+                self._checkout(pin=True)
+            return False
+
+        def unpin():
+            if ctx.pinned is not None:
+                pinned, ctx.pinned = ctx.pinned, None
+                pinned.close()
+            elif not self.pool:
+                self._pin_record(False)
+
+        ctx.connection = connection
         ctx.commit = commit
         ctx.rollback = rollback
+        ctx.pin = pin
+        ctx.unpin = unpin
 
     def _unload_context(self, ctx):
         del ctx.db
 
     def _connect(self, params):
         if self.pool:
-            maxcached = self.kwargs.get("maxcached", 0)
-            mincached = self.kwargs.get("mincached", 0)
-            maxshared = self.kwargs.get("maxshared", 0)
-            reset = self.kwargs.get("reset", False)
-            maxconnections = self.kwargs.get("maxconnections", 0)
-            maxusage = self.kwargs.get("maxusage", 0)
-            setsession = ['SET AUTOCOMMIT = 0']
-            if self.autocommit:
-                setsession = ['SET AUTOCOMMIT = 1']
-            return PooledDB(self.db_module,
-                            mincached=mincached,
-                            maxcached=maxcached,
-                            maxshared=maxshared,
-                            maxconnections=maxconnections,
-                            maxusage=maxusage,
-                            setsession=setsession,
-                            reset=reset,
-                            **params)
-        conn = self.db_module.connect(**params)
+            return self._shared_pool(params)
+        conn = forksafe.own(self.db_module.connect(**params))
         if self.autocommit:
             conn.autocommit(True)
         if self.print_flag:
             print("AutoCommit:", conn.get_autocommit())
         return conn
 
+    def _shared_pool(self, params):
+        """Returns the pool of the handle, built once and shared by all
+        threads, so `maxconnections` bounds the whole process."""
+        pool = self._pool
+        if pool is not None:
+            return pool
+        with self._pool_lock:
+            if self._pool is None:
+                setsession = ['SET AUTOCOMMIT = 0']
+                if self.autocommit:
+                    setsession = ['SET AUTOCOMMIT = 1']
+                self._pool = SharedPool(
+                    self.db_module,
+                    mincached=self.kwargs.get("mincached", 0),
+                    maxcached=self.kwargs.get("maxcached", 0),
+                    maxshared=self.kwargs.get("maxshared", 0),
+                    maxconnections=self.kwargs.get("maxconnections", 0),
+                    blocking=self.kwargs.get("blocking", False),
+                    maxusage=self.kwargs.get("maxusage", 0),
+                    setsession=setsession,
+                    reset=self.kwargs.get("reset", False),
+                    stats=self._pool_stats,
+                    **params)
+            return self._pool
+
+    def pool_stats(self):
+        """
+        Returns a snapshot of the connection counters: checkouts and
+        checkins, the checkout wait (total, max and average seconds),
+        driver connections created and destroyed, `maxusage` recycles,
+        reconnects (by the pool or by the retry of `_db_execute`),
+        checkouts refused on `maxconnections` (exhausted), and the
+        connections in use and idle right now.
+        :example:
+            stats = db_handle.pool_stats()
+            print(stats["in_use"], stats["idle"], stats["checkout_wait_max"])
+        """
+        out = self._pool_stats.snapshot()
+        in_use, idle = self._pool.usage() if self._pool is not None \
+            else (0, 0)
+        out.update(in_use=in_use,
+                   idle=idle,
+                   maxconnections=self.kwargs.get("maxconnections", 0))
+        return out
+
+    def _track(self, conn):
+        """Registers the connection of the calling thread, see
+        `maintain`."""
+        record = ConnRecord(threading.current_thread(), conn)
+        with self._conns_lock:
+            old = self._conns.get(get_ident())
+            self._conns[get_ident()] = record
+            if self.maintenance_interval and self._maintenance is None:
+                self._maintenance = Maintenance(self,
+                                                self.maintenance_interval)
+                self._maintenance.start()
+        if old is not None and old.conn is not conn:
+            # a thread id reused after its thread exited.
+            with old.lock:
+                if not old.closed:
+                    old.close()
+
+    def _after_fork(self):
+        """
+        Called in a forked child: forgets the pool, the thread connections
+        and the locks copied from the parent, whose sockets are shared with
+        the parent. The inherited connections are detached without a QUIT
+        or ROLLBACK reaching the server, and the child connects (and builds
+        its pool) on its first query.
+        """
+        self._pid = os.getpid()
+        ctx, self._ctx = self._ctx, threadeddict()
+        pool, self._pool = self._pool, None
+        conns, self._conns = self._conns, {}
+        self._pool_lock = threading.Lock()
+        self._conns_lock = threading.Lock()
+        # threads do not survive fork, the next `_track` starts another.
+        self._maintenance = None
+        self._pool_stats = PoolStats(self._pool_stats.listener)
+        self._replica_lock = threading.Lock()
+        self._hedger = None
+
+        inherited = [record.conn for record in conns.values()]
+        if ctx.get('pinned') is not None:
+            inherited.append(ctx.pinned)
+        if not self.pool and ctx.get('db') is not None and \
+                ctx.db not in inherited:
+            inherited.append(ctx.db)
+        if pool is not None:
+            # the lock may have been held by a thread of the parent.
+            pool._lock = threading.Condition()
+            inherited.extend(pool._idle_cache)
+            shared = getattr(pool, '_shared_cache', None) or []
+            inherited.extend(item.con for item in shared)
+            pool._idle_cache, pool._shared_cache = [], []
+            pool._affinity.clear()
+        for conn in inherited:
+            forksafe.detach(conn)
+
+    def _replicas(self):
+        """Returns the `ReplicaSet` of the handle, built once."""
+        replicas = self._replica_set
+        if replicas is not None:
+            return replicas
+        with self._replica_lock:
+            if self._replica_set is None:
+                replicas = []
+                for params in self._replica_params:
+                    handle = self._replica_handle(params)
+                    handle._host = Replica(handle, self.max_replica_lag,
+                                           self.replica_check_interval,
+                                           self.eject_errors,
+                                           self.eject_spike,
+                                           self.eject_time)
+                    replicas.append(handle._host)
+                self._replica_set = ReplicaSet(replicas)
+            return self._replica_set
+
+    def replica_stats(self):
+        """
+        Returns the stats of every replica: its average statement time
+        (ewma_ms), statements running (inflight), statements and failures,
+        ejections, whether it is ejected now, and its last known lag.
+        :example:
+            for stats in db_handle.replica_stats():
+                print(stats["name"], stats["ewma_ms"], stats["ejected"])
+        """
+        if not self._replica_params:
+            return []
+        return [replica.snapshot() for replica in self._replicas()]
+
+    def _replica_handle(self, replica):
+        """Returns a handle of the same kind for one replica, with the
+        params of the primary overridden by `replica`."""
+        if isinstance(replica, string_types):
+            host, _, port = replica.partition(":")
+            replica = dict(host=host)
+            if port:
+                replica["port"] = int(port)
+        kwargs = dict(self.kwargs)
+        kwargs.pop("replicas", None)
+        kwargs.pop("after_fork", None)
+        handle = object.__new__(type(self))
+        DB.__init__(handle, self.db_module, dict(self.params, **replica),
+                    self.pool, **kwargs)
+        for name in ("paramstyle", "dbname", "supports_multiple_insert",
+                     "print_flag"):
+            if hasattr(self, name):
+                setattr(handle, name, getattr(self, name))
+        return handle
+
+    def _route(self, sql_query):
+        """
+        Returns the handle to run `sql_query` on: a replica for a read,
+        unless the thread is in a transaction, in `primary()`, or wrote
+        less than `read_your_writes` seconds ago; the primary (self)
+        otherwise, and when every replica is ejected.
+        """
+        if not self._replica_params:
+            return self
+        ctx = self._ctx
+        if ctx.get('transactions') or ctx.get('primary') or \
+                not is_read(_query_text(sql_query)):
+            return self
+        replicas = self._replicas()
+        last_write = ctx.get('last_write')
+        if last_write is None or \
+                time.time() - last_write >= self.read_your_writes:
+            replica = replicas.choose()
+        elif not self.replica_gtid:
+            return self
+        else:
+            replica = replicas.choose(self._caught_up())
+        return self if replica is None else replica.database
+
+    def _caught_up(self):
+        """Returns a test of the replicas which applied the last write
+        of the thread, by the GTID set of the primary after it."""
+        ctx = self._ctx
+        if ctx.get('write_gtid') is None:
+            with Primary(ctx):
+                rows = self.query("SELECT @@GLOBAL.gtid_executed AS gtid",
+                                  row_factory="storage")
+            ctx.write_gtid = rows[0].gtid
+            ctx.caught_up = set()
+        gtid, caught_up = ctx.write_gtid, ctx.caught_up
+
+        def accept(replica):
+            if replica in caught_up:
+                return True
+            try:
+                done = replica.has_gtid(gtid)
+            except Exception:
+                done = False
+            if done:
+                caught_up.add(replica)
+            return done
+
+        return accept
+
+    def _hedged_query(self, sql_query, reader, row_factory):
+        """Runs a read on the replica `reader` hedged by a second
+        replica, see `crystaldb.hedge.Hedger`."""
+        with self._replica_lock:
+            if self._hedger is None:
+                self._hedger = Hedger(self.kwargs.get("hedge_workers", 8),
+                                      self.kwargs.get("hedge_delay"),
+                                      self.kwargs.get("hedge_budget", 0.05))
+        first = reader._host
+        second = self._replicas().choose(lambda replica: replica is not first)
+
+        def fetch(replica, task):
+            return replica.database._hedge_fetch(sql_query, row_factory, task)
+
+        return self._hedger.read(first, second, fetch)
+
+    def _hedge_fetch(self, sql_query, row_factory, task):
+        """Runs a read of a hedged call on this replica handle, with the
+        server id of its connection in `task` while it runs."""
+        db_cursor, conn = self._db_pool_cursor(
+        ) if self.pool else self._db_cursor()
+        if task is not None:
+            task.running(conn if conn is not None else self.ctx.db)
+            self._ctx.hedge = task
+        try:
+            self._db_execute(db_cursor, sql_query)
+            names = [x[0] for x in db_cursor.description]
+            make_row = row_converter(row_factory, names,
+                                     db_cursor.description)
+            out = list(map(make_row, db_cursor.fetchall()))
+        finally:
+            if task is not None:
+                task.finished()
+                self._ctx.hedge = None
+            try:
+                if not self.autocommit:
+                    if self.pool:
+                        conn.commit()
+                    else:
+                        self.ctx.commit()
+            finally:
+                db_cursor.close()
+                self._release(conn)
+        return out
+
+    def hedge_stats(self):
+        """
+        Returns the hedged reads counters: hedgeable reads, hedges sent,
+        hedges that answered first, losers cancelled, and the current
+        hedge delay in seconds.
+        """
+        if self._hedger is None:
+            return dict(reads=0, hedged=0, hedge_wins=0, cancelled=0,
+                        delay=self.kwargs.get("hedge_delay"))
+        return self._hedger.snapshot()
+
+    def primary(self):
+        """
+        Sends the reads of the thread to the primary within the block.
+        :example:
+            with db_handle.primary():
+                user = db_handle.select("user").where(id=1).first()
+        """
+        return Primary(self._ctx)
+
+    def _pin_record(self, pinned):
+        record = self._conns.get(get_ident())
+        if record is not None:
+            record.pinned = pinned
+
+    def _checkout(self, pin=False):
+        """Prepares the connection of the calling thread for a query:
+        reopens it if `maintain` closed it or if it fails the ping after
+        `ping_idle` seconds idle, then marks it busy, or with `pin` pinned
+        by the transaction starting on it."""
+        record = self._conns.get(get_ident())
+        if record is None:
+            return
+        ctx = self.ctx
+        with record.lock:
+            now = time.time()
+            if record.conn is not ctx.db:
+                # reopened by the retry of `_db_execute`.
+                record.conn, record.closed = ctx.db, False
+            if record.closed:
+                ctx.db = record.conn = self._connect(self.params)
+                record.closed = False
+                self._pool_stats.event("create")
+            elif self.ping_idle is not None and \
+                    now - record.last_used > self.ping_idle:
+                try:
+                    ctx.db.ping()
+                except Exception:
+                    record.close()
+                    ctx.db = record.conn = self._connect(self.params)
+                    record.closed = False
+                    self._pool_stats.event("reconnect")
+            if pin:
+                record.pinned = True
+            else:
+                record.busy = True
+            record.last_used = now
+
+    def maintain(self):
+        """
+        One maintenance pass over the thread connections, without pool:
+        closes the connections of exited threads, then the connections
+        idle for more than `idle_timeout` seconds above `max_idle`, oldest
+        first. Connections running a statement or a transaction are never
+        closed; a closed connection is reopened by its thread on its next
+        query or transaction. Runs every `maintenance_interval` seconds
+        when set.
+        :return : dict(dead=closed connections of exited threads,
+            idle=closed idle connections)
+        """
+        with self._conns_lock:
+            dead = [(ident, record)
+                    for ident, record in list(self._conns.items())
+                    if not record.thread.is_alive()]
+            for ident, _ in dead:
+                del self._conns[ident]
+            records = list(self._conns.values())
+        for _, record in dead:
+            with record.lock:
+                if not record.closed:
+                    record.close()
+                    self._pool_stats.event("destroy")
+
+        closed = 0
+        if self.max_idle is not None:
+            now = time.time()
+            idle = sorted((record for record in records
+                           if not (record.closed or record.busy
+                                   or record.pinned) and
+                           now - record.last_used > self.idle_timeout),
+                          key=lambda record: record.last_used)
+            for record in idle[:max(len(idle) - self.max_idle, 0)]:
+                with record.lock:
+                    if record.closed or record.busy or record.pinned or \
+                            now - record.last_used <= self.idle_timeout:
+                        continue
+                    record.close()
+                    closed += 1
+                    self._pool_stats.event("destroy")
+        return dict(dead=len(dead), idle=closed)
+
     def _db_cursor(self):
-        return self.ctx.db.cursor(), None
+        if self._conns:
+            self._checkout()
+        return self._cursor(self.ctx.db), None
 
     def _db_pool_cursor(self):
-        conn = self.ctx.db.connection()
-        cursor = conn.cursor()
+        # inside a transaction, every query runs on the pinned connection.
+        conn = self.ctx.pinned
+        if conn is None:
+            conn = self.ctx.db.connection()
+        cursor = self._cursor(conn)
         return cursor, conn
 
+    def _release(self, conn):
+        """Returns a connection from `_db_pool_cursor` to the pool, unless
+        it is pinned by a transaction."""
+        if conn is not None and conn is not self.ctx.pinned:
+            conn.close()
+
+    def _cursor(self, conn):
+        if self.prepared:
+            cursor = self._prepared_cursor(conn)
+            if cursor is not None:
+                return cursor
+        return conn.cursor()
+
+    def _prepared_cursor(self, conn):
+        """Returns a `PreparedCursor` on the driver connection underneath
+        `conn`, or None when the driver has no prepared cursors."""
+        raw = conn
+        # unwrap the DBUtils pooled/steady connection wrappers.
+        while hasattr(raw, '_con'):
+            raw = raw._con
+        statements = getattr(raw, '_crystaldb_statements', None)
+        if statements is None:
+            try:
+                raw.cursor(prepared=True).close()
+            except TypeError:
+                # the driver has no prepared cursor, never try again.
+                self.prepared = False
+                return None
+            statements = LRUCache(self.statement_cache_size,
+                                  on_evict=_close_statement)
+            raw._crystaldb_statements = statements
+            raw._crystaldb_busy = set()
+        return PreparedCursor(raw, statements, raw._crystaldb_busy)
+
     def _param_marker(self):
         """Returns parameter marker based on paramstyle attribute
         if this database."""
@@ -747,47 +1653,87 @@ class DB(object):
             return '%s'
         raise UnknownParamstyle(style)
 
-    def _db_execute(self, cur, sql_query):
-        """executes an sql query"""
-        self.ctx.dbq_count += 1
+    def _db_execute(self, cur, sql_query, detached=False):
+        """executes an sql query
+        :param detached: `cur` is on a connection of its own, not the
+            thread's: the thread's context is left alone, and a failure is
+            raised as is, without the rollback and reconnect of the
+            thread's connection."""
+        record = None
+        if self._conns and not detached:
+            record = self._conns.get(get_ident())
+        host, ok = self._host, False
         start_time = time.time() * 1000
-        run_time = lambda: "%.4f" % (time.time() * 1000 - start_time)
-        try_cnt = 2
-        while try_cnt > 0:
-            try:
-                query, params = self._process_query(sql_query)
-                out = cur.execute(query, params)
-            except Exception:
-                try_cnt -= 1
-                if self.print_flag:
-                    print('ERR:', str(sql_query))
-                if self.ctx.transactions:
-                    self.ctx.transactions[-1].rollback()
-                else:
-                    self.ctx.rollback()
+        if host is not None:
+            host.begin()
+        try:
+            if not detached:
+                self.ctx.dbq_count += 1
+            run_time = lambda: "%.4f" % (time.time() * 1000 - start_time)
+            try_cnt = 2
+            while try_cnt > 0:
                 try:
-                    if not self.pool:
-                        self.ctx.db.ping()
+                    query, params = self._process_query(
+                        sql_query, getattr(cur, 'paramstyle', None))
+                    out = cur.execute(query, params)
                 except Exception:
-                    self.ctx.db = self._connect(self.params)
-                    cur, _ = self._db_cursor()
-                    continue
-                raise
-            break
-
-        if self.print_flag:
-            print("{} ({}): {}".format(run_time(), self.ctx.dbq_count,
-                                       str(sql_query)))
-
-        if self.get_debug_queries:
-            self.get_debug_queries_info = dict(run_time=run_time(),
-                                               sql="{}".format(sql_query))
-        return out
+                    if detached:
+                        raise
+                    try_cnt -= 1
+                    if self.print_flag:
+                        print('ERR:', str(sql_query))
+                    if self.ctx.transactions:
+                        self.ctx.transactions[-1].rollback()
+                    else:
+                        self.ctx.rollback()
+                    if not try_cnt:
+                        # failed again on a new connection.
+                        raise
+                    try:
+                        if not self.pool:
+                            self.ctx.db.ping()
+                    except Exception:
+                        self.ctx.db = self._connect(self.params)
+                        self._pool_stats.event("reconnect")
+                        cur, _ = self._db_cursor()
+                        continue
+                    raise
+                break
 
-    def _process_query(self, sql_query):
+            if self._replica_params and not detached and is_write(query):
+                ctx = self.ctx
+                ctx.last_write = time.time()
+                ctx.write_gtid = None
+                ctx.wrote = bool(ctx.transactions)
+
+            if self.query_log is not None:
+                self.query_log.emit(query, params,
+                                    time.time() * 1000 - start_time, cur)
+
+            if self.print_flag:
+                print("{} ({}): {}".format(
+                    run_time(), self._ctx.get('dbq_count', 0),
+                    str(sql_query)))
+
+            if self.get_debug_queries:
+                self.get_debug_queries_info = dict(run_time=run_time(),
+                                                   sql="{}".format(sql_query))
+            ok = True
+            return out
+        finally:
+            if record is not None:
+                record.busy = False
+                record.last_used = time.time()
+            if host is not None:
+                # a hedged read cancelled by its twin did not fail.
+                hedge = self._ctx.get('hedge')
+                host.end(time.time() * 1000 - start_time, ok
+                         or (hedge is not None and hedge.killed))
+
+    def _process_query(self, sql_query, paramstyle=None):
         """Takes the SQLQuery object and returns query string and parameters.
         """
-        paramstyle = getattr(self, 'paramstyle', 'pyformat')
+        paramstyle = paramstyle or getattr(self, 'paramstyle', 'pyformat')
         query = sql_query.query(paramstyle)
         params = sql_query.values()
         return query, params
@@ -798,12 +1744,35 @@ class DB(object):
         query, params = self._process_query(sql_query)
         return query, params
 
-    def query(self, sql_query, vars=None, processed=False, _test=False):
+    def query(self,
+              sql_query,
+              vars=None,
+              processed=False,
+              _test=False,
+              stream=False,
+              batch_size=1000,
+              row_factory=None,
+              memory_limit=None,
+              memory_policy=None,
+              hedge=False):
         """
         Execute SQL query `sql_query` using dictionary `vars` to interpolate it.
         If `processed=True`, `vars` is a `reparam`-style list to use
         instead of interpolating.
         :param sql_query: select `sql`.
+        :param stream: if true, read the rows over an unbuffered server side
+            cursor and return them as an `IterBetter`, see `_stream`.
+        :param batch_size: the number of rows fetched at a time when
+            streaming.
+        :param row_factory: the type of result rows, overriding the
+            handle's `row_factory`: "storage", "row", "dict", "tuple",
+            "lazy" or a `LazyRows`.
+        :param memory_limit: the byte budget of the rows, overriding the
+            handle's `memory_limit`.
+        :param memory_policy: "raise" or "spill", overriding the handle's
+            `memory_policy`.
+        :param hedge: hedge the read when it goes to a replica, see the
+            `hedge` option of the handle.
         :return : The result of the query is the list object of the iterator.
         """
         if vars is None:
@@ -815,27 +1784,47 @@ class DB(object):
         if _test:
             return sql_query
 
+        if row_factory is None:
+            row_factory = self.row_factory
+
+        reader = self._route(sql_query)
+        if reader is not self and hedge and not stream and \
+                len(self._replicas()) > 1:
+            return self._hedged_query(sql_query, reader, row_factory)
+        if reader is not self:
+            return reader.query(sql_query,
+                                processed=True,
+                                stream=stream,
+                                batch_size=batch_size,
+                                row_factory=row_factory,
+                                memory_limit=memory_limit,
+                                memory_policy=memory_policy)
+
+        if stream:
+            return self._stream(sql_query, batch_size, row_factory)
+
+        if memory_limit is None:
+            memory_limit = self.memory_limit
+        if memory_limit is not None:
+            return self._query_budgeted(sql_query, row_factory, memory_limit,
+                                        memory_policy, batch_size)
+
         db_cursor, conn = self._db_pool_cursor(
         ) if self.pool else self._db_cursor()
         self._db_execute(db_cursor, sql_query)
 
-        if db_cursor.description:
-            names = [x[0] for x in db_cursor.description]
-
-            #def iterwrapper():
-            #    row = db_cursor.fetchone()
-            #    while row:
-            #        yield storage(dict(zip(names, row)))
-            #        row = db_cursor.fetchone()
-
-            #out = iterbetter(iterwrapper())
-            #out.__len__ = lambda: int(db_cursor.rowcount)
-            #out.list = lambda: [
-            #    storage(dict(zip(names, x))) for x in db_cursor.fetchall()
-            #]
-            out = [storage(dict(zip(names, x))) for x in db_cursor.fetchall()]
-        else:
-            out = db_cursor.rowcount
+        try:
+            if not db_cursor.description:
+                out = db_cursor.rowcount
+            else:
+                names = [x[0] for x in db_cursor.description]
+                make_row = row_converter(row_factory, names,
+                                         db_cursor.description)
+                out = list(map(make_row, db_cursor.fetchall()))
+        except Exception:
+            db_cursor.close()
+            self._release(conn)
+            raise
 
         if not self.autocommit and not self.ctx.transactions:
             if not self.pool:
@@ -843,18 +1832,232 @@ class DB(object):
             else:
                 conn.commit()
         db_cursor.close()
+        self._release(conn)
+        return out
+
+    def _query_budgeted(self, sql_query, row_factory, limit, policy,
+                        batch_size):
+        """
+        Runs `sql_query` on an unbuffered cursor, so that its rows count
+        against `limit` as they come from the server, not once the driver
+        has read the whole result into memory. It runs on the connection
+        `query` would use: the thread's, the one pinned by a transaction,
+        or one checked out of the pool. The rows are all read, or the rest
+        discarded, before it returns, so the connection is free again.
+        """
         if self.pool:
-            conn.close()
+            conn = self.ctx.pinned
+            if conn is None:
+                conn = self.ctx.db.connection()
+            db_cursor = self._stream_cursor(conn)
+        else:
+            if self._conns:
+                self._checkout()
+            conn = None
+            db_cursor = self._stream_cursor(self.ctx.db)
+        try:
+            self._db_execute(db_cursor, sql_query)
+            if not db_cursor.description:
+                out = db_cursor.rowcount
+            else:
+                out = self._fetch_budgeted(db_cursor, sql_query, row_factory,
+                                           limit, policy, batch_size)
+            if not self.autocommit and not self.ctx.transactions:
+                if not self.pool:
+                    self.ctx.commit()
+                else:
+                    conn.commit()
+        finally:
+            db_cursor.close()
+            self._release(conn)
         return out
 
-    def select(self, tables, fields=None, distinct=False):
+    def _fetch_budgeted(self, db_cursor, sql_query, row_factory, limit,
+                        policy, batch_size):
+        """Fetches the rows within `limit` bytes, see
+        `crystaldb.spill.fetch_budgeted`, and records their size in
+        `memory_stats`."""
+        names = [x[0] for x in db_cursor.description]
+        make_row = row_converter(row_factory, names,
+                                 db_cursor.description)
+        try:
+            out, nbytes = fetch_budgeted(db_cursor, make_row, limit, policy
+                                         or self.memory_policy, batch_size,
+                                         self.spill_dir)
+        except MemoryLimitExceeded as e:
+            self.memory_stats.record(sql_query.query(), e.nbytes, e.rows, 0)
+            raise
+        self.memory_stats.record(sql_query.query(), nbytes, len(out),
+                                 getattr(out, 'spilled_rows', 0))
+        return out
+
+    def _stream_cursor(self, conn):
+        """Returns an unbuffered cursor, which keeps the result on the
+        server and reads it as it is fetched."""
+        cursors = getattr(self.db_module, 'cursors', None)
+        sscursor = getattr(cursors, 'SSCursor', None)
+        if sscursor is not None:
+            # MySQLdb and pymysql
+            return conn.cursor(sscursor)
+        try:
+            # mysql.connector
+            return conn.cursor(buffered=False)
+        except TypeError:
+            return conn.cursor()
+
+    def _open_stream(self, sql_query, detached=False):
+        """
+        Executes `sql_query` on an unbuffered cursor and returns the cursor
+        with a function releasing it and its connection.
+
+        The cursor holds its connection until released: a connection
+        checked out of the pool, or a dedicated connection without pool,
+        since the thread's connection cannot run other queries while an
+        unbuffered result is pending. Releasing early discards the unread
+        rows. A failure is raised as is: the thread's connection and
+        transaction are not touched by a query on another connection.
+
+        Inside a transaction, the stream reads on the transaction's
+        connection instead, so it sees the transaction's writes; the
+        transaction cannot run other queries until the stream is released.
+        With `detached`, the thread's context is not used, so a worker
+        thread opens no connection of its own besides this one.
+        """
+        if not detached and self._ctx.get('transactions'):
+            conn, own = self.ctx.connection(), False
+        elif self.pool:
+            conn, own = self._shared_pool(self.params).connection(), True
+        else:
+            conn, own = self._connect(self.params), True
+        db_cursor = None
+        try:
+            db_cursor = self._stream_cursor(conn)
+            self._db_execute(db_cursor, sql_query, detached=True)
+        except Exception:
+            if db_cursor is not None and not own:
+                db_cursor.close()
+            if own:
+                conn.close()
+            raise
+
+        released = []
+
+        def release():
+            if released:
+                return
+            released.append(True)
+            try:
+                db_cursor.close()
+                if own and not self.autocommit:
+                    conn.commit()
+            finally:
+                if own:
+                    conn.close()
+
+        return db_cursor, release
+
+    def _stream(self,
+                sql_query,
+                batch_size=1000,
+                row_factory=None,
+                detached=False):
+        """
+        Returns an `IterBetter` of the rows of `sql_query`, fetched
+        `batch_size` at a time from an unbuffered cursor, so memory stays
+        constant whatever the size of the result. It holds its connection
+        until it is exhausted or closed. `detached` leaves the thread's
+        context alone, see `_open_stream`.
+        """
+        db_cursor, release = self._open_stream(sql_query, detached)
+        if not db_cursor.description:
+            out = db_cursor.rowcount
+            release()
+            return out
+
+        names = [x[0] for x in db_cursor.description]
+        make_row = row_converter(row_factory, names,
+                                 db_cursor.description)
+
+        def iterwrapper():
+            try:
+                while True:
+                    rows = db_cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield make_row(row)
+            finally:
+                release()
+
+        return iterbetter(iterwrapper(), on_close=release)
+
+    def columns(self,
+                sql_query,
+                vars=None,
+                processed=False,
+                batch_size=10000,
+                dtypes=None):
+        """
+        Executes a select and returns a dict of one NumPy array per column,
+        filled `batch_size` rows at a time from an unbuffered cursor. The
+        dtypes follow the cursor description type codes, strings go to
+        object arrays and numeric columns with NULLs to masked arrays.
+        Needs numpy.
+        :param dtypes: optional dict of column name to dtype.
+        """
+        if not processed and not isinstance(sql_query, SQLQuery):
+            sql_query = reparam(sql_query, vars or {})
+        reader = self._route(sql_query)
+        if reader is not self:
+            return reader.columns(sql_query, processed=True,
+                                  batch_size=batch_size, dtypes=dtypes)
+        db_cursor, release = self._open_stream(sql_query)
+        try:
+            return fetch_columns(db_cursor, batch_size, dtypes)
+        finally:
+            release()
+
+    def export(self,
+               sql_query,
+               path,
+               vars=None,
+               processed=False,
+               format="csv",
+               batch_size=10000,
+               compression=None,
+               progress=None):
+        """
+        Executes a select and writes its rows to `path` straight from an
+        unbuffered cursor, `batch_size` at a time.
+        :param format: "csv", "jsonl" or "parquet" (needs pyarrow).
+        :param compression: "gzip" or None, implied by a ".gz" path.
+        :param progress: optional callable `progress(rows, seconds)`.
+        :return : the number of rows written.
+        """
+        if not processed and not isinstance(sql_query, SQLQuery):
+            sql_query = reparam(sql_query, vars or {})
+        reader = self._route(sql_query)
+        if reader is not self:
+            return reader.export(sql_query, path, processed=True,
+                                 format=format, batch_size=batch_size,
+                                 compression=compression, progress=progress)
+        db_cursor, release = self._open_stream(sql_query)
+        try:
+            return export_cursor(db_cursor, path, format, batch_size,
+                                 compression, progress)
+        finally:
+            release()
+
+    def select(self, tables, fields=None, distinct=False, row_factory=None):
         """
         Query method which return `Select` object.
         :param tables : tables name.
         :param fields : fields to be queried.
+        :param row_factory : the type of result rows, see `query`.
         :return : `Select` objects which contain various query methods.
         """
-        return Select(self, tables, fields, self.raw_sql_flag, distinct)
+        return Select(self, tables, fields, self.raw_sql_flag, distinct,
+                      row_factory)
 
     def operator(self, tablename, test=False, default=False):
         """The entry point for the write operation, including `insert`、
@@ -933,6 +2136,24 @@ class DB(object):
         return Operator(self, tablename, _test,
                         self.raw_sql_flag).delete(where, using, vars)
 
+    def _id_generator(self, tablename):
+        """Returns (key column, generator) of `tablename`, or None."""
+        try:
+            return self._id_generators[tablename]
+        except KeyError:
+            pass
+        # "shop_1.user_3" matches "shop_1.user_3", then "user_3".
+        names = [tablename, tablename.rpartition(".")[2]]
+        generator = self.id_generators.get(tablename) or \
+            self.id_generators.get(names[1])
+        if generator is None:
+            for pattern, value in self.id_generators.items():
+                if any(fnmatch.fnmatchcase(name, pattern) for name in names):
+                    generator = value
+                    break
+        self._id_generators[tablename] = generator
+        return generator
+
     def _get_insert_default_values_query(self, table):
         """Default insert sql"""
         return "INSERT INTO %s DEFAULT VALUES" % table
@@ -940,8 +2161,26 @@ class DB(object):
     def _process_insert_query(self, query, tablename, seqname):
         return query
 
+    def _insert_ids(self, cursor, count=None):
+        """Returns the id of the row inserted on `cursor`, or with `count`
+        the ids of the `count` rows of a multiple insert, read from the
+        result of the query of `_process_insert_query`."""
+        out = cursor.fetchone()[0]
+        if count is None:
+            return out
+        return range(out - count + 1, out + 1)
+
     def transaction(self):
-        """Start a transaction."""
+        """
+        Start a transaction. Nested transactions are savepoints. With pool,
+        one connection is checked out for the whole transaction and every
+        query of the thread runs on it until the outermost transaction
+        ends.
+        :example:
+            with db_handle.transaction():
+                for values in rows:
+                    db_handle.operator("user").insert(**values)
+        """
         return Transaction(self.ctx)
 
     def close(self):
@@ -1052,8 +2291,7 @@ class BaseQuery(object):
 
     def _cursor_close(self, db_cursor, conn):
         db_cursor.close()
-        if self.database.pool:
-            conn.close()
+        self.database._release(conn)
         return
 
 
@@ -1078,31 +2316,73 @@ class Insert(BaseQuery):
         self._raw_sql_flag = _raw_sql_flag
         super(Insert, self).__init__()
 
-    def _execute(self, sql):
+    def _generate(self, rows):
+        """Fills the key of the `rows` without one from the generator of
+        the table, returns the keys of all the rows, or None when the
+        table has no generator."""
+        generator = self.database._id_generator(self.tablename)
+        if generator is None:
+            return None
+        column, ids = generator
+        missing = [row for row in rows if column not in row]
+        if missing:
+            for row, id in zip(missing, ids.next_ids(len(missing))):
+                row[column] = id
+        return [row[column] for row in rows]
+
+    def _execute(self, sql, generated=None, count=None):
+        """
+        :param generated: the keys filled by `_generate`, returned for
+            `seqname` instead of asking the database.
+        :param count: the rows of a multiple insert, whose ids are
+            returned for `seqname`.
+        """
         db_cursor, conn = self._db_cursor()
-        if self.seqname:
-            sql = self.database._process_insert_query(sql, self.tablename,
-                                                      self.seqname)
-
-        if isinstance(sql, tuple):
-            # for some databases, a separate query has to be made to find
-            # the id of the inserted row.
-            q1, q2 = sql
-            result = self.database._db_execute(db_cursor, q1)
-            self.database._db_execute(db_cursor, q2)
-        else:
-            result = self.database._db_execute(db_cursor, sql)
-
         try:
-            out = db_cursor.fetchone()[0]
-        except Exception:
-            out = result
+            if self.seqname and generated is None:
+                sql = self.database._process_insert_query(sql, self.tablename,
+                                                          self.seqname)
+
+            if isinstance(sql, tuple):
+                # for some databases, a separate query has to be made to find
+                # the id of the inserted row.
+                q1, q2 = sql
+                result = self.database._db_execute(db_cursor, q1)
+                self.database._db_execute(db_cursor, q2)
+            else:
+                result = self.database._db_execute(db_cursor, sql)
 
-        if not self.database.ctx.transactions:
-            if self.database.pool:
-                conn.commit()
+            if generated is not None and self.seqname:
+                out = generated
+            elif self.seqname:
+                try:
+                    out = self.database._insert_ids(db_cursor, count)
+                except Exception:
+                    if count is not None:
+                        raise
+                    out = result
             else:
-                self.database.ctx.commit()
+                try:
+                    out = db_cursor.fetchone()[0]
+                except Exception:
+                    out = result
+        except Exception:
+            # e.g. the ids of a multiple insert are unknown: the rows
+            # are not kept, and the connection goes back clean.
+            if not self.database.ctx.transactions:
+                if self.database.pool:
+                    conn.rollback()
+                else:
+                    self.database.ctx.rollback()
+            raise
+        else:
+            if not self.database.ctx.transactions:
+                if self.database.pool:
+                    conn.commit()
+                else:
+                    self.database.ctx.commit()
+        finally:
+            self._cursor_close(db_cursor, conn)
         return out
 
     def insert(self, ignore=None, **values):
@@ -1112,7 +2392,9 @@ class Insert(BaseQuery):
         def q(x):
             return "(" + x + ")"
 
+        generated = None
         if values:
+            generated = self._generate([values])
             #needed for Py3 compatibility with the above doctests
             sorted_values = sorted(values.items(), key=lambda t: t[0])
 
@@ -1134,7 +2416,8 @@ class Insert(BaseQuery):
         if self._test or self._raw_sql_flag:
             return sql_query
 
-        return self._execute(sql_query)
+        key = None if generated is None else generated[0]
+        return self._execute(sql_query, key)
 
     def insert_duplicate_update(self, where=None, vars=None, **values):
         if not where:
@@ -1176,6 +2459,10 @@ class Insert(BaseQuery):
             else:
                 return out
 
+        if self.database._id_generator(self.tablename) is not None:
+            values = [dict(row) for row in values]
+        generated = self._generate(values)
+
         keys = values[0].keys()
         #@@ make sure all keys are valid
 
@@ -1201,10 +2488,7 @@ class Insert(BaseQuery):
         if self._test or self._raw_sql_flag:
             return sql_query
 
-        out = self._execute(sql_query)
-        if self.seqname:
-            out = range(out - len(values) + 1, out + 1)
-        return out
+        return self._execute(sql_query, generated, len(values))
 
 
 class Update(BaseQuery):
@@ -1274,6 +2558,7 @@ class MetaData(BaseQuery):
         self._offset = None
         self._join_type = None
         self._join_expression = None
+        self._row_factory = None
         self._test = _test
         super(MetaData, self).__init__()
         try:
@@ -1329,7 +2614,7 @@ class MetaData(BaseQuery):
 
         return xjoin(sql, nout)
 
-    def _query(self, vars=None, _raw_sql_flag=False):
+    def _query(self, vars=None, _raw_sql_flag=False, **kwargs):
         sql_clauses = self._sql_clauses(self._what, self._tables, self._where,
                                         self._group, self._order, self._limit,
                                         self._offset, self._join_type,
@@ -1341,17 +2626,71 @@ class MetaData(BaseQuery):
         qout = SQLQuery.join(clauses)
         if self._test or _raw_sql_flag:
             return qout
-        return self.database.query(qout, processed=True)
+        kwargs.setdefault("row_factory", self._row_factory)
+        return self.database.query(qout, processed=True, **kwargs)
 
     def query(self, _raw_sql_flag=False):
         return self._query(_raw_sql_flag=_raw_sql_flag)
 
-    def first(self):
-        query_result = self._query()
+    def clone(self):
+        """Returns a copy that can be changed without affecting this one.
+        """
+        other = copy.copy(self)
+        if isinstance(self._where, SQLQuery):
+            other._where = SQLQuery(self._where)
+        elif isinstance(self._where, dict):
+            other._where = dict(self._where)
+        return other
+
+    def compile(self, limit=None, offset=None):
+        """Freezes the query into a `CompiledSelect`, `limit` and `offset`
+        may be values or `bindparam` placeholders."""
+        metadata = self.clone()
+        if limit is not None:
+            metadata._limit = limit
+        if offset is not None:
+            metadata._offset = offset
+        return CompiledSelect(self.database,
+                              metadata._query(_raw_sql_flag=True),
+                              self._row_factory)
+
+    def first(self, hedge=None):
+        """Returns the first row or None, `hedge` overrides the handle's
+        `hedge` option."""
+        if hedge is None:
+            hedge = self.database.hedge
+        query_result = self._query(hedge=hedge)
         return query_result[0] if query_result else None
 
-    def all(self):
-        return self._query()
+    def all(self, memory_limit=None, memory_policy=None):
+        return self._query(memory_limit=memory_limit,
+                           memory_policy=memory_policy)
+
+    def stream(self, batch_size=1000):
+        """Returns the rows as an `IterBetter` read from a server side
+        cursor, `batch_size` rows at a time."""
+        return self._query(stream=True, batch_size=batch_size)
+
+    def columns(self, batch_size=10000, dtypes=None):
+        """Returns the result as a dict of one NumPy array per column."""
+        return self.database.columns(self._query(_raw_sql_flag=True),
+                                     processed=True,
+                                     batch_size=batch_size,
+                                     dtypes=dtypes)
+
+    def dataframe(self, batch_size=10000, dtypes=None):
+        """Returns the result as a pandas DataFrame, built from
+        `columns`."""
+        return to_dataframe(self.columns(batch_size, dtypes))
+
+    def export(self, path, format="csv", **kwargs):
+        """Writes the result to a csv, jsonl or parquet file, see
+        `DB.export`."""
+        return self.database.export(self._query(_raw_sql_flag=True),
+                                    path,
+                                    processed=True,
+                                    format=format,
+                                    **kwargs)
 
     def order_by(self, order_vars, _reversed=False):
         """Order by syntax
@@ -1405,9 +2744,11 @@ class Select(object):
                  tables,
                  fields=None,
                  _raw_sql_flag=False,
-                 distinct=False):
+                 distinct=False,
+                 row_factory=None):
         self.distinct = distinct
         self._metadata = MetaData(database, tables)
+        self._metadata._row_factory = row_factory
         self._metadata._what = self._what_fields(self._metadata.cur_table,
                                                  fields)
         self._raw_sql_flag = _raw_sql_flag
@@ -1446,21 +2787,41 @@ class Select(object):
             self._metadata._where = kwargs.get("where")
         else:
             self._metadata._where = kwargs
-        return self._metadata._query()
+        return self._metadata._query(hedge=self._metadata.database.hedge)
 
-    def all(self):
-        return self._metadata._query()
+    def all(self, memory_limit=None, memory_policy=None):
+        """
+        Returns every row.
+        :param memory_limit: an optional byte budget for this result, see
+            `DB.query`.
+        :param memory_policy: "raise" or "spill" past the budget.
+        """
+        return self._metadata.all(memory_limit, memory_policy)
 
     def count(self, distinct=None, **kwargs):
+        # count on a copy, so the select can still be used for rows.
+        select = self.clone()
         if "where" in kwargs and kwargs.get("where"):
-            self._metadata._where = kwargs.get("where")
+            select._metadata._where = kwargs.get("where")
         else:
-            self._opt_where(OP.EQ, **kwargs)
+            select._opt_where(OP.EQ, **kwargs)
         count_str = "COUNT(DISTINCT {}.{})".format(
-            self._metadata.cur_table, distinct) if distinct else "COUNT(*)"
-        self._metadata._what = count_str + " AS COUNT"
-        query_result = self._metadata._query()
-        return query_result[0]["COUNT"]
+            select._metadata.cur_table, distinct) if distinct else "COUNT(*)"
+        select._metadata._what = count_str + " AS COUNT"
+        query_result = select._metadata._query(row_factory="tuple")
+        return query_result[0][0]
+
+    def clone(self):
+        """Returns a copy of the select, for branching variants of a
+        common chain."""
+        other = copy.copy(self)
+        other._metadata = self._metadata.clone()
+        return other
+
+    def compile(self, limit=None, offset=None):
+        """Freezes the select into a `CompiledSelect` that runs with
+        `stmt.execute(**params)` for its `bindparam` placeholders."""
+        return self._metadata.compile(limit, offset)
 
     def distinct(self):
         self.distinct = True
@@ -1500,8 +2861,8 @@ class Select(object):
                 raise ValueError(
                     "between param must be list object and length equal 2.")
             where_clauses.append(
-                "{}.{}".format(self._metadata.cur_table, k) +
-                " BETWEEN {} AND {} ".format(sqlquote(v[0]), sqlquote(v[1])))
+                "{}.{} BETWEEN ".format(self._metadata.cur_table, k) +
+                sqlquote(v[0]) + " AND " + sqlquote(v[1]) + " ")
         if not where_clauses:
             return self
         between_expression = SQLQuery.join(where_clauses, add_space(OP.AND))
@@ -1516,8 +2877,8 @@ class Select(object):
         for k, v in kwargs.items():
             if not isinstance(v, list):
                 raise ValueError("param must be list object")
-            where_clauses.append("{}.{}".format(self._metadata.cur_table, k) +
-                                 " {} {} ".format(OP.IN, sqlquote(v)))
+            where_clauses.append("{}.{} {} ".format(
+                self._metadata.cur_table, k, OP.IN) + sqlquote(v) + " ")
         if not where_clauses:
             return self
         in_expression = SQLQuery.join(where_clauses, add_space(OP.AND))
@@ -1532,8 +2893,8 @@ class Select(object):
         for k, v in kwargs.items():
             if not isinstance(v, list):
                 raise ValueError("param must be list object")
-            where_clauses.append("{}.{}".format(self._metadata.cur_table, k) +
-                                 " {} {} ".format(OP.NOT_IN, sqlquote(v)))
+            where_clauses.append("{}.{} {} ".format(
+                self._metadata.cur_table, k, OP.NOT_IN) + sqlquote(v) + " ")
         if not where_clauses:
             return self
         in_expression = SQLQuery.join(where_clauses, add_space(OP.AND))
@@ -1543,8 +2904,20 @@ class Select(object):
             self._metadata._where = in_expression
         return self
 
-    def first(self):
-        return self._metadata.first()
+    def first(self, hedge=None):
+        return self._metadata.first(hedge)
+
+    def stream(self, batch_size=1000):
+        return self._metadata.stream(batch_size)
+
+    def columns(self, batch_size=10000, dtypes=None):
+        return self._metadata.columns(batch_size, dtypes)
+
+    def dataframe(self, batch_size=10000, dtypes=None):
+        return self._metadata.dataframe(batch_size, dtypes)
+
+    def export(self, path, format="csv", **kwargs):
+        return self._metadata.export(path, format, **kwargs)
 
     def query(self):
         return self._metadata.query(self._raw_sql_flag)
@@ -1613,8 +2986,11 @@ class Table(object):
         return Update(self.database, self.tables,
                       test).update(where, vars, **values)
 
-    def select(self, fields=None):
-        return Select(self.database, self.tables, fields)
+    def select(self, fields=None, row_factory=None):
+        return Select(self.database,
+                      self.tables,
+                      fields,
+                      row_factory=row_factory)
 
     def delete(self, where, using=None, vars=None, test=False):
         return Delete(self.database, self.tables,
@@ -1624,15 +3000,45 @@ class Table(object):
 class MySQLDB(DB):
     """MySQLDB class, about importing mysqldb module and
     and the required parameters."""
+    # the step between two auto-increment ids, see `_insert_ids`.
+    _auto_increment_increment = None
+
     def __init__(self,
                  maxcached=0,
                  mincached=0,
                  maxshared=0,
                  maxconnections=0,
                  maxusage=0,
+                 blocking=False,
                  pool=False,
                  autocommit=False,
                  reset=False,
+                 prepared=False,
+                 statement_cache_size=64,
+                 query_log=None,
+                 row_factory=None,
+                 memory_limit=None,
+                 memory_policy=None,
+                 spill_dir=None,
+                 pool_events=None,
+                 ping_idle=None,
+                 maintenance_interval=None,
+                 max_idle=None,
+                 idle_timeout=60,
+                 after_fork=None,
+                 replicas=None,
+                 read_your_writes=2,
+                 replica_gtid=False,
+                 max_replica_lag=None,
+                 replica_check_interval=5,
+                 eject_errors=3,
+                 eject_spike=5,
+                 eject_time=10,
+                 hedge=False,
+                 hedge_delay=None,
+                 hedge_budget=0.05,
+                 hedge_workers=8,
+                 id_generators=None,
                  **params):
         db = import_driver(["MySQLdb", "pymysql", "mysql.connector"],
                            preferred=params.pop('driver', None))
@@ -1656,12 +3062,64 @@ class MySQLDB(DB):
                     maxshared=maxshared,
                     maxconnections=maxconnections,
                     maxusage=maxusage,
+                    blocking=blocking,
                     autocommit=autocommit,
-                    reset=reset)
+                    reset=reset,
+                    prepared=prepared,
+                    statement_cache_size=statement_cache_size,
+                    query_log=query_log,
+                    row_factory=row_factory,
+                    memory_limit=memory_limit,
+                    memory_policy=memory_policy,
+                    spill_dir=spill_dir,
+                    pool_events=pool_events,
+                    ping_idle=ping_idle,
+                    maintenance_interval=maintenance_interval,
+                    max_idle=max_idle,
+                    idle_timeout=idle_timeout,
+                    after_fork=after_fork,
+                    replicas=replicas,
+                    read_your_writes=read_your_writes,
+                    replica_gtid=replica_gtid,
+                    max_replica_lag=max_replica_lag,
+                    replica_check_interval=replica_check_interval,
+                    eject_errors=eject_errors,
+                    eject_spike=eject_spike,
+                    eject_time=eject_time,
+                    hedge=hedge,
+                    hedge_delay=hedge_delay,
+                    hedge_budget=hedge_budget,
+                    hedge_workers=hedge_workers,
+                    id_generators=id_generators)
         self.supports_multiple_insert = True
 
-    def _process_insert_query(self, query, tablename, seqname):
-        return query, SQLQuery('SELECT last_insert_id();')
+    def _insert_ids(self, cursor, count=None):
+        """
+        Returns the ids from `cursor.lastrowid`, sent back with the result
+        of the insert itself, instead of a `SELECT last_insert_id()`. A
+        multiple insert gets consecutive ids from the first one, which is
+        the lastrowid, spaced by `@@auto_increment_increment` (read once
+        per handle).
+        """
+        first = cursor.lastrowid
+        if count is None:
+            return first
+        if not first:
+            # the rows had their ids, none was generated.
+            return None
+        if cursor.rowcount != count:
+            raise ValueError("inserted %d rows out of %d, their ids are "
+                             "unknown." % (cursor.rowcount, count))
+        increment = self._auto_increment_increment
+        if increment is None:
+            self._db_execute(cursor,
+                             SQLQuery("SELECT @@auto_increment_increment"))
+            increment = int(cursor.fetchone()[0])
+            if increment < 1:
+                raise ValueError("bad auto_increment_increment: %d" %
+                                 increment)
+            self._auto_increment_increment = increment
+        return range(first, first + count * increment, increment)
 
     def _get_insert_default_values_query(self, table):
         return "INSERT INTO %s () VALUES()" % table
@@ -32,3 +32,28 @@ class _ItplError(ValueError):
     def __str__(self):
         return "unfinished expression in %s at char %d" % (repr(self.text),
                                                            self.pos)
+
+
+class MemoryLimitExceeded(MemoryError):
+    """raised when a result set grows past its memory budget"""
+    def __init__(self, nbytes, limit, rows):
+        MemoryError.__init__(self)
+        self.nbytes = nbytes
+        self.limit = limit
+        self.rows = rows
+
+    def __str__(self):
+        return "result set of %d rows exceeds the memory limit: " \
+               "%d > %d bytes" % (self.rows, self.nbytes, self.limit)
+
+
+class ClockMovedBackwards(RuntimeError):
+    """raised by a Snowflake id generator when the clock went back further
+    than it may wait"""
+    def __init__(self, milliseconds):
+        RuntimeError.__init__(self)
+        self.milliseconds = milliseconds
+
+    def __str__(self):
+        return "the clock moved backwards by %d ms, refusing to generate " \
+               "ids" % self.milliseconds
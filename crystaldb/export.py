@@ -0,0 +1,239 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Export of query results to csv, jsonl or parquet files, written batch
+#   by batch from the cursor so the result is never held in memory.
+#   pyarrow is needed for parquet only.
+# ***********************************************************************
+
+import io
+import csv
+import json
+import gzip
+import time
+import decimal
+import binascii
+import datetime
+from .config import FIELD_TYPE, FIELD_FLAG, BINARY_CHARSET
+from .utils import column_flags
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+__all__ = ["export_cursor", "FORMATS"]
+
+FORMATS = ("csv", "jsonl", "parquet")
+
+# the type codes shared by text and binary strings.
+_STRING_CODES = (FIELD_TYPE.VARCHAR, FIELD_TYPE.VAR_STRING, FIELD_TYPE.STRING,
+                 FIELD_TYPE.TINY_BLOB, FIELD_TYPE.MEDIUM_BLOB,
+                 FIELD_TYPE.LONG_BLOB, FIELD_TYPE.BLOB, FIELD_TYPE.BIT,
+                 FIELD_TYPE.GEOMETRY)
+
+
+def _binary(type_code, flags, charset):
+    """True for a binary string column, False for any other one, and None
+    for a string column of a driver telling neither flags nor charset."""
+    if type_code not in _STRING_CODES and type_code is not None:
+        return False
+    elif charset is not None:
+        return charset == BINARY_CHARSET
+    elif flags is not None:
+        return bool(flags & FIELD_FLAG.BINARY)
+    return None
+
+
+def _json_default(obj):
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    elif isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    elif isinstance(obj, decimal.Decimal):
+        return str(obj)
+    elif isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8", "replace")
+    return str(obj)
+
+
+def _open_text(path, compression):
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return io.open(path, "w", encoding="utf-8", newline="")
+
+
+def _hex(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return binascii.hexlify(value).decode("ascii")
+    return value
+
+
+class _CSVWriter(object):
+    """Binary strings are written hex encoded."""
+    def __init__(self, path, names, description, flags, compression):
+        self.f = _open_text(path, compression)
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(names)
+        self.binary = [
+            i for i, (d, (flag, charset)) in enumerate(zip(description, flags))
+            if _binary(d[1], flag, charset) is not False
+        ]
+
+    def write(self, rows):
+        if self.binary:
+            rows = [self._encode(row) for row in rows]
+        self.writer.writerows(rows)
+
+    def _encode(self, row):
+        row = list(row)
+        for i in self.binary:
+            row[i] = _hex(row[i])
+        return row
+
+    def close(self):
+        self.f.close()
+
+
+class _JSONLWriter(object):
+    def __init__(self, path, names, description, flags, compression):
+        self.f = _open_text(path, compression)
+        self.names = names
+        # one encoder for every row, json.dumps builds one per call.
+        self.encode = json.JSONEncoder(default=_json_default,
+                                       ensure_ascii=False).encode
+
+    def write(self, rows):
+        names, encode = self.names, self.encode
+        self.f.write("".join(
+            encode(dict(zip(names, row))) + "\n" for row in rows))
+
+    def close(self):
+        self.f.close()
+
+
+def _arrow_type(type_code, precision, scale, binary, values):
+    """Returns the arrow type of a column, from its type code and, for the
+    string and blob codes shared by text and binary, the `binary` flag of
+    `_binary`. Only a driver telling neither the type code nor the flags
+    has the type guessed from the values."""
+    if type_code in (FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG,
+                     FIELD_TYPE.INT24, FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR):
+        return pyarrow.int64()
+    elif type_code in (FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE):
+        return pyarrow.float64()
+    elif type_code in (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL) and \
+            precision:
+        return pyarrow.decimal128(min(precision, 38), scale or 0)
+    elif type_code in (FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP):
+        return pyarrow.timestamp("us")
+    elif type_code in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE):
+        return pyarrow.date32()
+    elif type_code == FIELD_TYPE.TIME:
+        return pyarrow.duration("us")
+    elif binary is not None:
+        return pyarrow.binary() if binary else pyarrow.string()
+    for value in values:
+        if value is None:
+            continue
+        elif isinstance(value, (bytes, bytearray)):
+            return pyarrow.binary()
+        elif type_code is None and isinstance(value, int):
+            # drivers without type codes.
+            return pyarrow.int64()
+        elif type_code is None and isinstance(value, float):
+            return pyarrow.float64()
+        return pyarrow.string()
+    return pyarrow.string()
+
+
+class _ParquetWriter(object):
+    def __init__(self, path, names, description, flags, compression):
+        if pyarrow is None:
+            raise ImportError("pyarrow is required for parquet export.")
+        self.path = path
+        self.names = names
+        self.description = description
+        self.binary = [
+            _binary(d[1], flag, charset)
+            for d, (flag, charset) in zip(description, flags)
+        ]
+        self.compression = compression or "snappy"
+        self.writer = None
+
+    def _open(self, columns):
+        # the schema is fixed by the first batch, whose values only matter
+        # to drivers without type codes or column flags.
+        schema = pyarrow.schema([
+            (name, _arrow_type(d[1], d[4], d[5], binary, values))
+            for name, d, binary, values in zip(self.names, self.description,
+                                               self.binary, columns)
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(
+            self.path, schema, compression=self.compression)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        if self.writer is None:
+            self._open(columns)
+        schema = self.writer.schema
+        arrays = [
+            pyarrow.array(values, type=schema.field(i).type)
+            for i, values in enumerate(columns)
+        ]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays,
+                                                          schema=schema))
+
+    def close(self):
+        if self.writer is None:
+            # no rows, still write a file with the schema.
+            self._open([()] * len(self.names))
+        self.writer.close()
+
+
+_WRITERS = dict(csv=_CSVWriter, jsonl=_JSONLWriter, parquet=_ParquetWriter)
+
+
+def export_cursor(cursor,
+                  path,
+                  format="csv",
+                  batch_size=10000,
+                  compression=None,
+                  progress=None):
+    """
+    Writes every row left in an executed `cursor` to `path`, `batch_size`
+    rows at a time.
+    :param format: "csv" (with a header line), "jsonl" or "parquet".
+    :param compression: "gzip", or None. Paths ending with ".gz" are
+        gzipped. Parquet files use their own codec ("snappy" by default).
+    :param progress: optional callable `progress(rows, seconds)` called
+        after every batch.
+    :return : the number of rows written.
+    """
+    if format not in _WRITERS:
+        raise ValueError("unknown export format: %s" % format)
+    if not cursor.description:
+        raise ValueError("the query returned no result set.")
+    if compression is None and format != "parquet" and \
+            str(path).endswith(".gz"):
+        compression = "gzip"
+    names = [x[0] for x in cursor.description]
+    writer = _WRITERS[format](path, names, cursor.description,
+                              column_flags(cursor), compression)
+    start = time.time()
+    count = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            writer.write(rows)
+            count += len(rows)
+            if progress is not None:
+                progress(count, time.time() - start)
+    finally:
+        writer.close()
+    return count
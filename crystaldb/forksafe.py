@@ -0,0 +1,126 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Fork safety. A forked child shares the sockets of the connections it
+#   inherits with its parent, so it must neither use nor close them: a
+#   QUIT or ROLLBACK sent by the child lands on the parent's session.
+#   Handles are reset in the child by an `os.register_at_fork` hook, and
+#   the inherited sockets are pointed at /dev/null before the connection
+#   objects are dropped. Connections also record the pid that opened
+#   them, so one freed in the child before the hook runs (the other
+#   threads' thread-locals go first) is dropped the same way.
+# ***********************************************************************
+
+import os
+import weakref
+import traceback
+import threading
+
+__all__ = ["register", "own", "inherited", "detach", "unwrap", "HOOKED"]
+
+# without `os.register_at_fork` (python < 3.7), the handles compare their
+# pid instead.
+HOOKED = hasattr(os, "register_at_fork")
+_handles = weakref.WeakSet()
+_lock = threading.Lock()
+_hooked = []
+
+# inherited connections whose socket could not be found. They are kept
+# alive so that their destructor never sends anything.
+_orphans = []
+
+
+def unwrap(conn):
+    """Returns the driver connection under the DBUtils wrappers."""
+    seen = 0
+    while getattr(conn, '_con', None) is not None and seen < 4:
+        conn = conn._con
+        seen += 1
+    return conn
+
+
+def own(conn):
+    """Records the process that opened `conn`, see `inherited`. Driver
+    connections without a `__dict__` (e.g. sqlite3) are left alone."""
+    try:
+        conn._crystaldb_pid = os.getpid()
+    except (AttributeError, TypeError):
+        pass
+    return conn
+
+
+def inherited(conn):
+    """True when `conn` was opened by another process, i.e. it came from
+    the parent through fork."""
+    pid = getattr(conn, '_crystaldb_pid', None)
+    return pid is not None and pid != os.getpid()
+
+
+def _fileno(conn):
+    try:
+        # MySQLdb
+        return conn.fileno()
+    except Exception:
+        pass
+    for path in (("_sock", ), ("_socket", "sock")):
+        # pymysql, mysql.connector
+        sock = conn
+        for name in path:
+            sock = getattr(sock, name, None)
+        try:
+            return sock.fileno()
+        except Exception:
+            pass
+    return None
+
+
+def detach(conn):
+    """
+    Drops a connection inherited through fork without touching the
+    parent's session: its socket is replaced by /dev/null in this process,
+    so closing it sends nothing to the server.
+    """
+    raw = unwrap(conn)
+    fd = _fileno(raw)
+    if fd is None or fd < 0:
+        _orphans.append(conn)
+        return
+    devnull = os.open(os.devnull, os.O_RDWR)
+    try:
+        os.dup2(devnull, fd)
+    finally:
+        os.close(devnull)
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+
+def _after_fork_child():
+    handles = list(_handles)
+    for database in handles:
+        try:
+            database._after_fork()
+        except Exception:
+            pass
+    # the warm up hooks, once every handle is reset.
+    for database in handles:
+        if database.after_fork is not None:
+            try:
+                database.after_fork(database)
+            except Exception:
+                traceback.print_exc()
+
+
+def register(database):
+    """Resets `database` in every child forked from now on."""
+    _handles.add(database)
+    if _hooked or not HOOKED:
+        return
+    with _lock:
+        if not _hooked:
+            os.register_at_fork(after_in_child=_after_fork_child)
+            _hooked.append(True)
+
@@ -0,0 +1,225 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Hedged reads. A point read runs on a replica from a worker thread; if
+#   it has not answered within the hedge delay (the observed p95, or a
+#   fixed delay), the same read goes to a second replica. The first answer
+#   wins and the other statement is cancelled with `KILL QUERY`. A token
+#   budget caps the extra reads to a fraction of the hedgeable ones.
+# ***********************************************************************
+
+import time
+import threading
+from collections import deque
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+from .forksafe import unwrap
+
+__all__ = ["Hedger", "HedgeTask"]
+
+
+def _thread_id(conn):
+    """Returns the server connection id of `conn`, or None."""
+    raw = unwrap(conn)
+    try:
+        # MySQLdb, pymysql
+        return raw.thread_id()
+    except Exception:
+        # mysql.connector
+        return getattr(raw, "connection_id", None)
+
+
+class HedgeTask(object):
+    """One read of a hedged call on one replica. `conn_id` is set while
+    its statement runs, under `lock`, so that a cancel never reaches the
+    next statement of the connection."""
+    __slots__ = ["replica", "lock", "conn_id", "killed"]
+
+    def __init__(self, replica):
+        self.replica = replica
+        self.lock = threading.Lock()
+        self.conn_id = None
+        self.killed = False
+
+    def running(self, conn):
+        with self.lock:
+            self.conn_id = _thread_id(conn)
+
+    def finished(self):
+        with self.lock:
+            self.conn_id = None
+
+    def cancel(self):
+        with self.lock:
+            if self.conn_id is None:
+                return False
+            self.killed = True
+            try:
+                self.replica.database.query("KILL QUERY %d" % self.conn_id)
+            except Exception:
+                pass
+            return True
+
+
+class _Call(object):
+    """The reads of one hedged call, done on the first answer or once
+    every read failed."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.tasks = []
+        self.pending = 0
+        self.winner = None
+        self.result = None
+        self.error = None
+
+    def finish(self, task, result, error):
+        with self.lock:
+            self.pending -= 1
+            if self.done.is_set():
+                return
+            if error is None:
+                self.winner, self.result = task, result
+                self.done.set()
+            else:
+                self.error = self.error or error
+                if not self.pending:
+                    self.done.set()
+
+
+class Hedger(object):
+    """
+    Runs hedged reads on `workers` daemon threads, which keep their own
+    connections to the replicas. A read finds no free worker runs
+    unhedged in the calling thread, so hedging never queues.
+    :param delay: the seconds before the second read, the default None
+        uses the p95 of the recent reads (no hedging before 20 reads).
+    :param budget: the extra reads allowed per hedgeable read, 0.05 is at
+        most 5% more reads.
+    """
+    window = 1000
+    min_samples = 20
+
+    def __init__(self, workers=8, delay=None, budget=0.05):
+        self.workers = workers
+        self.delay = delay
+        self.budget = budget
+        self.reads = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.cancelled = 0
+        self._latencies = deque(maxlen=self.window)
+        self._p95 = None
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(workers)
+        self._queue = Queue()
+        self._threads = []
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                                          name="crystaldb-hedge-%d" % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job, args = self._queue.get()
+            try:
+                job(*args)
+            except Exception:
+                pass
+
+    def _run(self, call, task, fetch):
+        try:
+            result, error = fetch(task.replica, task), None
+        except Exception as e:
+            result, error = None, e
+        finally:
+            self._slots.release()
+        call.finish(task, result, error)
+
+    def _submit(self, call, replica, fetch):
+        task = HedgeTask(replica)
+        with call.lock:
+            call.tasks.append(task)
+            call.pending += 1
+        self._queue.put((self._run, (call, task, fetch)))
+
+    def _cancel(self, task):
+        if task.cancel():
+            with self._lock:
+                self.cancelled += 1
+
+    def _record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            count = len(self._latencies)
+            if count >= self.min_samples and \
+                    (self._p95 is None or count % 50 == 0):
+                latencies = sorted(self._latencies)
+                self._p95 = latencies[int(count * 0.95) - 1]
+
+    def hedge_delay(self):
+        """The seconds to wait before hedging, None while unknown."""
+        return self.delay if self.delay is not None else self._p95
+
+    def _take_token(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.hedged += 1
+                return True
+            return False
+
+    def read(self, first, second, fetch):
+        """
+        Returns `fetch(replica, task)` from `first`, or from `second` when
+        `first` is slower than the hedge delay and the budget allows it.
+        """
+        with self._lock:
+            self.reads += 1
+            self._tokens = min(self._tokens + self.budget, 10.0)
+        start = time.time()
+        delay = self.hedge_delay()
+        if delay is None or second is None or not self._slots.acquire(False):
+            result = fetch(first, None)
+            self._record(time.time() - start)
+            return result
+        self._start()
+        call = _Call()
+        self._submit(call, first, fetch)
+        if not call.done.wait(delay) and self._slots.acquire(False):
+            if self._take_token():
+                self._submit(call, second, fetch)
+            else:
+                self._slots.release()
+        call.done.wait()
+        self._record(time.time() - start)
+        if call.winner is None:
+            raise call.error
+        if call.winner.replica is second:
+            with self._lock:
+                self.hedge_wins += 1
+        for task in call.tasks:
+            if task is not call.winner:
+                # from a worker, the caller does not wait for the kill.
+                self._queue.put((self._cancel, (task, )))
+        return call.result
+
+    def snapshot(self):
+        with self._lock:
+            return dict(reads=self.reads,
+                        hedged=self.hedged,
+                        hedge_wins=self.hedge_wins,
+                        cancelled=self.cancelled,
+                        delay=self.hedge_delay())
@@ -0,0 +1,233 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Client-side id generation. `Snowflake` builds 64-bit ids from the
+#   time, a worker id and a sequence, with no database at all; `HiLo`
+#   takes blocks of ids from a sequence table, one UPDATE per block. Both
+#   are unique across sharded tables, and with the `id_generators` option
+#   of a handle, inserts fill their key from them, so the ids are known
+#   without asking the database.
+# ***********************************************************************
+
+import time
+import threading
+from .db import BaseQuery, reparam
+from .exception import ClockMovedBackwards
+
+__all__ = ["Snowflake", "HiLo"]
+
+
+class Snowflake(object):
+    """
+    Time ordered 64-bit ids: milliseconds since `epoch`, then the worker
+    id, then a sequence within the millisecond. Every process generating
+    ids at the same time needs its own worker id.
+    :param worker_id: the id of this generator, below 2 ** worker_bits.
+    :param worker_bits: the bits of the worker id (the default 10 is 1024
+        workers).
+    :param sequence_bits: the bits of the sequence (the default 12 is 4096
+        ids per millisecond and worker).
+    :param epoch: the start of the time, in milliseconds since 1970 (the
+        default is 2020-01-01). With 10 and 12 bits, 41 bits of time last
+        69 years.
+    :param max_backwards: the seconds the generator waits when the clock
+        moves backwards (e.g. an NTP step); further back, it raises
+        `ClockMovedBackwards` instead of risking a duplicate id.
+    :example:
+        ids = Snowflake(worker_id=3)
+        db_handle = crystaldb.database(dbn="mysql", ...,
+                                       id_generators={"user": ("id", ids)})
+    """
+    def __init__(self,
+                 worker_id,
+                 worker_bits=10,
+                 sequence_bits=12,
+                 epoch=1577836800000,
+                 max_backwards=0.01):
+        if worker_bits + sequence_bits > 22:
+            raise ValueError("worker_bits + sequence_bits must be at most "
+                             "22, leaving 41 bits of time.")
+        if not 0 <= worker_id < 1 << worker_bits:
+            raise ValueError("worker_id must be in [0, %d)." %
+                             (1 << worker_bits))
+        self.worker_id = worker_id
+        self.worker_bits = worker_bits
+        self.sequence_bits = sequence_bits
+        self.epoch = epoch
+        self.max_backwards = max_backwards
+        self._time_shift = worker_bits + sequence_bits
+        self._worker = worker_id << sequence_bits
+        self._sequence_mask = (1 << sequence_bits) - 1
+        self._last = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _now(self):
+        return int(time.time() * 1000)
+
+    def _next(self):
+        now = self._now()
+        if now < self._last:
+            behind = self._last - now
+            if behind > self.max_backwards * 1000:
+                raise ClockMovedBackwards(behind)
+            while now < self._last:
+                time.sleep((self._last - now) / 1000.0)
+                now = self._now()
+        if now == self._last:
+            self._sequence = (self._sequence + 1) & self._sequence_mask
+            if not self._sequence:
+                # the sequence of this millisecond is used up.
+                while now <= self._last:
+                    now = self._now()
+        else:
+            self._sequence = 0
+        self._last = now
+        return (now - self.epoch) << self._time_shift | self._worker | \
+            self._sequence
+
+    def next_id(self):
+        with self._lock:
+            return self._next()
+
+    def next_ids(self, count):
+        with self._lock:
+            return [self._next() for _ in range(count)]
+
+    def decode(self, id):
+        """Returns (milliseconds since 1970, worker id, sequence) of an
+        id."""
+        return ((id >> self._time_shift) + self.epoch,
+                id >> self.sequence_bits & (1 << self.worker_bits) - 1,
+                id & self._sequence_mask)
+
+
+class _LastId(BaseQuery):
+    """Runs one statement, returns its `cursor.lastrowid`, or None when it
+    changed no row."""
+    def __init__(self, database):
+        self.database = database
+        BaseQuery.__init__(self)
+
+    def _execute(self, sql, vars):
+        database = self.database
+        db_cursor, conn = self._db_cursor()
+        try:
+            database._db_execute(db_cursor, reparam(sql, vars))
+            out = db_cursor.lastrowid if db_cursor.rowcount else None
+            if not database.autocommit and not database.ctx.transactions:
+                if database.pool:
+                    conn.commit()
+                else:
+                    database.ctx.commit()
+        finally:
+            self._cursor_close(db_cursor, conn)
+        return out
+
+
+class HiLo(object):
+    """
+    Ids taken in blocks of `block` from a row of a sequence table:
+        CREATE TABLE crystaldb_sequence (
+            name VARCHAR(64) NOT NULL PRIMARY KEY,
+            next_id BIGINT NOT NULL)
+    One UPDATE moves `next_id` past the block, the ids of the block are
+    then handed out from memory. The ids are unique, not gapless: the
+    rest of a block is lost when the process stops.
+    :param database: the handle of the sequence table. The blocks are
+        taken on a connection of their own, so a rollback of the caller's
+        transaction never gives back a block already handed out.
+    :param name: the sequence, one row of the table.
+    :param block: the ids per UPDATE.
+    :param start: the first id of a new sequence.
+    :example:
+        ids = HiLo(db_handle, "user", block=1000)
+        ids.next_ids(3)         # [1, 2, 3]
+    """
+    def __init__(self,
+                 database,
+                 name,
+                 block=1000,
+                 table="crystaldb_sequence",
+                 start=1):
+        if block < 1:
+            raise ValueError("block must be positive.")
+        self.database = database
+        self.name = name
+        self.block = block
+        self.table = table
+        self.start = start
+        self.blocks = 0
+        self._sequence_handle = None
+        self._next = self._high = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, count):
+        """Moves the sequence past `count` ids, returns the new next_id,
+        or None when the sequence has no row yet."""
+        database = self._handle()
+        vars = dict(name=self.name, count=count)
+        if getattr(database, "dbname", None) == "mysql":
+            # LAST_INSERT_ID(expr) hands the new value back with the
+            # UPDATE itself, as the insert id of the statement.
+            return _LastId(database)._execute(
+                "UPDATE %s SET next_id = LAST_INSERT_ID(next_id + $count) "
+                "WHERE name = $name" % self.table, vars)
+        with database.transaction():
+            database.query(
+                "UPDATE %s SET next_id = next_id + $count WHERE name = $name"
+                % self.table,
+                vars=vars)
+            rows = database.query("SELECT next_id FROM %s WHERE name = $name"
+                                  % self.table,
+                                  vars=vars,
+                                  row_factory="tuple")
+            return rows[0][0] if rows else None
+
+    def _handle(self):
+        # a handle of the same params with its own connections.
+        if self._sequence_handle is None:
+            self._sequence_handle = self.database._replica_handle({})
+        return self._sequence_handle
+
+    def _grab(self, count):
+        high = self._reserve(count)
+        if high is None:
+            database = self._handle()
+            try:
+                database.query(
+                    "INSERT INTO %s (name, next_id) VALUES ($name, $start)" %
+                    self.table,
+                    vars=dict(name=self.name, start=self.start))
+            except database.db_module.IntegrityError:
+                # created by another process meanwhile.
+                pass
+            high = self._reserve(count)
+            if high is None:
+                raise ValueError("the sequence %s has no row in %s." %
+                                 (self.name, self.table))
+        self.blocks += 1
+        self._next, self._high = high - count, high
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._high:
+                self._grab(self.block)
+            self._next += 1
+            return self._next - 1
+
+    def next_ids(self, count):
+        """Returns `count` ids, from one UPDATE at most."""
+        with self._lock:
+            ids = list(range(self._next, min(self._next + count,
+                                             self._high)))
+            self._next += len(ids)
+            if len(ids) < count:
+                left = count - len(ids)
+                self._grab(max(self.block, left))
+                ids.extend(range(self._next, self._next + left))
+                self._next += left
+            return ids
+
@@ -0,0 +1,78 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Upkeep of the per-thread connections of a `DB` handle without pool.
+#   Every thread connection is tracked in a `ConnRecord`; a background
+#   thread closes the connections of exited threads and the idle
+#   connections above a cap, and the owner thread pings a connection that
+#   sat idle before using it again.
+# ***********************************************************************
+
+import time
+import weakref
+import threading
+from . import forksafe
+
+__all__ = ["ConnRecord", "Maintenance"]
+
+
+class ConnRecord(object):
+    """
+    The connection of one thread. `busy` is set while a statement runs,
+    `pinned` while a transaction is open; neither kind is ever closed by
+    the maintenance thread. The owner thread reopens a `closed` connection
+    on its next query or transaction.
+    """
+    __slots__ = [
+        "thread", "conn", "last_used", "busy", "pinned", "closed", "lock"
+    ]
+
+    def __init__(self, thread, conn):
+        self.thread = thread
+        self.conn = conn
+        self.last_used = time.time()
+        self.busy = False
+        self.pinned = False
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def close(self):
+        """Closes the connection, called with `lock` held."""
+        self.closed = True
+        if forksafe.inherited(self.conn):
+            forksafe.detach(self.conn)
+            return
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class Maintenance(threading.Thread):
+    """
+    A daemon thread calling `database.maintain()` every `interval`
+    seconds. It only holds a weak reference to the handle and stops once
+    the handle is collected or `stop` is called.
+    """
+    def __init__(self, database, interval):
+        threading.Thread.__init__(self, name="crystaldb-maintenance")
+        self.daemon = True
+        self.interval = interval
+        self._database = weakref.ref(database)
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            database = self._database()
+            if database is None:
+                return
+            try:
+                database.maintain()
+            except Exception:
+                pass
+            del database
+
+    def stop(self):
+        self._stopped.set()
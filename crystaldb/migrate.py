@@ -0,0 +1,307 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Online data migration between shards. Rows are read from a source
+#   table in primary key order, one chunk at a time, written to the
+#   target in multi-row batches, throttled to a rate of rows per second,
+#   checked with a checksum against the source as it is after the write,
+#   and the last key of every verified chunk is checkpointed so that a
+#   restart resumes where it stopped. The target is a table, or a
+#   `ShardRouter` for a rebalancing, where every row goes to its new
+#   shard.
+# ***********************************************************************
+
+import os
+import json
+import time
+import zlib
+from .db import Table, SQLQuery, sqlquote
+from .compat import string_types
+
+__all__ = ["Migration", "FileCheckpoint", "rebalance", "checksum"]
+
+try:
+    _replace = os.replace
+except AttributeError:
+    # py2, rename is atomic on POSIX.
+    _replace = os.rename
+
+
+def checksum(rows, columns):
+    """crc32 of the `columns` of `rows`, in order."""
+    crc = 0
+    for row in rows:
+        value = repr(tuple(row[column] for column in columns))
+        crc = zlib.crc32(value.encode("utf-8"), crc)
+    return crc & 0xffffffff
+
+
+class FileCheckpoint(object):
+    """
+    The progress of a migration in a JSON file, written to a temp file
+    then renamed over it, so a crash leaves the previous checkpoint.
+    Any object with the same `load` and `save` can replace it, e.g. to
+    keep the checkpoints in a table.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Returns the saved state, or None."""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return None
+
+    def save(self, state):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        _replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Migration(object):
+    """
+    Copies the rows of one source table to a target.
+    :param source: the source `Table`, e.g. `router.table(...)` or
+        `Table(db_handle, "user_3")`.
+    :param target: a `Table`, or a `ShardRouter` that routes every row by
+        its shard key to a table of `table`. Rows routed to the source
+        table itself are not copied.
+    :param key: the primary key column, chunks are ranges of it.
+    :param table: the logical table of a `ShardRouter` target.
+    :param chunk_size: the rows read from the source per chunk.
+    :param batch_size: the rows per multi-row INSERT on the target.
+    :param rate: the rows per second to copy at most, None for no limit.
+    :param checkpoint: a file path or an object with `load`/`save`, see
+        `FileCheckpoint`; None keeps no checkpoint.
+    :param verify: compare the checksum of every chunk on the target with
+        the source re-read after the write, and copy the rows that differ
+        again, e.g. a row dual-written between the read and the write.
+    :param retries: the copies of a mismatched chunk before giving up.
+    :example:
+        migration = Migration(Table(old_db, "user_3"), new_router,
+                              key="id", table="user", rate=5000,
+                              checkpoint="/var/lib/app/user_3.json")
+        migration.run()
+        print(migration.stats)
+    """
+    def __init__(self,
+                 source,
+                 target,
+                 key="id",
+                 table=None,
+                 chunk_size=1000,
+                 batch_size=500,
+                 rate=None,
+                 checkpoint=None,
+                 verify=True,
+                 retries=2):
+        if not isinstance(target, Table) and table is None:
+            raise ValueError("a router target needs the logical table.")
+        if batch_size > chunk_size:
+            batch_size = chunk_size
+        self.source = source
+        self.target = target
+        self.key = key
+        self.table = table
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.rate = rate
+        if isinstance(checkpoint, string_types):
+            checkpoint = FileCheckpoint(checkpoint)
+        self.checkpoint = checkpoint
+        self.verify = verify
+        self.retries = retries
+        self.stats = dict(rows=0, chunks=0, batches=0, skipped=0,
+                          mismatches=0, last=None, seconds=0.0)
+        self._started = None
+        self._throttled = 0
+
+    def _state(self):
+        state = self.checkpoint.load() if self.checkpoint else None
+        if state:
+            for name in ("rows", "chunks", "batches", "skipped",
+                         "mismatches", "last"):
+                self.stats[name] = state.get(name, self.stats[name])
+        return self.stats["last"]
+
+    def _read(self, last, high=None):
+        """Returns the chunk after the key `last`, or with `high` the rows
+        of the source from `last` to `high` as they are now."""
+        select = self.source.select(row_factory="storage")
+        if last is not None:
+            select.gt(**{self.key: last})
+        # a lagging replica would hand back rows older than the target's.
+        with self.source.database.primary():
+            if high is not None:
+                return select.lte(**{
+                    self.key: high
+                }).order_by(self.key).all()
+            return select.order_by(self.key).limit(self.chunk_size)
+
+    def _route(self, row):
+        if isinstance(self.target, Table):
+            return self.target.database, self.target.tables
+        return self.target.route(self.table, row[self.target.key])
+
+    def _groups(self, rows):
+        """Returns [((handle, name), rows)] of the rows to write, in the
+        order of their first row, leaving out the rows routed to the
+        source table itself."""
+        source = (self.source.database, self.source.tables)
+        groups, order = {}, []
+        for row in rows:
+            route = self._route(row)
+            if route == source:
+                continue
+            if route not in groups:
+                groups[route] = []
+                order.append(route)
+            groups[route].append(row)
+        return [(route, groups[route]) for route in order]
+
+    def _in(self, keys):
+        return SQLQuery("%s IN " % self.key) + sqlquote(list(keys))
+
+    def _write(self, groups):
+        """Replaces the rows of every group in batches, each batch in
+        one transaction, so a chunk copied twice gives the same rows."""
+        for (database, name), rows in groups:
+            for i in range(0, len(rows), self.batch_size):
+                batch = rows[i:i + self.batch_size]
+                with database.transaction():
+                    Table(database, name).delete(
+                        self._in(row[self.key] for row in batch))
+                    database.multiple_insert(name, [dict(row)
+                                                    for row in batch])
+                self.stats["batches"] += 1
+                self._throttle(len(batch))
+
+    def _throttle(self, count):
+        self._throttled += count
+        if self.rate:
+            ahead = self._throttled / float(self.rate) - \
+                (time.time() - self._started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def _repair(self, last, rows):
+        """
+        Compares the checksums of the target with the source as it is
+        now, re-read from `last` to the last key of `rows`, not with the
+        copied `rows`: a dual-write between the read and the write of the
+        chunk is then seen, and its row is copied again, instead of the
+        stale copy staying. Rows gone from the source are deleted.
+        :return : the number of rows that differed.
+        """
+        key = self.key
+        fresh = self._read(last, rows[-1][key])
+        expected = dict((row[key], row) for row in fresh)
+        columns = sorted(rows[0].keys())
+        stale, differ = [], 0
+        for (database, name), routed in self._groups(fresh + rows):
+            keys = sorted(set(row[key] for row in routed))
+            with database.primary():
+                copied = Table(database, name).select(
+                    row_factory="storage").in_(**{
+                        key: keys
+                    }).order_by(key).all()
+            wanted = [expected[k] for k in keys if k in expected]
+            if checksum(wanted, columns) == checksum(copied, columns):
+                continue
+            copied = dict((row[key], row) for row in copied)
+            gone = [k for k in keys if k not in expected and k in copied]
+            if gone:
+                Table(database, name).delete(self._in(gone))
+            for row in wanted:
+                if row[key] not in copied or checksum(
+                        [row], columns) != checksum([copied[row[key]]],
+                                                    columns):
+                    stale.append(row)
+            differ += len(gone)
+        if stale:
+            self._write(self._groups(stale))
+        return differ + len(stale)
+
+    def chunk(self, last):
+        """Copies the chunk after the key `last` (None for the first),
+        returns its last key, or None when the source is done."""
+        rows = self._read(last)
+        if not rows:
+            return None
+        groups = self._groups(rows)
+        self._write(groups)
+        copies = 1
+        while self.verify and self._repair(last, rows):
+            self.stats["mismatches"] += 1
+            copies += 1
+            if copies > self.retries + 1:
+                raise ValueError("the checksums of %s after %s differ after "
+                                 "%d copies." % (self.source.tables, last,
+                                                 copies - 1))
+        self.stats["rows"] += len(rows)
+        self.stats["skipped"] += len(rows) - sum(
+            len(routed) for _, routed in groups)
+        self.stats["chunks"] += 1
+        self.stats["last"] = rows[-1][self.key]
+        if self.checkpoint:
+            self.checkpoint.save(dict(
+                (name, self.stats[name])
+                for name in ("rows", "chunks", "batches", "skipped",
+                             "mismatches", "last")))
+        return self.stats["last"]
+
+    def run(self, max_chunks=None):
+        """
+        Copies the chunks from the checkpoint on, until the source is
+        done or `max_chunks` chunks are copied.
+        :return : True when the whole source is copied.
+        """
+        self._started, self._throttled = time.time(), 0
+        last = self._state()
+        count = 0
+        try:
+            while max_chunks is None or count < max_chunks:
+                last = self.chunk(last)
+                if last is None:
+                    return True
+                count += 1
+            return False
+        finally:
+            self.stats["seconds"] += time.time() - self._started
+
+
+def rebalance(router, new_router, table, checkpoint_dir=None, **kwargs):
+    """
+    Returns one `Migration` per shard of `table` in `router`, moving its
+    rows to their shard in `new_router`. `checkpoint_dir` keeps one
+    checkpoint file per source table.
+    :example:
+        router.dual_write(new_router)
+        for migration in rebalance(router, new_router, "user",
+                                   checkpoint_dir="/var/lib/app"):
+            migration.run()
+        # then the application switches to new_router.
+    """
+    migrations = []
+    for database, name in router.routes(table):
+        checkpoint = None
+        if checkpoint_dir:
+            checkpoint = os.path.join(checkpoint_dir, "%s.json" % name)
+        migrations.append(
+            Migration(Table(database, name),
+                      new_router,
+                      table=table,
+                      checkpoint=checkpoint,
+                      **kwargs))
+    return migrations
@@ -0,0 +1,318 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Time-partitioned tables: a logical table split by day, month or year
+#   into physical tables (events_202601, events_202602, ...). Inserts go
+#   to the partition of their key; a select is pruned to the partitions
+#   its range on the key touches, and runs them as one UNION ALL or in
+#   parallel. Future partitions can be created ahead of time.
+# ***********************************************************************
+
+import time
+import datetime
+from .db import Table, SQLQuery, SQLParam
+from .scatter import ShardSelect, ShardExecutor
+from .utils import iterbetter
+from .compat import string_types, numeric_types
+
+__all__ = ["PartitionedTable", "PartitionSelect", "INTERVALS"]
+
+# interval -> format of the table name suffix.
+INTERVALS = dict(day="%Y%m%d", month="%Y%m", year="%Y")
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    if isinstance(value, numeric_types):
+        return datetime.datetime.fromtimestamp(value)
+    if isinstance(value, string_types):
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f",
+                    "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+            try:
+                return datetime.datetime.strptime(value, fmt)
+            except ValueError:
+                pass
+    raise ValueError("not a partition key value: %r" % (value, ))
+
+
+def _period_start(value, interval):
+    if interval == "day":
+        return datetime.datetime(value.year, value.month, value.day)
+    elif interval == "month":
+        return datetime.datetime(value.year, value.month, 1)
+    return datetime.datetime(value.year, 1, 1)
+
+
+def _next_period(start, interval):
+    if interval == "day":
+        return start + datetime.timedelta(days=1)
+    elif interval == "month":
+        if start.month == 12:
+            return datetime.datetime(start.year + 1, 1, 1)
+        return datetime.datetime(start.year, start.month + 1, 1)
+    return datetime.datetime(start.year + 1, 1, 1)
+
+
+class PartitionedTable(object):
+    """
+    A logical table partitioned by time on the column `key`.
+    :param database: the handle of the partitions.
+    :param name: the logical table name.
+    :param key: the partition key column, a DATE/DATETIME.
+    :param interval: "day", "month" (the default) or "year".
+    :param template: the physical name, formatted with `table` and
+        `suffix` (e.g. 202601 by month).
+    :param ahead: the number of future partitions kept created, checked
+        when the list of partitions is refreshed; 0 creates none.
+    :param like: the table the created partitions copy, the default is
+        the latest partition.
+    :param refresh: the seconds the list of partitions is cached.
+    :param workers: the threads of the `parallel` selects, see
+        `ShardExecutor`.
+    :example:
+        events = PartitionedTable(db_handle, "events", key="created_at")
+        events.insert(created_at="2026-02-03 10:00:00", kind="login")
+        events.select().between(
+            created_at=["2026-01-01", "2026-03-31"]).order_by(
+                "created_at", True).limit(100)
+    """
+    def __init__(self,
+                 database,
+                 name,
+                 key,
+                 interval="month",
+                 template="{table}_{suffix}",
+                 ahead=0,
+                 like=None,
+                 refresh=60,
+                 workers=8):
+        if interval not in INTERVALS:
+            raise ValueError("unknown partition interval: %s" % interval)
+        self.database = database
+        self.name = name
+        self.key = key
+        self.interval = interval
+        self.template = template
+        self.ahead = ahead
+        self.like = like
+        self.refresh = refresh
+        self.executor = ShardExecutor(workers)
+        self._format = INTERVALS[interval]
+        self._prefix = template.split("{suffix}")[0].format(table=name)
+        self._existing = None
+        self._listed = 0
+
+    def table_name(self, value):
+        """Returns the partition name of a key value."""
+        start = _period_start(_to_datetime(value), self.interval)
+        return self.template.format(table=self.name,
+                                    suffix=start.strftime(self._format))
+
+    def partition(self, value):
+        """Returns the `Table` of the partition of a key value."""
+        return Table(self.database, self.table_name(value))
+
+    def insert(self, seqname=None, test=False, ignore=False, **values):
+        if self.key not in values:
+            raise ValueError("the partition key %s is required." % self.key)
+        return self.partition(values[self.key]).insert(seqname,
+                                                       test,
+                                                       ignore=ignore,
+                                                       **values)
+
+    def multiple_insert(self, values, seqname=None, test=False):
+        """Inserts the rows with one statement per partition."""
+        groups = {}
+        for row in values:
+            groups.setdefault(self.table_name(row[self.key]), []).append(row)
+        return [
+            self.database.multiple_insert(name, rows, seqname, test)
+            for name, rows in sorted(groups.items())
+        ]
+
+    def _list_tables(self):
+        """Returns the table names starting with the partition prefix."""
+        pattern = self._prefix.replace("\\", "\\\\").replace(
+            "_", "\\_").replace("%", "\\%") + "%"
+        # a lagging replica would miss the partitions just created.
+        with self.database.primary():
+            rows = self.database.query("SHOW TABLES LIKE $pattern",
+                                       vars=dict(pattern=pattern),
+                                       row_factory="tuple")
+        return [row[0] for row in rows]
+
+    def _create_table(self, name, like):
+        self.database.query("CREATE TABLE IF NOT EXISTS %s LIKE %s" %
+                            (name, like))
+
+    def existing(self, force=False):
+        """Returns {period start: table name} of the partitions, listed at
+        most every `refresh` seconds. Creates the `ahead` future
+        partitions when they are missing."""
+        if not force and self._existing is not None and \
+                time.time() - self._listed < self.refresh:
+            return self._existing
+        self._load()
+        if self.ahead and self._existing and self.create_ahead():
+            self._load()
+        return self._existing
+
+    def _load(self):
+        existing = {}
+        size = len(self._prefix)
+        for name in self._list_tables():
+            try:
+                start = datetime.datetime.strptime(name[size:], self._format)
+            except ValueError:
+                continue
+            if self.template.format(
+                    table=self.name,
+                    suffix=start.strftime(self._format)) == name:
+                existing[start] = name
+        self._existing, self._listed = existing, time.time()
+
+    def create_ahead(self, count=None, now=None):
+        """
+        Creates the partitions of the current and of the next `count`
+        periods (`ahead` by default) that are missing, like `like` or the
+        latest partition.
+        :return : the names of the created partitions.
+        """
+        count = self.ahead if count is None else count
+        existing = self._existing if self._existing is not None else \
+            self.existing()
+        like = self.like or (existing[max(existing)] if existing else None)
+        if like is None:
+            raise ValueError("no partition to create %s partitions like." %
+                             self.name)
+        start = _period_start(now or datetime.datetime.now(), self.interval)
+        created = []
+        for _ in range(count + 1):
+            name = self.template.format(table=self.name,
+                                        suffix=start.strftime(self._format))
+            if start not in existing:
+                self._create_table(name, like)
+                created.append(name)
+            start = _next_period(start, self.interval)
+        if created:
+            self._listed = 0
+        return created
+
+    def partitions(self, low=None, high=None, high_inclusive=True):
+        """Returns the names of the existing partitions holding keys from
+        `low` to `high`, in time order. None leaves a side open."""
+        existing = self.existing()
+        first = None if low is None else \
+            _period_start(_to_datetime(low), self.interval)
+        last = None
+        if high is not None:
+            high = _to_datetime(high)
+            last = _period_start(high, self.interval)
+            if not high_inclusive and last == high:
+                # `key < high` with high on a period start.
+                last -= datetime.timedelta(microseconds=1)
+        return [
+            existing[start] for start in sorted(existing)
+            if (first is None or start >= first) and (
+                last is None or start <= last)
+        ]
+
+    def select(self, fields=None, row_factory=None, parallel=False):
+        """
+        Returns a `PartitionSelect` over the partitions its range on the
+        key touches, run as one UNION ALL, or with `parallel` on one
+        thread per partition like `ShardSelect`.
+        """
+        return PartitionSelect(self, fields, row_factory, parallel)
+
+
+class PartitionSelect(ShardSelect):
+    """A `ShardSelect` over the partitions of a `PartitionedTable`,
+    pruned by the range of the key in `between`, `gt`, `gte`, `lt`,
+    `lte`, `eq` and `filter`."""
+    def __init__(self, table, fields=None, row_factory=None, parallel=False):
+        ShardSelect.__init__(self, table, table.name, fields, row_factory)
+        self.parallel = parallel
+
+    def _range(self):
+        low = high = None
+        high_inclusive = True
+        key = self.router.key
+
+        def later(a, b):
+            return b if a is None or _to_datetime(b) > _to_datetime(a) \
+                else a
+
+        def earlier(a, b):
+            return b if a is None or _to_datetime(b) < _to_datetime(a) \
+                else a
+
+        for name, args, kwargs in self._ops:
+            if key not in kwargs:
+                continue
+            value = kwargs[key]
+            if name == "between":
+                low, high = later(low, value[0]), earlier(high, value[1])
+            elif name in ("gt", "gte"):
+                low = later(low, value)
+            elif name in ("lt", "lte"):
+                new_high = earlier(high, value)
+                if new_high is not high:
+                    high, high_inclusive = new_high, name == "lte"
+            elif name in ("eq", "filter", "filter_by") and \
+                    not isinstance(value, (list, tuple)):
+                low, high = later(low, value), earlier(high, value)
+        return low, high, high_inclusive
+
+    def _routes(self):
+        database = self.router.database
+        return [(database, name)
+                for name in self.router.partitions(*self._range())]
+
+    def stream(self, batch_size=1000, limit=None):
+        """Returns an `IterBetter` of the rows, see `ShardSelect.stream`;
+        without `parallel`, one UNION ALL query reads every partition."""
+        if self.parallel:
+            return ShardSelect.stream(self, batch_size, limit)
+        routes = self._routes()
+        pushed = None if limit is None else self._offset + limit
+        selects = self._selects(routes, limit=pushed)
+        self.timings = [self._timing(", ".join(name for _, name in routes))]
+        if not selects:
+            return iterbetter(iter([]))
+        sql = SQLQuery.join([
+            SQLQuery("SELECT * FROM (") +
+            select._metadata._query(_raw_sql_flag=True) + ") AS p%d" % i
+            for i, select in enumerate(selects)
+        ], " UNION ALL ")
+        if self._order:
+            direction = " DESC" if self._reversed else ""
+            sql += " ORDER BY " + ", ".join(field + direction
+                                             for field in self._order)
+        offset = self._offset
+        if limit is not None:
+            sql += " LIMIT " + SQLParam(limit).sqlquery()
+            if offset:
+                sql += " OFFSET " + SQLParam(offset).sqlquery()
+            offset = 0
+        start = time.time()
+        rows = self.router.database.query(sql,
+                                          processed=True,
+                                          stream=True,
+                                          batch_size=batch_size,
+                                          row_factory=self.row_factory)
+        self.timings[0]["first_row"] = time.time() - start
+        if not offset:
+            return rows
+
+        def skipped():
+            for i, row in enumerate(rows):
+                if i >= offset:
+                    yield row
+
+        return iterbetter(skipped(), on_close=rows.close)
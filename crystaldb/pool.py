@@ -0,0 +1,230 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   The connection pool shared by every thread of a `DB` handle. A
+#   `PooledDB` whose checkout is thread-affine (a thread gets back the
+#   connection it released last when it is idle) and which connects,
+#   pings and resets connections outside of the pool lock. `PoolStats`
+#   counts what happens to its connections.
+# ***********************************************************************
+
+import os
+import time
+import threading
+try:
+    from threading import get_ident
+except ImportError:
+    from thread import get_ident
+from DBUtils.PooledDB import PooledDB, PooledDedicatedDBConnection
+from DBUtils.SteadyDB import SteadyDBConnection
+from . import forksafe
+
+__all__ = ["SharedPool", "PoolStats"]
+
+
+class PoolStats(object):
+    """
+    Thread-safe counters of a pool. Every event optionally goes to
+    `listener(event, value)`, value being the wait in seconds for
+    "checkout" and 1 for the other events. Events are:
+        checkout, checkin: a connection left or came back to the pool.
+        create, destroy: a driver connection was opened or closed.
+        recycle: a connection reached `maxusage` and was reopened.
+        reconnect: a dead connection was reopened.
+        exhausted: a checkout failed on `maxconnections`.
+    :example:
+        >>> stats = PoolStats()
+        >>> stats.event("checkout", 0.002)
+        >>> stats.event("create")
+        >>> s = stats.snapshot()
+        >>> s["checkouts"], s["created"], s["checkout_wait_max"]
+        (1, 1, 0.002)
+    """
+    _counters = dict(checkout="checkouts",
+                     checkin="checkins",
+                     create="created",
+                     destroy="destroyed",
+                     recycle="recycled",
+                     reconnect="reconnects",
+                     exhausted="exhausted")
+
+    def __init__(self, listener=None):
+        self.listener = listener
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._values = dict((name, 0) for name in
+                                self._counters.values())
+            self._wait_total = 0.0
+            self._wait_max = 0.0
+
+    def event(self, name, value=1):
+        counter = self._counters[name]
+        with self._lock:
+            self._values[counter] += 1
+            if name == "checkout":
+                self._wait_total += value
+                if value > self._wait_max:
+                    self._wait_max = value
+        if self.listener is not None:
+            self.listener(name, value)
+
+    def snapshot(self):
+        with self._lock:
+            out = dict(self._values)
+            out["checkout_wait_total"] = self._wait_total
+            out["checkout_wait_max"] = self._wait_max
+        checkouts = out["checkouts"]
+        out["checkout_wait_avg"] = \
+            out["checkout_wait_total"] / checkouts if checkouts else 0.0
+        return out
+
+
+class _SteadyConnection(SteadyDBConnection):
+    """A `SteadyDBConnection` reporting its connects and closes. In a
+    forked child, it is dropped without sending anything: its session is
+    the parent's."""
+    def __init__(self, stats, *args, **kwargs):
+        self._stats = stats
+        self._pid = os.getpid()
+        SteadyDBConnection.__init__(self, *args, **kwargs)
+
+    def _create(self):
+        con = SteadyDBConnection._create(self)
+        if getattr(self, '_con', None) is not None:
+            # reopened, because of maxusage or because it was dead.
+            if self._maxusage and self._usage >= self._maxusage:
+                self._stats.event("recycle")
+            else:
+                self._stats.event("reconnect")
+        self._stats.event("create")
+        return con
+
+    def _close(self):
+        if self._pid != os.getpid():
+            if not self._closed:
+                self._closed = True
+                forksafe.detach(self._con)
+            return
+        if not self._closed:
+            self._stats.event("destroy")
+        SteadyDBConnection._close(self)
+
+    def _reset(self, force=False):
+        if self._pid == os.getpid():
+            SteadyDBConnection._reset(self, force)
+
+
+class SharedPool(PooledDB):
+    """
+    A `PooledDB` for many threads. `maxconnections` and `maxcached` bound
+    the whole process, not a thread. The lock is only held to count
+    connections and move them in and out of the idle cache, so a slow
+    connect or ping does not stall the other threads.
+    """
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the arguments of `PooledDB`, plus
+        :param stats: the `PoolStats` counting the pool events.
+        """
+        # thread ident -> the connection it released last.
+        self._affinity = {}
+        self.stats = kwargs.pop("stats", None) or PoolStats()
+        PooledDB.__init__(self, *args, **kwargs)
+
+    def steady_connection(self):
+        return _SteadyConnection(self.stats, self._creator, self._maxusage,
+                                 self._setsession, self._failures,
+                                 self._ping, True, *self._args,
+                                 **self._kwargs)
+
+    def connection(self, shareable=True):
+        start = time.time()
+        if shareable and self._maxshared:
+            con = PooledDB.connection(self, shareable)
+            self.stats.event("checkout", time.time() - start)
+            return con
+        with self._lock:
+            while self._maxconnections and \
+                    self._connections >= self._maxconnections:
+                try:
+                    self._wait_lock()
+                except Exception:
+                    self.stats.event("exhausted")
+                    raise
+            con = self._take_idle()
+            self._connections += 1
+        try:
+            if con is None:
+                con = self.steady_connection()
+            else:
+                con._ping_check()
+        except Exception:
+            with self._lock:
+                self._connections -= 1
+                self._lock.notify()
+            raise
+        self.stats.event("checkout", time.time() - start)
+        return PooledDedicatedDBConnection(self, con)
+
+    def usage(self):
+        """Returns the number of connections in use and idle."""
+        with self._lock:
+            return self._connections, len(self._idle_cache)
+
+    def _take_idle(self):
+        """Pops the idle connection of the calling thread, or else the
+        most recently released one. Called with the lock held."""
+        idle = self._idle_cache
+        if not idle:
+            return None
+        con = self._affinity.pop(get_ident(), None)
+        if con is not None:
+            try:
+                idle.remove(con)
+                return con
+            except ValueError:
+                pass
+        con = idle.pop()
+        owner = getattr(con, '_crystaldb_thread', None)
+        if self._affinity.get(owner) is con:
+            del self._affinity[owner]
+        return con
+
+    def cache(self, con):
+        """Puts a connection back into the idle cache."""
+        if con._pid != os.getpid():
+            # freed in a forked child, e.g. with the thread-locals of
+            # another thread of the parent: the pool, its lock and the
+            # session are the parent's.
+            con._close()
+            return
+        self.stats.event("checkin")
+        keep = not self._maxcached or len(self._idle_cache) < self._maxcached
+        if keep:
+            try:
+                # rollback possible transaction, outside of the lock.
+                con._reset(force=self._reset)
+            except Exception:
+                keep = False
+        with self._lock:
+            if keep and (not self._maxcached or
+                         len(self._idle_cache) < self._maxcached):
+                ident = get_ident()
+                con._crystaldb_thread = ident
+                self._affinity[ident] = con
+                self._idle_cache.append(con)
+                con = None
+            self._connections -= 1
+            self._lock.notify()
+        if con is not None:
+            con.close()
+
+    def close(self):
+        with self._lock:
+            self._affinity.clear()
+        PooledDB.close(self)
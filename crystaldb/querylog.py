@@ -0,0 +1,210 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Structured query event log, sent through the `logging` module.
+#   Nothing is rendered unless an event is sampled and a handler formats
+#   it, and handlers run on a background thread behind a queue.
+# ***********************************************************************
+
+import re
+import random
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    QueueHandler = QueueListener = None
+
+__all__ = ["QueryEvent", "QueryLog", "fingerprint"]
+
+_string_re = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_number_re = re.compile(r"\b\d+(?:\.\d+)?\b")
+_marker_re = re.compile(r"%s|\?")
+_list_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_space_re = re.compile(r"\s+")
+
+
+def fingerprint(query):
+    """
+    Normalizes a query so that statements differing only in their values
+    share one fingerprint.
+    :example:
+        >>> fingerprint("SELECT * FROM user WHERE id IN (%s, %s)  AND name = 'x'")
+        'SELECT * FROM user WHERE id IN (?+) AND name = ?'
+    """
+    query = _string_re.sub("?", query)
+    query = _number_re.sub("?", query)
+    query = _marker_re.sub("?", query)
+    query = _list_re.sub("(?+)", query)
+    return _space_re.sub(" ", query).strip()
+
+
+class QueryEvent(object):
+    """One executed query. Holds the raw values only, every string is made
+    when the event is formatted."""
+    __slots__ = ["query", "params", "elapsed", "rowcount", "thread",
+                 "connection_id"]
+
+    def __init__(self, query, params, elapsed, rowcount, thread,
+                 connection_id):
+        self.query = query
+        self.params = params
+        self.elapsed = elapsed
+        self.rowcount = rowcount
+        self.thread = thread
+        self.connection_id = connection_id
+
+    @property
+    def fingerprint(self):
+        return fingerprint(self.query)
+
+    def as_dict(self):
+        return dict(fingerprint=self.fingerprint,
+                    params=self.params,
+                    elapsed=round(self.elapsed, 4),
+                    rowcount=self.rowcount,
+                    thread=self.thread.name,
+                    connection_id=self.connection_id)
+
+    def __str__(self):
+        return "%.4fms rows=%s thread=%s conn=%s: %s %r" % (
+            self.elapsed, self.rowcount, self.thread.name,
+            self.connection_id, self.fingerprint, self.params)
+
+
+def _connection_id(cursor):
+    """Returns the server thread id of the connection of `cursor`."""
+    conn = getattr(cursor, 'connection', None) or \
+        getattr(cursor, '_connection', None)
+    try:
+        # MySQLdb has thread_id(), mysql.connector connection_id and
+        # pymysql server_thread_id.
+        thread_id = getattr(conn, 'thread_id', None)
+        if callable(thread_id):
+            return thread_id()
+        if getattr(conn, 'connection_id', None) is not None:
+            return conn.connection_id
+        return conn.server_thread_id[0]
+    except Exception:
+        return id(conn) if conn is not None else None
+
+
+if QueueHandler is not None:
+
+    class _LazyQueueHandler(QueueHandler):
+        """Queues records unformatted and drops them when the queue is
+        full, so that logging never blocks a query."""
+        def __init__(self, queue_):
+            QueueHandler.__init__(self, queue_)
+            self.dropped = 0
+
+        def prepare(self, record):
+            return record
+
+        def enqueue(self, record):
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+
+class QueryLog(object):
+    """
+    Samples executed queries into `QueryEvent` records on the
+    `crystaldb.query` logger.
+    :param sample_rate: the fraction of queries logged, from 0 to 1.
+    :param slow_ms: queries slower than this are always logged.
+    :param level: the logging level of the records.
+    :param logger: logger name or object, default `crystaldb.query`.
+    :example:
+        query_log = QueryLog(sample_rate=0.01, slow_ms=200)
+        query_log.start(logging.FileHandler("query.log"))
+        db_handle = crystaldb.database(..., query_log=query_log)
+    """
+    def __init__(self,
+                 sample_rate=1.0,
+                 slow_ms=None,
+                 level=logging.INFO,
+                 logger="crystaldb.query"):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.level = level
+        if not isinstance(logger, logging.Logger):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self._handler = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def sampled(self, elapsed):
+        if self.slow_ms is not None and elapsed >= self.slow_ms:
+            return True
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def emit(self, query, params, elapsed, cursor):
+        """Logs one executed query if it is sampled.
+        :param elapsed: run time in ms.
+        """
+        if not self.sampled(elapsed) or \
+                not self.logger.isEnabledFor(self.level):
+            return
+        event = QueryEvent(query, params, elapsed,
+                           getattr(cursor, 'rowcount', None),
+                           threading.current_thread(),
+                           _connection_id(cursor))
+        self.logger.log(self.level,
+                        "%s",
+                        event,
+                        extra=dict(query_event=event))
+
+    def start(self, *handlers, **kwargs):
+        """Attaches `handlers` to the logger behind a bounded queue that is
+        drained by a background thread.
+        :param maxsize: the queue size, records are dropped when full.
+        """
+        maxsize = kwargs.get("maxsize", 10000)
+        with self._lock:
+            if self._handler is not None:
+                raise RuntimeError("query log is already started.")
+            if QueueHandler is None:
+                # python2, no queue handlers, log directly.
+                for handler in handlers:
+                    self.logger.addHandler(handler)
+                self._handler = handlers
+            else:
+                queue_ = queue.Queue(maxsize)
+                self._handler = _LazyQueueHandler(queue_)
+                self._listener = QueueListener(queue_, *handlers)
+                self._listener.start()
+                self.logger.addHandler(self._handler)
+            if self.logger.level == logging.NOTSET or \
+                    self.logger.level > self.level:
+                self.logger.setLevel(self.level)
+        return self
+
+    def stop(self):
+        """Flushes the queue and detaches the handlers."""
+        with self._lock:
+            if self._handler is None:
+                return
+            if self._listener is not None:
+                self.logger.removeHandler(self._handler)
+                self._listener.stop()
+                self._listener = None
+            else:
+                for handler in self._handler:
+                    self.logger.removeHandler(handler)
+            self._handler = None
+
+    @property
+    def dropped(self):
+        """The number of records dropped because the queue was full."""
+        return getattr(self._handler, 'dropped', 0)
@@ -0,0 +1,269 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Read/write splitting. A `DB` handle given replicas sends its reads to
+#   a `ReplicaSet` of replica handles and keeps writes, transactions and
+#   the reads following a write on the primary. Replicas lagging behind
+#   the primary by more than `max_lag` seconds are left out until they
+#   catch up, and reads are balanced by the latency of every replica.
+# ***********************************************************************
+
+import re
+import time
+import random
+import threading
+
+__all__ = ["Replica", "ReplicaSet", "Primary", "is_read", "is_write"]
+
+_READ = re.compile(r"^[\s(]*(SELECT|SHOW|DESCRIBE|DESC|EXPLAIN|WITH)\b",
+                   re.I)
+# reads that must see the session or the locks of the primary.
+_PRIMARY_ONLY = re.compile(
+    r"\bFOR\s+UPDATE\b|\bLOCK\s+IN\s+SHARE\s+MODE\b|\bFOR\s+SHARE\b|"
+    r"\bINTO\b|\b(LAST_INSERT_ID|FOUND_ROWS|ROW_COUNT|GET_LOCK|"
+    r"RELEASE_LOCK|IS_FREE_LOCK|IS_USED_LOCK)\s*\(", re.I)
+
+
+def is_read(sql):
+    """
+    True when `sql` can run on a replica.
+    :example:
+        >>> is_read("SELECT * FROM user WHERE id = 1")
+        True
+        >>> is_read("SELECT * FROM user WHERE id = 1 FOR UPDATE")
+        False
+        >>> is_read("UPDATE user SET age = 2")
+        False
+    """
+    return bool(_READ.match(sql)) and not _PRIMARY_ONLY.search(sql)
+
+
+def is_write(sql):
+    """True when `sql` may change data, the reads after it go to the
+    primary for a while."""
+    return not _READ.match(sql)
+
+
+class Replica(object):
+    """
+    A replica handle and what is known of its health:
+        lag: the replication lag, checked at most every `check_interval`
+            seconds on the read path. The replica is left out while it is
+            over `max_lag` seconds or unknown (replication stopped).
+        ewma, inflight: the moving average of its statement times (ms)
+            and the statements running on it, fed by `_db_execute`.
+    It is ejected for `eject_time` seconds after `eject_errors` failed
+    statements in a row, or when its average is over `eject_spike` times
+    the best of its peers; the time doubles (up to 8 times) when it fails
+    again right after coming back. A replica back from ejection has no
+    average, so it is probed by the next reads.
+    """
+    # weight of the newest statement time in the average.
+    alpha = 0.3
+    # statements before the average of a replica is compared to its peers.
+    min_samples = 10
+
+    def __init__(self,
+                 database,
+                 max_lag=None,
+                 check_interval=5,
+                 eject_errors=3,
+                 eject_spike=5,
+                 eject_time=10):
+        self.database = database
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.eject_errors = eject_errors
+        self.eject_spike = eject_spike
+        self.eject_time = eject_time
+        self.lag = None
+        self.checked = 0
+        self.lagging = False
+        self.ewma = None
+        self.samples = 0
+        self.inflight = 0
+        self.queries = 0
+        self.failures = 0
+        self.errors = 0
+        self.ejections = 0
+        self.ejected_until = 0
+        self.peers = ()
+        self._backoff = 1
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def name(self):
+        params = self.database.params
+        return "%s:%s" % (params.get("host"), params.get("port") or 3306)
+
+    @property
+    def ejected(self):
+        return self.lagging or time.time() < self.ejected_until
+
+    def healthy(self):
+        now = time.time()
+        if self.max_lag is not None and \
+                now - self.checked >= self.check_interval:
+            self.refresh()
+        if self.ejected_until and now >= self.ejected_until:
+            self._rejoin()
+        return not self.lagging and now >= self.ejected_until
+
+    def refresh(self):
+        """Reads the lag of the replica, unless another thread is."""
+        if not self._lock.acquire(False):
+            return
+        try:
+            try:
+                lag = self._read_lag()
+            except Exception:
+                lag = None
+            self.lag = lag
+            self.lagging = lag is None or lag > self.max_lag
+            self.checked = time.time()
+        finally:
+            self._lock.release()
+
+    def _read_lag(self):
+        # SHOW SLAVE STATUS is gone from MySQL 8.4, REPLICA is new in 8.0.22.
+        for sql in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+            try:
+                rows = self.database.query(sql, row_factory="storage")
+            except Exception:
+                continue
+            if not rows:
+                # not a replica
+                return None
+            row = rows[0]
+            return row.get("Seconds_Behind_Source",
+                           row.get("Seconds_Behind_Master"))
+        return None
+
+    def has_gtid(self, gtid):
+        """True when the replica applied every transaction of `gtid`."""
+        rows = self.database.query(
+            "SELECT GTID_SUBSET($gtid, @@GLOBAL.gtid_executed) AS done",
+            vars=dict(gtid=gtid),
+            row_factory="storage")
+        return bool(rows and rows[0].done)
+
+    def begin(self):
+        """A statement starts on the replica."""
+        with self._stats_lock:
+            self.inflight += 1
+
+    def end(self, ms, ok):
+        """A statement ended after `ms` milliseconds, failed unless
+        `ok`."""
+        with self._stats_lock:
+            self.inflight -= 1
+            self.queries += 1
+            if ok:
+                self.errors = 0
+                self._backoff = 1
+                self.samples += 1
+                self.ewma = ms if self.ewma is None else \
+                    self.alpha * ms + (1 - self.alpha) * self.ewma
+                eject = self._outlier()
+            else:
+                self.failures += 1
+                self.errors += 1
+                eject = self.errors >= self.eject_errors
+        if eject:
+            self.eject()
+
+    def _outlier(self):
+        if not self.eject_spike or self.samples < self.min_samples:
+            return False
+        peers = [peer.ewma for peer in self.peers
+                 if peer is not self and peer.ewma is not None and
+                 peer.samples >= self.min_samples and not peer.ejected]
+        return bool(peers) and self.ewma > self.eject_spike * min(peers)
+
+    def eject(self):
+        """Leaves the replica out for `eject_time` seconds, longer when it
+        was just back."""
+        with self._stats_lock:
+            self.ejections += 1
+            self.ejected_until = time.time() + \
+                self.eject_time * self._backoff
+            self._backoff = min(self._backoff * 2, 8)
+            self.errors = 0
+
+    def _rejoin(self):
+        with self._stats_lock:
+            if not self.ejected_until or time.time() < self.ejected_until:
+                return
+            self.ejected_until = 0
+            self.ewma = None
+            self.samples = 0
+            # one more failure ejects it again.
+            self.errors = max(self.eject_errors - 1, 0)
+
+    def score(self):
+        """The expected wait of a new statement, lower is better. A
+        replica without average comes first, to measure it."""
+        return (self.ewma or 0.0) * (self.inflight + 1)
+
+    def snapshot(self):
+        return dict(name=self.name,
+                    ewma_ms=self.ewma,
+                    inflight=self.inflight,
+                    queries=self.queries,
+                    failures=self.failures,
+                    ejections=self.ejections,
+                    ejected=self.ejected,
+                    lag=self.lag)
+
+
+class ReplicaSet(object):
+    """
+    The replicas of a handle. A read goes to the better of two healthy
+    replicas picked at random (power of two choices), by `score`, which
+    spreads the load by latency and in-flight statements without sending
+    everything to the single fastest replica.
+    """
+    def __init__(self, replicas):
+        self.replicas = list(replicas)
+        for replica in self.replicas:
+            replica.peers = self.replicas
+
+    def __iter__(self):
+        return iter(self.replicas)
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def choose(self, accept=None):
+        """Returns a healthy replica for which `accept(replica)` is true,
+        or None. `accept` is tried on the replicas by best score."""
+        healthy = [replica for replica in self.replicas if replica.healthy()]
+        if len(healthy) > 1:
+            first, second = random.sample(healthy, 2)
+            if second.score() < first.score():
+                first, second = second, first
+            if accept is None:
+                return first
+            healthy.remove(first)
+            healthy.sort(key=lambda replica: replica.score())
+            healthy.insert(0, first)
+        for replica in healthy:
+            if accept is None or accept(replica):
+                return replica
+        return None
+
+
+class Primary(object):
+    """Context manager sending the reads of the thread to the primary."""
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    def __enter__(self):
+        self.ctx.primary = self.ctx.get("primary", 0) + 1
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        self.ctx.primary -= 1
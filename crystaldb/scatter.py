@@ -0,0 +1,453 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Scatter-gather selects over the shards of a `ShardRouter`. Every shard
+#   runs its select on its own thread and streams its rows back in
+#   batches; ordered selects are merged with a k-way merge, LIMIT/OFFSET
+#   are pushed down to the shards as LIMIT offset + limit, and counts and
+#   simple aggregates are combined from the per shard values. The shard
+#   threads are the workers of a `ShardExecutor` kept by the router, and
+#   read on a connection of their own only.
+# ***********************************************************************
+
+import os
+import time
+import heapq
+import threading
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+from .db import Table
+from .utils import iterbetter
+
+__all__ = ["ShardSelect", "ShardExecutor"]
+
+_DONE = object()
+
+# the filters of `Select` that a `ShardSelect` replays on every shard.
+_FILTERS = ("filter", "eq", "ne", "lt", "lte", "gt", "gte", "like",
+            "not_like", "between", "in_", "not_in")
+
+
+class _Desc(object):
+    """Reverses the order of a sort key."""
+    __slots__ = ["key"]
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def _getter(fields):
+    def key(row):
+        if isinstance(row, dict):
+            return tuple(row[field] for field in fields)
+        return tuple(getattr(row, field) for field in fields)
+
+    return key
+
+
+def _merge(iterators, key, reverse):
+    """k-way merge of sorted iterators, one row of each in the heap."""
+    heap = []
+    for index, iterator in enumerate(iterators):
+        for row in iterator:
+            k = key(row)
+            heap.append((_Desc(k) if reverse else k, index, row))
+            break
+    heapq.heapify(heap)
+    while heap:
+        _, index, row = heap[0]
+        yield row
+        for row in iterators[index]:
+            k = key(row)
+            heapq.heapreplace(heap, (_Desc(k) if reverse else k, index, row))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+class ShardExecutor(object):
+    """
+    Daemon threads running the per shard reads of the selects of a router,
+    kept across queries. A query takes one thread per shard, all at once,
+    so that the shards of an ordered merge all run. `workers` threads are
+    kept, more when a query has more shards. A query never waits for
+    threads held by the streams of another one (e.g. a select run while
+    iterating a stream): it starts more, which end once enough threads
+    are free again.
+    """
+    def __init__(self, workers=8):
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._threads = []
+        self._free = 0
+        self._keep = self.workers
+        self._queue = Queue()
+
+    def _work(self):
+        while True:
+            job, args = self._queue.get()
+            try:
+                job(*args)
+            except Exception:
+                pass
+            with self._cond:
+                if self._free >= self._keep:
+                    self._threads.remove(threading.current_thread())
+                    return
+                self._free += 1
+
+    def run(self, jobs):
+        """Starts the `(job, args)` of `jobs` on free threads, starting
+        threads for the jobs that find none."""
+        with self._cond:
+            if self._pid != os.getpid():
+                # the threads of the parent are gone in a forked child.
+                self._reset()
+            self._keep = max(self._keep, len(jobs))
+            while self._free < len(jobs):
+                thread = threading.Thread(
+                    target=self._work,
+                    name="crystaldb-shard-%d" % len(self._threads))
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+                self._free += 1
+            self._free -= len(jobs)
+        for job in jobs:
+            self._queue.put(job)
+
+
+class _ShardStream(object):
+    """Reads one shard, putting batches of its rows, then `_DONE` or the
+    error, on `queue`. It runs on a worker of a `ShardExecutor`, on a
+    connection of its own, without the worker's thread context."""
+    def __init__(self, index, database, sql, row_factory, queue, stopped,
+                 batch_size, timing):
+        self.index = index
+        self.database = database
+        self.sql = sql
+        self.row_factory = row_factory
+        self.queue = queue
+        self.stopped = stopped
+        self.batch_size = batch_size
+        self.timing = timing
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put((self.index, item), timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def run(self):
+        start = time.time()
+        timing = self.timing
+        try:
+            rows = self.database._stream(self.sql,
+                                         self.batch_size,
+                                         self.row_factory,
+                                         detached=True)
+            try:
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) < self.batch_size:
+                        continue
+                    if timing["first_row"] is None:
+                        timing["first_row"] = time.time() - start
+                    timing["rows"] += len(batch)
+                    if not self._put(batch):
+                        return
+                    batch = []
+                if batch:
+                    if timing["first_row"] is None:
+                        timing["first_row"] = time.time() - start
+                    timing["rows"] += len(batch)
+                    self._put(batch)
+            finally:
+                rows.close()
+            self._put(_DONE)
+        except Exception as e:
+            timing["error"] = e
+            self._put(e)
+        finally:
+            timing["seconds"] = time.time() - start
+
+
+class ShardSelect(object):
+    """
+    A select over every shard of a logical table, built by
+    `ShardRouter.select`. The filters of `Select` are recorded and
+    replayed on the select of every shard; a filter on the shard key with
+    one value sends the select to that shard only.
+    `timings` holds, after a run, one dict per shard: its table, rows,
+    seconds to the first batch (first_row), total seconds and error.
+    :example:
+        users = router.select("user").gt(age=18).order_by("age")
+        rows = users.limit(20)              # the 20 youngest of all shards
+        total = router.select("user").gt(age=18).count()
+    """
+    def __init__(self, router, table, fields=None, row_factory=None):
+        self.router = router
+        self.table = table
+        self.fields = fields
+        self.row_factory = row_factory
+        self.timings = []
+        self._ops = []
+        self._order = None
+        self._reversed = False
+        self._offset = 0
+        self._shard_value = None
+
+    def _add(self, name, *args, **kwargs):
+        self._ops.append((name, args, kwargs))
+        key = self.router.key
+        if name in ("filter", "eq", "filter_by") and key in kwargs and \
+                not isinstance(kwargs[key], (list, tuple)):
+            self._shard_value = (kwargs[key], )
+        return self
+
+    def _routes(self):
+        if self._shard_value is not None:
+            return [self.router.route(self.table, self._shard_value[0])]
+        return self.router.routes(self.table)
+
+    def _selects(self, routes, fields=None, row_factory=None, limit=None):
+        selects = []
+        for database, name in routes:
+            select = Table(database, name).select(
+                fields or self.fields, row_factory or self.row_factory)
+            for op, args, kwargs in self._ops:
+                getattr(select, op)(*args, **kwargs)
+            if limit is not None:
+                select._metadata._limit = limit
+            selects.append(select)
+        return selects
+
+    def _statement(self, select, row_factory=None):
+        """Returns (handle, sql, row_factory) of the select of a shard,
+        routed to a replica or to the primary by the calling thread."""
+        metadata = select._metadata
+        sql = metadata._query(_raw_sql_flag=True)
+        if row_factory is None:
+            row_factory = metadata._row_factory
+        if row_factory is None:
+            row_factory = metadata.database.row_factory
+        return metadata.database._route(sql), sql, row_factory
+
+    def _executor(self):
+        return self.router.executor
+
+    def filter_by(self, **kwargs):
+        return self._add("filter_by", **kwargs)
+
+    def order_by(self, order_vars, _reversed=False):
+        if isinstance(order_vars, (list, tuple)):
+            self._order = list(order_vars)
+        else:
+            self._order = [field.strip() for field in order_vars.split(",")]
+        self._reversed = _reversed
+        # as a list, every column gets the DESC the merge assumes.
+        return self._add("order_by", list(self._order), _reversed)
+
+    def offset(self, num):
+        self._offset = num
+        return self
+
+    def _timing(self, name):
+        return dict(table=name, rows=0, first_row=None, seconds=None,
+                    error=None)
+
+    def stream(self, batch_size=1000, limit=None):
+        """
+        Returns an `IterBetter` of the merged rows. Without `order_by`,
+        batches come in the order the shards produce them, so a slow shard
+        does not hold back the others. Closing it stops the shards.
+        """
+        pushed = None if limit is None else self._offset + limit
+        routes = self._routes()
+        selects = self._selects(routes, limit=pushed)
+        names = [name for _, name in routes]
+        self.timings = timings = [self._timing(name) for name in names]
+        stopped = threading.Event()
+        ordered = self._order is not None
+        if ordered:
+            queues = [Queue(4) for _ in selects]
+        else:
+            queues = [Queue(2 * len(selects) + 2)] * len(selects)
+        statements = [self._statement(select) for select in selects]
+        if ordered and any(row_factory == "tuple"
+                           for _, _, row_factory in statements):
+            raise ValueError("an ordered select over shards merges rows by "
+                             "column name, not tuples.")
+        jobs = []
+        for index, (database, sql, row_factory) in enumerate(statements):
+            stream = _ShardStream(index, database, sql, row_factory,
+                                  queues[index], stopped, batch_size,
+                                  timings[index])
+            jobs.append((stream.run, ()))
+        self._executor().run(jobs)
+
+        def shard_rows(index):
+            while True:
+                _, item = queues[index].get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                for row in item:
+                    yield row
+
+        def any_rows():
+            remaining = len(selects)
+            while remaining:
+                _, item = queues[0].get()
+                if item is _DONE:
+                    remaining -= 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                for row in item:
+                    yield row
+
+        def iterwrapper():
+            if ordered:
+                rows = _merge([shard_rows(i) for i in range(len(selects))],
+                              _getter(self._order), self._reversed)
+            else:
+                rows = any_rows()
+            try:
+                skip, left = self._offset, limit
+                for row in rows:
+                    if skip:
+                        skip -= 1
+                        continue
+                    if left is not None:
+                        if not left:
+                            break
+                        left -= 1
+                    yield row
+            finally:
+                stopped.set()
+
+        return iterbetter(iterwrapper(), on_close=stopped.set)
+
+    def all(self, batch_size=1000):
+        return list(self.stream(batch_size))
+
+    def limit(self, num):
+        """Returns the first `num` rows after `offset` over all the
+        shards, each shard reading at most offset + num rows."""
+        return list(self.stream(limit=num))
+
+    def first(self):
+        rows = self.limit(1)
+        return rows[0] if rows else None
+
+    def _gather(self, what):
+        """Runs `SELECT what` on every shard in parallel, returns the
+        rows of each."""
+        routes = self._routes()
+        selects = self._selects(routes, row_factory="tuple")
+        names = [name for _, name in routes]
+        self.timings = timings = [self._timing(name) for name in names]
+        results = [None] * len(selects)
+        done = threading.Semaphore(0)
+
+        def run(index, database, sql):
+            start = time.time()
+            try:
+                rows = database._stream(sql, row_factory="tuple",
+                                        detached=True)
+                try:
+                    results[index] = list(rows)
+                finally:
+                    rows.close()
+                timings[index]["rows"] = len(results[index])
+            except Exception as e:
+                timings[index]["error"] = e
+            finally:
+                timings[index]["seconds"] = time.time() - start
+                done.release()
+
+        jobs = []
+        for index, select in enumerate(selects):
+            select._metadata._what = what
+            database, sql, _ = self._statement(select, "tuple")
+            jobs.append((run, (index, database, sql)))
+        self._executor().run(jobs)
+        for _ in jobs:
+            done.acquire()
+        for timing in timings:
+            if timing["error"] is not None:
+                raise timing["error"]
+        return results
+
+    def count(self, distinct=None):
+        """
+        Returns the number of rows of all shards. A distinct count is a
+        sum of the per shard counts when `distinct` is the shard key,
+        otherwise the union of the distinct values of the shards.
+        """
+        if distinct and distinct != self.router.key:
+            values = set()
+            for rows in self._gather("DISTINCT %s" % distinct):
+                values.update(row[0] for row in rows)
+            return len(values)
+        what = "COUNT(DISTINCT %s)" % distinct if distinct else "COUNT(*)"
+        return sum(rows[0][0] for rows in self._gather(what))
+
+    def _values(self, expression):
+        return [rows[0][0] for rows in self._gather(expression)
+                if rows and rows[0][0] is not None]
+
+    def sum(self, field):
+        values = self._values("SUM(%s)" % field)
+        return sum(values) if values else None
+
+    def min(self, field):
+        values = self._values("MIN(%s)" % field)
+        return min(values) if values else None
+
+    def max(self, field):
+        values = self._values("MAX(%s)" % field)
+        return max(values) if values else None
+
+    def avg(self, field):
+        """The average over all rows, from the sum and the count of every
+        shard, not the average of the shard averages."""
+        total, count = 0, 0
+        for rows in self._gather("SUM(%s), COUNT(%s)" % (field, field)):
+            if rows and rows[0][1]:
+                total += rows[0][0]
+                count += rows[0][1]
+        return total / float(count) if count else None
+
+
+def _replay(name):
+    def method(self, **kwargs):
+        return self._add(name, **kwargs)
+
+    method.__name__ = name
+    method.__doc__ = "Replays `Select.%s` on every shard." % name
+    return method
+
+
+for _name in _FILTERS:
+    setattr(ShardSelect, _name, _replay(_name))
@@ -0,0 +1,279 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Shard router for sub-databases and sub-tables. A shard key value is
+#   hashed to one of `shards` shards, each shard living in one physical
+#   table of one database. Every route is computed once, when the router
+#   is built, so resolving one is a hash and a list index. During a
+#   rebalancing the router can dual-write to the routes of a new router.
+# ***********************************************************************
+
+import zlib
+import bisect
+import hashlib
+from .db import Table
+from .scatter import ShardSelect, ShardExecutor
+
+__all__ = ["ShardRouter", "DualTable", "METHODS"]
+
+METHODS = ("modulo", "hash", "consistent")
+
+
+def _crc32(value):
+    if not isinstance(value, bytes):
+        value = str(value).encode("utf-8")
+    return zlib.crc32(value) & 0xffffffff
+
+
+class _Ring(object):
+    """A consistent hash ring of `shards` shards, `vnodes` points each.
+    Adding shards moves about 1/shards of the keys."""
+    def __init__(self, shards, vnodes):
+        points = []
+        for shard in range(shards):
+            for i in range(vnodes):
+                digest = hashlib.md5(
+                    ("%s-%s" % (shard, i)).encode("utf-8")).hexdigest()
+                points.append((int(digest[:8], 16), shard))
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def __call__(self, value):
+        i = bisect.bisect(self._hashes, _crc32(value))
+        return self._shards[i % len(self._shards)]
+
+
+class DualTable(Table):
+    """
+    A `Table` of the current route whose writes are replayed on the table
+    of the new route, from `ShardRouter.dual_write`. Reads stay on the
+    current route. A key from the `id_generators` of the current handle
+    is generated once and written to both tables; an auto-increment id
+    is not known to the new one, so such writes must carry their keys.
+    """
+    def __init__(self, database, tables, new):
+        Table.__init__(self, database, tables)
+        self.new = new
+
+    def _keyed(self, values):
+        """Returns `values` with the key of the id generator of the table
+        filled, when it has one and the key is missing."""
+        generator = self.database._id_generator(self.tables)
+        if generator is None or generator[0] in values:
+            return values
+        column, ids = generator
+        values = dict(values)
+        values[column] = ids.next_id()
+        return values
+
+    def insert(self,
+               seqname=None,
+               test=False,
+               default=None,
+               ignore=False,
+               **values):
+        values = self._keyed(values)
+        out = Table.insert(self, seqname, test, default, ignore, **values)
+        self.new.insert(None, test, default, ignore, **values)
+        return out
+
+    def insert_duplicate_update(self,
+                                where,
+                                vars=None,
+                                seqname=None,
+                                test=False,
+                                **values):
+        if not where:
+            # a plain insert then, see `Insert.insert_duplicate_update`.
+            values = self._keyed(values)
+        out = Table.insert_duplicate_update(self, where, vars, seqname, test,
+                                            **values)
+        self.new.insert_duplicate_update(where, vars, None, test, **values)
+        return out
+
+    def update(self, where, vars=None, test=None, **values):
+        out = Table.update(self, where, vars, test, **values)
+        self.new.update(where, vars, test, **values)
+        return out
+
+    def delete(self, where, using=None, vars=None, test=False):
+        out = Table.delete(self, where, using, vars, test)
+        self.new.delete(where, using, vars, test)
+        return out
+
+
+class ShardRouter(object):
+    """
+    Routes logical tables to their physical table and database.
+    :param databases: the sub-databases, in shard order. Each one is a
+        `DB` handle, or a dict of connection params with its "db": such
+        dicts on the same host (host, port and user) share one handle,
+        so one pool per physical host, and their tables are qualified
+        with their database name.
+    :param key: the name of the shard key, e.g. "user_id".
+    :param shards: the number of shards (sub-tables), the default is one
+        per database. Shards are spread over the databases in contiguous
+        ranges: with 4 databases and 64 shards, shards 0 to 15 are in the
+        first one.
+    :param method: "modulo" (the key is an integer), "hash" (crc32 of the
+        key) or "consistent" (a consistent hash ring over the shards).
+    :param tables: dict of logical table name to the template of its
+        physical name, formatted with `table` and `shard`. The default
+        template is "{table}_{shard}".
+    :param factory: builds a handle from a dict of params, the default is
+        `crystaldb.database`.
+    :param vnodes: the points per shard on the consistent hash ring.
+    :param workers: the threads of the scatter-gather selects, kept for
+        all the selects of the router; a select over more shards adds
+        threads up to its number of shards.
+    :example:
+        router = ShardRouter([db_a, db_b], key="user_id", shards=64)
+        router.table("user", user_id=123).select().where(user_id=123).all()
+        # runs on db_b, in the table user_59
+    """
+    default_template = "{table}_{shard}"
+
+    def __init__(self,
+                 databases,
+                 key,
+                 shards=None,
+                 method="modulo",
+                 tables=None,
+                 factory=None,
+                 vnodes=64,
+                 workers=8):
+        if method not in METHODS:
+            raise ValueError("unknown shard method: %s" % method)
+        if not databases:
+            raise ValueError("a shard router needs databases.")
+        self.key = key
+        self.shards = shards or len(databases)
+        if self.shards < len(databases):
+            raise ValueError("fewer shards than databases.")
+        self.method = method
+        self.templates = dict(tables or {})
+        self.executor = ShardExecutor(workers)
+        self._handles = {}
+        self._databases = [self._handle(database, factory)
+                           for database in databases]
+        if method == "modulo":
+            self._shard_of = self._modulo
+        elif method == "hash":
+            self._shard_of = self._hash
+        else:
+            self._shard_of = _Ring(self.shards, vnodes)
+        # shard -> (handle, schema), then table -> [(handle, name)].
+        count = len(self._databases)
+        self._placement = [
+            self._databases[shard * count // self.shards]
+            for shard in range(self.shards)
+        ]
+        self._routes = {}
+        self._dual = None
+        for table in self.templates:
+            self._add_routes(table)
+
+    def _handle(self, database, factory):
+        """Returns (handle, schema) for one entry of `databases`."""
+        if not isinstance(database, dict):
+            return database, None
+        params = dict(database)
+        schema = params.get("db")
+        host = (params.get("host"), params.get("port"),
+                params.get("username") or params.get("user"))
+        handle = self._handles.get(host)
+        if handle is None:
+            if factory is None:
+                from . import database as factory
+                params.setdefault("dbn", "mysql")
+            handle = self._handles[host] = factory(**params)
+        return handle, schema
+
+    def _modulo(self, value):
+        return int(value) % self.shards
+
+    def _hash(self, value):
+        return _crc32(value) % self.shards
+
+    def _add_routes(self, table):
+        template = self.templates.get(table, self.default_template)
+        routes = []
+        for shard, (handle, schema) in enumerate(self._placement):
+            name = template.format(table=table, shard=shard)
+            if schema:
+                name = "%s.%s" % (schema, name)
+            routes.append((handle, name))
+        self._routes[table] = routes
+        return routes
+
+    def shard(self, value):
+        """Returns the shard of a shard key value."""
+        return self._shard_of(value)
+
+    def route(self, table, value):
+        """Returns (handle, physical table name) of `table` for the shard
+        key `value`."""
+        routes = self._routes.get(table)
+        if routes is None:
+            routes = self._add_routes(table)
+        return routes[self._shard_of(value)]
+
+    def routes(self, table):
+        """Returns the (handle, physical table name) of every shard of
+        `table`, in shard order."""
+        routes = self._routes.get(table)
+        if routes is None:
+            routes = self._add_routes(table)
+        return list(routes)
+
+    def table(self, table, **key):
+        """
+        Returns a `Table` bound to the handle and the physical table of
+        `table` for the shard key given as keyword.
+        :example:
+            router.table("user", user_id=123).insert(user_id=123, name="x")
+        """
+        if self.key not in key:
+            raise ValueError("the shard key %s is required." % self.key)
+        route = self.route(table, key[self.key])
+        dual = self._dual
+        if dual is not None:
+            new = dual.route(table, key[dual.key])
+            if new != route:
+                return DualTable(route[0], route[1], Table(*new))
+        return Table(*route)
+
+    def dual_write(self, router):
+        """
+        Replays the writes of `table()` on their route in `router` too,
+        for the cutover to a new shard layout: writes go to both while
+        `crystaldb.migrate.rebalance` copies the rows, then the
+        application switches to `router`. None stops it. Both routers
+        must shard on the same key.
+        :example:
+            router.dual_write(ShardRouter(new_dbs, key="user_id", shards=8))
+        """
+        if router is not None and router.key != self.key:
+            raise ValueError("the new router shards on %s, not on %s." %
+                             (router.key, self.key))
+        self._dual = router
+
+    def select(self, table, fields=None, row_factory=None):
+        """
+        Returns a `ShardSelect` of `table` over every shard, run in
+        parallel and merged, see `crystaldb.scatter.ShardSelect`.
+        :example:
+            router.select("user").gt(age=18).order_by("age").limit(10)
+        """
+        return ShardSelect(self, table, fields, row_factory)
+
+    def databases(self):
+        """Returns the distinct handles of the router."""
+        handles = []
+        for handle, _ in self._databases:
+            if handle not in handles:
+                handles.append(handle)
+        return handles
@@ -0,0 +1,221 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+# ***********************************************************************
+# Function:
+#   Result set memory budget. Rows are sized as they are fetched, and once
+#   the budget is used up the query either raises or spills the remaining
+#   raw rows to a memory-mapped temp file that the result reads back.
+# ***********************************************************************
+
+import sys
+import mmap
+import pickle
+import bisect
+import tempfile
+import threading
+from .utils import LRUCache
+from .exception import MemoryLimitExceeded
+from .querylog import fingerprint
+
+__all__ = ["SpilledResult", "MemoryStats", "fetch_budgeted", "row_size"]
+
+POLICIES = ("raise", "spill")
+
+
+def row_size(row, raw=None):
+    """Approximate bytes held by a result row and its values. Given the
+    `raw` tuple the row was made from, the values are sized from it, so a
+    `LazyRow` is not decoded to be sized."""
+    getsizeof = sys.getsizeof
+    if raw is None:
+        raw = row.values() if isinstance(row, dict) else row
+    return getsizeof(row) + sum(getsizeof(v) for v in raw)
+
+
+class SpilledResult(object):
+    """
+    A result set partly kept on disk. The first rows are in memory, the
+    rest are pickled in batches to a temp file, read back through `mmap`
+    and turned into rows as they are iterated. Supports `len`, iteration
+    and indexing like the list returned by `DB.query`.
+    """
+    def __init__(self, rows, make_row, spill_dir=None):
+        self.rows = rows
+        self.make_row = make_row
+        self.nbytes = 0
+        self._file = tempfile.TemporaryFile(dir=spill_dir)
+        self._offsets = [0]
+        self._starts = []
+        self._spilled = 0
+        self._mmap = None
+        self._cache = (None, None)
+        self._lock = threading.Lock()
+
+    def spill(self, raw_rows):
+        """Appends a batch of raw rows to the temp file."""
+        self._starts.append(self._spilled)
+        pickle.dump(list(raw_rows), self._file, pickle.HIGHEST_PROTOCOL)
+        self._offsets.append(self._file.tell())
+        self._spilled += len(raw_rows)
+
+    @property
+    def spilled_rows(self):
+        return self._spilled
+
+    @property
+    def spilled_bytes(self):
+        return self._offsets[-1]
+
+    def _batch(self, i):
+        index, batch = self._cache
+        if index == i:
+            return batch
+        with self._lock:
+            if self._mmap is None:
+                self._file.flush()
+                self._mmap = mmap.mmap(self._file.fileno(),
+                                       0,
+                                       access=mmap.ACCESS_READ)
+        batch = pickle.loads(
+            self._mmap[self._offsets[i]:self._offsets[i + 1]])
+        self._cache = (i, batch)
+        return batch
+
+    def __len__(self):
+        return len(self.rows) + self._spilled
+
+    def __iter__(self):
+        for row in self.rows:
+            yield row
+        make_row = self.make_row
+        for i in range(len(self._starts)):
+            for row in self._batch(i):
+                yield make_row(row)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("result index out of range")
+        if i < len(self.rows):
+            return self.rows[i]
+        i -= len(self.rows)
+        batch = bisect.bisect_right(self._starts, i) - 1
+        return self.make_row(self._batch(batch)[i - self._starts[batch]])
+
+    def __bool__(self):
+        return len(self) > 0
+
+    __nonzero__ = __bool__
+
+    def close(self):
+        """Closes and removes the temp file."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._cache = (None, None)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __repr__(self):
+        return "<SpilledResult: %d rows, %d on disk>" % (len(self),
+                                                          self._spilled)
+
+
+class MemoryStats(object):
+    """
+    Bytes materialized per query fingerprint, for the queries run with a
+    memory budget. The most recent `maxsize` fingerprints are kept.
+    :example:
+        for item in db_handle.memory_stats.top(10):
+            print(item["fingerprint"], item["max_bytes"])
+    """
+    def __init__(self, maxsize=512):
+        self._stats = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def record(self, query, nbytes, rows, spilled):
+        key = fingerprint(query)
+        with self._lock:
+            item = self._stats.get(key)
+            if item is None:
+                item = dict(fingerprint=key,
+                            calls=0,
+                            bytes=0,
+                            max_bytes=0,
+                            rows=0,
+                            spilled=0)
+                self._stats.set(key, item)
+            item["calls"] += 1
+            item["bytes"] += nbytes
+            item["max_bytes"] = max(item["max_bytes"], nbytes)
+            item["rows"] += rows
+            item["spilled"] += spilled
+
+    def top(self, n=None, key="max_bytes"):
+        """Returns the stats sorted by `key`, biggest first."""
+        with self._lock:
+            items = [dict(x) for x in self._stats.values()]
+        items.sort(key=lambda x: x[key], reverse=True)
+        return items[:n] if n else items
+
+    def clear(self):
+        self._stats.clear()
+
+
+def fetch_budgeted(cursor,
+                   make_row,
+                   limit,
+                   policy="raise",
+                   batch_size=1000,
+                   spill_dir=None):
+    """
+    Fetches the rows of an executed `cursor` while counting their bytes.
+    Past `limit` bytes, raises `MemoryLimitExceeded` with `policy="raise"`,
+    or with `policy="spill"` writes the remaining rows to a temp file and
+    returns a `SpilledResult`.
+    :return : (rows, nbytes), rows being a list or a `SpilledResult` and
+        nbytes the bytes held in memory.
+    """
+    if policy not in POLICIES:
+        raise ValueError("unknown memory policy: %s" % policy)
+    out = []
+    nbytes = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return out, nbytes
+        for i, raw in enumerate(rows):
+            row = make_row(raw)
+            nbytes += row_size(row, raw)
+            out.append(row)
+            if nbytes > limit:
+                break
+        else:
+            continue
+        break
+
+    if policy == "raise":
+        raise MemoryLimitExceeded(nbytes, limit, len(out))
+
+    result = SpilledResult(out, make_row, spill_dir)
+    rows = rows[i + 1:]
+    while rows:
+        result.spill(rows)
+        rows = cursor.fetchmany(batch_size)
+    result.nbytes = nbytes
+    return result, nbytes
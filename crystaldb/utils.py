@@ -6,9 +6,21 @@
 # Created Time: 2018-08-25 16:01:39
 # ***********************************************************************
 
+import re
+import json
+import codecs
+import keyword
+import weakref
+import operator
+import threading
+import itertools
+from collections import OrderedDict
 from threading import local as threadlocal
 from .compat import (iteritems, iterkeys, itervalues, is_iter, imap, PY2,
-                     text_type)
+                     text_type, string_types)
+from .config import FIELD_TYPE
+
+_identifier_re = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
 
 
 def add_space(string, symbol=" ", direction="all"):
@@ -78,14 +90,12 @@ class ThreadedDict(threadlocal):
         >>> d.x
         1
     """
-    _instances = set()
+    # weak, so that the instance of a discarded handle can be collected.
+    _instances = weakref.WeakSet()
 
     def __init__(self):
         ThreadedDict._instances.add(self)
 
-    def __del__(self):
-        ThreadedDict._instances.remove(self)
-
     def __hash__(self):
         return id(self)
 
@@ -248,8 +258,13 @@ class IterBetter:
         []
     """
 
-    def __init__(self, iterator):
+    def __init__(self, iterator, on_close=None):
+        """
+        :param on_close: optional callable run once by `close`, to release
+            what the iterator holds (cursor, connection).
+        """
         self.i, self.c = iterator, 0
+        self._on_close = on_close
 
     def first(self, default=None):
         """Returns the first element of the iterator or None when there are no
@@ -265,25 +280,62 @@ class IterBetter:
 
     def __iter__(self):
         if hasattr(self, "_head"):
-            yield self._head
-        while 1:
-            yield next(self.i)
+            head = self._head
+            del self._head
+            self.c += 1
+            yield head
+        for value in self.i:
             self.c += 1
+            yield value
 
     def __getitem__(self, i):
-        # todo: slices
+        """
+        Slices are forward only as well, and return an `IterBetter`.
+
+            >>> c = iterbetter(iter(range(10)))
+            >>> list(c[2:5])
+            [2, 3, 4]
+            >>> c[6]
+            6
+            >>> list(c[8:])
+            [8, 9]
+        """
+        if isinstance(i, slice):
+            start = i.start or 0
+            if start < self.c:
+                raise IndexError("already passed " + str(start))
+            stop = i.stop if i.stop is None else max(i.stop - self.c, 0)
+            return iterbetter(
+                itertools.islice(iter(self), start - self.c, stop, i.step))
         if i < self.c:
             raise IndexError("already passed " + str(i))
+        it = iter(self)
         try:
             while i > self.c:
-                next(self.i)
-                self.c += 1
+                next(it)
             # now self.c == i
-            self.c += 1
-            return next(self.i)
+            return next(it)
         except StopIteration:
             raise IndexError(str(i))
 
+    def close(self):
+        """Stops the iteration and releases what the iterator holds."""
+        if hasattr(self.i, "close"):
+            self.i.close()
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, "_on_close", None) is not None:
+            self.close()
+
     def __nonzero__(self):
         if hasattr(self, "__len__"):
             return self.__len__() != 0
@@ -301,3 +353,393 @@ class IterBetter:
 
 
 iterbetter = IterBetter
+
+
+class LRUCache(object):
+    """
+    A thread safe, bounded mapping that discards the least recently used
+    entry when it is full, and counts hits and misses.
+
+        >>> c = LRUCache(maxsize=2)
+        >>> c.set('a', 1)
+        >>> c.set('b', 2)
+        >>> c.get('a')
+        1
+        >>> c.set('c', 3)
+        >>> c.get('b') is None
+        True
+        >>> sorted(c.stats().items())
+        [('hits', 1), ('maxsize', 2), ('misses', 1), ('size', 2)]
+    """
+
+    def __init__(self, maxsize=128, on_evict=None):
+        """
+        :param maxsize: the maximum number of entries, 0 means unbounded.
+        :param on_evict: an optional callable `on_evict(key, value)` run
+            for every entry dropped to make room or removed by `clear`.
+        """
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            evicted = self._shrink()
+        self._evict(evicted)
+
+    def resize(self, maxsize):
+        """Changes the capacity, dropping the oldest entries if needed."""
+        with self._lock:
+            self.maxsize = maxsize
+            evicted = self._shrink()
+        self._evict(evicted)
+
+    def clear(self):
+        with self._lock:
+            evicted = list(self._data.items())
+            self._data.clear()
+            self.hits = self.misses = 0
+        self._evict(evicted)
+
+    def _shrink(self):
+        evicted = []
+        while self.maxsize and len(self._data) > self.maxsize:
+            evicted.append(self._data.popitem(last=False))
+        return evicted
+
+    def _evict(self, evicted):
+        # run outside the lock, the callback may be slow (network I/O).
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+    def values(self):
+        """Returns a list of the values, oldest first."""
+        with self._lock:
+            return list(self._data.values())
+
+    def stats(self):
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    size=len(self._data),
+                    maxsize=self.maxsize)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class Row(tuple):
+    """
+    A result row stored as a tuple, with attribute and key access by column
+    name like `Storage`. Subclasses are made per column set by `row_class`.
+
+        >>> Person = row_class(("id", "name"))
+        >>> r = Person((1, "joe"))
+        >>> r.name, r["id"], r[1]
+        ('joe', 1, 'joe')
+        >>> r
+        Row(id=1, name='joe')
+        >>> r.get("age", 20), dict(r.items())["id"]
+        (20, 1)
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, string_types):
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._fields)
+
+    def values(self):
+        return list(self)
+
+    def items(self):
+        return list(zip(self._fields, self))
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return "Row(%s)" % ", ".join(
+            "%s=%r" % (name, value) for name, value in zip(self._fields, self))
+
+
+_row_classes = LRUCache(maxsize=256)
+
+
+def row_class(names):
+    """
+    Returns the `Row` subclass for the column `names`, built once per
+    column tuple and cached.
+    """
+    names = tuple(names)
+    cls = _row_classes.get(names)
+    if cls is None:
+        index = dict((name, i) for i, name in enumerate(names))
+        attrs = dict(__slots__=(), _fields=names, _index=index)
+        for name, i in iteritems(index):
+            # columns may shadow tuple methods, but not the mapping api.
+            if not _identifier_re.match(name) or keyword.iskeyword(name) \
+                    or name.startswith("_") or name in Row.__dict__:
+                continue
+            attrs[name] = property(operator.itemgetter(i))
+        cls = type(str("Row"), (Row, ), attrs)
+        _row_classes.set(names, cls)
+    return cls
+
+
+class _Raw(object):
+    """A column value kept as fetched until it is read."""
+    __slots__ = ["data", "decode"]
+
+    def __init__(self, data, decode):
+        self.data = data
+        self.decode = decode
+
+    def __repr__(self):
+        return "<raw %d bytes>" % len(self.data)
+
+
+class LazyRow(Storage):
+    """
+    A `Storage` row whose heavy columns are decoded on first access. The
+    decoded value replaces the raw one, so each column is decoded once.
+    `dict` methods that bypass item access (`dict(row)`, `json.dumps`) see
+    the raw values until `decode_all` is called.
+
+        >>> make_row = LazyRows(columns={"doc": "json"}).converter(["id", "doc"])
+        >>> r = make_row((1, b'{"a": 1}'))
+        >>> dict.__getitem__(r, "doc")
+        <raw 8 bytes>
+        >>> r.doc["a"], r["doc"] is r.doc
+        (1, True)
+    """
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if type(value) is _Raw:
+            value = value.decode(value.data)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def decode_all(self):
+        """Decodes every pending column, returns the row."""
+        for key in self:
+            self[key]
+        return self
+
+    def __repr__(self):
+        return '<LazyRow ' + dict.__repr__(self) + '>'
+
+
+def _text(value, encoding="utf-8"):
+    if isinstance(value, string_types) and not isinstance(value, bytes):
+        return value
+    # decodes bytes, bytearray and memoryview without copying them first.
+    return codecs.decode(value, encoding)
+
+
+def _json(value, encoding="utf-8"):
+    if value is None:
+        return None
+    return json.loads(_text(value, encoding))
+
+
+def _raw(value, encoding=None):
+    return value
+
+
+_decoders = dict(json=_json, text=_text, raw=_raw)
+
+_BLOB_TYPES = (FIELD_TYPE.TINY_BLOB, FIELD_TYPE.MEDIUM_BLOB,
+               FIELD_TYPE.LONG_BLOB, FIELD_TYPE.BLOB)
+
+
+class LazyRows(object):
+    """
+    The row factory of `LazyRow` rows. Heavy columns are chosen by name
+    or by the type code of `cursor.description`, and kept as fetched
+    (`bytearray` values as a `memoryview` over the driver's buffer) until
+    first read.
+    :param columns: dict of column name to decoder, or a list of names
+        decoded by their type code. Decoders are "json", "text" (bytes
+        to str), "raw" (no decoding) or a callable taking the raw value.
+    :param types: dict of type code to decoder, or a list of type codes.
+        The default is JSON columns as "json" and BLOB/TEXT columns as
+        "raw" when `columns` is not given.
+    :param encoding: the encoding of "text" and "json" columns.
+    :example:
+        rows = LazyRows(columns={"payload": "json", "body": "text"})
+        db_handle.select("event", row_factory=rows).all()
+    """
+    def __init__(self, columns=None, types=None, encoding="utf-8"):
+        if types is None and columns is None:
+            types = dict((code, "raw") for code in _BLOB_TYPES)
+            types[FIELD_TYPE.JSON] = "json"
+        self.columns = self._decoders(columns)
+        self.types = self._decoders(types)
+        self.encoding = encoding
+
+    def _decoders(self, spec):
+        if spec is None:
+            return {}
+        if not isinstance(spec, dict):
+            spec = dict((key, None) for key in spec)
+        return dict((key, self._decoder(value))
+                    for key, value in iteritems(spec))
+
+    @staticmethod
+    def _decoder(value):
+        if value is None or callable(value):
+            return value
+        try:
+            return _decoders[value]
+        except KeyError:
+            raise ValueError("unknown decoder: %r" % (value, ))
+
+    def _type_decoder(self, type_code):
+        if type_code == FIELD_TYPE.JSON:
+            return _json
+        return _raw
+
+    def converter(self, names, description=None):
+        """Returns the function converting a fetched tuple into a
+        `LazyRow`."""
+        type_codes = [d[1] for d in description] if description else \
+            [None] * len(names)
+        lazy = []
+        for i, (name, type_code) in enumerate(zip(names, type_codes)):
+            if name in self.columns:
+                decode = self.columns[name] or self._type_decoder(type_code)
+            elif type_code in self.types:
+                decode = self.types[type_code] or \
+                    self._type_decoder(type_code)
+            else:
+                continue
+            if decode is _raw:
+                lazy.append((i, None))
+            elif decode in (_json, _text):
+                encoding = self.encoding
+                lazy.append(
+                    (i, lambda value, decode=decode: decode(value, encoding)))
+            else:
+                lazy.append((i, decode))
+
+        if not lazy:
+            return lambda row: LazyRow(zip(names, row))
+
+        def make_row(row):
+            row = list(row)
+            for i, decode in lazy:
+                value = row[i]
+                if value is None:
+                    continue
+                if isinstance(value, bytearray):
+                    value = memoryview(value)
+                if decode is not None:
+                    row[i] = _Raw(value, decode)
+                else:
+                    row[i] = value
+            return LazyRow(zip(names, row))
+
+        return make_row
+
+
+def row_converter(kind, names, description=None):
+    """
+    Returns the function converting a fetched tuple into a result row.
+    :param kind: "storage" for `Storage` dicts (default), "row" for
+        `Row` tuples, "dict" for plain dicts, "tuple" for the raw tuples,
+        "lazy" or a `LazyRows`
+        for `LazyRow` dicts decoding heavy columns on access, or a
+        callable taking the column names and returning the converter.
+    :param description: the cursor description, used by lazy rows.
+
+        >>> row_converter("row", ["a"])((1, ))
+        Row(a=1)
+        >>> row_converter(None, ["a"])((1, ))
+        <Storage {'a': 1}>
+    """
+    if kind is None or kind == "storage":
+        return lambda row: Storage(zip(names, row))
+    elif kind == "row":
+        return row_class(names)
+    elif kind == "dict":
+        return lambda row: dict(zip(names, row))
+    elif kind == "tuple":
+        return tuple
+    elif kind == "lazy":
+        return LazyRows().converter(names, description)
+    elif isinstance(kind, LazyRows):
+        return kind.converter(names, description)
+    elif callable(kind):
+        return kind(names)
+    raise ValueError("unknown row factory: %r" % (kind, ))
+
+
+def column_flags(cursor):
+    """
+    Returns (flags, charset number) of every column of an executed
+    `cursor`, which `cursor.description` leaves out: from the
+    `description_flags` of MySQLdb, the result fields of pymysql, or the
+    longer description of mysql.connector. Unknown values are None.
+    """
+    description = cursor.description or ()
+    out = [(None, None)] * len(description)
+    flags = getattr(cursor, "description_flags", None)
+    if flags:
+        # MySQLdb
+        return [(flag or 0, None) for flag in flags]
+    fields = getattr(getattr(cursor, "_result", None), "fields", None)
+    if fields and len(fields) == len(description):
+        # pymysql
+        return [(getattr(field, "flags", None),
+                 getattr(field, "charsetnr", None)) for field in fields]
+    if description and len(description[0]) > 8:
+        # mysql.connector: ..., null_ok, flags, charset
+        return [(d[7] or 0, d[8]) for d in description]
+    return out
@@ -0,0 +1,102 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import decimal
+import datetime
+import pytest
+from crystaldb.config import FIELD_TYPE, FIELD_FLAG
+from crystaldb.columnar import fetch_columns, to_dataframe, column_dtype
+
+numpy = pytest.importorskip("numpy")
+
+
+class _Cursor(object):
+    """An executed cursor over `rows`, with MySQLdb's `description_flags`
+    when `flags` are given."""
+    def __init__(self, columns, rows, flags=None):
+        self.description = tuple(
+            (name, type_code, None, None, None, None, True)
+            for name, type_code in columns)
+        if flags is not None:
+            self.description_flags = flags
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        out, self.rows = self.rows[:size], self.rows[size:]
+        return out
+
+
+class TestColumnar(object):
+    def test_dtypes(self):
+        assert column_dtype(FIELD_TYPE.LONG) == "int64"
+        assert column_dtype(FIELD_TYPE.LONGLONG,
+                            FIELD_FLAG.UNSIGNED) == "uint64"
+        assert column_dtype(FIELD_TYPE.NEWDECIMAL) == "object"
+        assert column_dtype(FIELD_TYPE.DATE) == "datetime64[D]"
+
+    def test_null_mask(self):
+        cursor = _Cursor([("id", FIELD_TYPE.LONG),
+                          ("score", FIELD_TYPE.DOUBLE)],
+                         [(1, 0.5), (None, 1.5), (3, None)])
+        columns = fetch_columns(cursor, batch_size=2)
+        assert list(columns["id"].mask) == [False, True, False]
+        assert columns["id"].compressed().tolist() == [1, 3]
+        assert columns["score"].dtype == numpy.float64
+        assert list(columns["score"].mask) == [False, False, True]
+
+    def test_dates_and_decimals(self):
+        cursor = _Cursor([("day", FIELD_TYPE.DATE),
+                          ("at", FIELD_TYPE.DATETIME),
+                          ("amount", FIELD_TYPE.NEWDECIMAL)],
+                         [(datetime.date(2026, 1, 2),
+                           datetime.datetime(2026, 1, 2, 10, 30),
+                           decimal.Decimal("1.10")),
+                          (None, None, None)])
+        columns = fetch_columns(cursor)
+        assert str(columns["day"][0]) == "2026-01-02"
+        assert numpy.isnat(columns["day"][1]) and \
+            numpy.isnat(columns["at"][1])
+        assert str(columns["at"][0]) == "2026-01-02T10:30:00.000000"
+        assert columns["amount"].dtype == object
+        assert columns["amount"][0] == decimal.Decimal("1.10")
+
+    def test_zero_dates(self):
+        # pymysql hands back the dates it cannot convert as strings.
+        cursor = _Cursor([("day", FIELD_TYPE.DATE),
+                          ("at", FIELD_TYPE.DATETIME)],
+                         [("2026-01-02", "2026-01-02 10:30:00"),
+                          ("0000-00-00", "0000-00-00 00:00:00")])
+        columns = fetch_columns(cursor)
+        assert str(columns["day"][0]) == "2026-01-02"
+        assert numpy.isnat(columns["day"][1]) and \
+            numpy.isnat(columns["at"][1])
+
+    def test_unsigned(self):
+        big = 2**64 - 1
+        rows = [(1, ), (None, ), (big, )]
+        columns = fetch_columns(
+            _Cursor([("id", FIELD_TYPE.LONGLONG)], rows,
+                    flags=(FIELD_FLAG.UNSIGNED, )))
+        assert columns["id"].dtype == numpy.uint64
+        assert columns["id"].compressed().tolist() == [1, big]
+        # without the flags, the values are kept as python ints.
+        columns = fetch_columns(_Cursor([("id", FIELD_TYPE.LONGLONG)],
+                                        rows))
+        assert columns["id"].tolist() == [1, None, big]
+
+    def test_pymysql_flags(self):
+        cursor = _Cursor([("id", FIELD_TYPE.LONGLONG)], [(2**63, )])
+        field = type("Field", (object, ), dict(flags=FIELD_FLAG.UNSIGNED,
+                                               charsetnr=63))
+        cursor._result = type("Result", (object, ), dict(fields=[field]))
+        assert fetch_columns(cursor)["id"].dtype == numpy.uint64
+
+    def test_dataframe(self):
+        pandas = pytest.importorskip("pandas")
+        cursor = _Cursor([("id", FIELD_TYPE.LONG),
+                          ("name", FIELD_TYPE.VAR_STRING)],
+                         [(1, "a"), (2, "b")])
+        frame = to_dataframe(fetch_columns(cursor))
+        assert isinstance(frame, pandas.DataFrame)
+        assert frame["id"].tolist() == [1, 2]
+        assert frame["name"].tolist() == ["a", "b"]
@@ -0,0 +1,84 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import io
+import gzip
+import json
+import datetime
+import pytest
+from crystaldb.config import FIELD_TYPE, FIELD_FLAG
+from crystaldb.export import export_cursor
+
+
+class _Cursor(object):
+    description = (("id", 8, None, None, 20, 0, False),
+                   ("created", 12, None, None, None, None, True))
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        out, self.rows = self.rows[:size], self.rows[size:]
+        return out
+
+
+class _BlobCursor(_Cursor):
+    """A text and a binary column, with MySQLdb's `description_flags`."""
+    description = (("name", FIELD_TYPE.VAR_STRING, None, None, None, None,
+                    True), ("data", FIELD_TYPE.BLOB, None, None, None, None,
+                            True))
+    description_flags = (0, FIELD_FLAG.BINARY | FIELD_FLAG.BLOB)
+
+
+class TestExport(object):
+    rows = [(i, datetime.datetime(2026, 1, 1) if i % 2 else None)
+            for i in range(5)]
+
+    def test_csv_gzip(self, tmpdir):
+        path = str(tmpdir.join("out.csv.gz"))
+        progress = []
+        assert export_cursor(_Cursor(self.rows), path, batch_size=2,
+                             progress=lambda n, t: progress.append(n)) == 5
+        assert progress == [2, 4, 5]
+        lines = gzip.open(path, "rt").read().splitlines()
+        assert lines[:3] == ["id,created", "0,", "1,2026-01-01 00:00:00"]
+
+    def test_jsonl(self, tmpdir):
+        path = str(tmpdir.join("out.jsonl"))
+        export_cursor(_Cursor(self.rows), path, format="jsonl")
+        with io.open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        assert rows[1] == {"id": 1, "created": "2026-01-01T00:00:00"}
+        assert len(rows) == 5
+
+    blobs = [(None, None), (u"b", b"\x00\xff"), (u"c", b"")]
+
+    def test_csv_binary(self, tmpdir):
+        path = str(tmpdir.join("out.csv"))
+        export_cursor(_BlobCursor(self.blobs), path)
+        with io.open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        assert lines == ["name,data", ",", "b,00ff", "c,"]
+
+    def test_parquet_binary(self, tmpdir):
+        pytest.importorskip("pyarrow")
+        import pyarrow.parquet
+        path = str(tmpdir.join("out.parquet"))
+        # the first batch is all NULL: the types come from the flags.
+        assert export_cursor(_BlobCursor(self.blobs), path, format="parquet",
+                             batch_size=1) == 3
+        table = pyarrow.parquet.read_table(path)
+        assert str(table.schema.field("name").type) == "string"
+        assert str(table.schema.field("data").type) == "binary"
+        assert table.column("data").to_pylist() == [None, b"\x00\xff", b""]
+        assert table.column("name").to_pylist() == [None, u"b", u"c"]
+
+    def test_parquet(self, tmpdir):
+        pytest.importorskip("pyarrow")
+        import pyarrow.parquet
+        path = str(tmpdir.join("out.parquet"))
+        export_cursor(_Cursor(self.rows), path, format="parquet")
+        table = pyarrow.parquet.read_table(path)
+        assert table.column("id").to_pylist() == list(range(5))
+        assert table.column("created").to_pylist()[:2] == \
+            [None, datetime.datetime(2026, 1, 1)]
@@ -0,0 +1,140 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import os
+import stat
+import socket
+import threading
+import pytest
+from crystaldb.db import DB
+
+
+class _Connection(object):
+    """Sends its session commands to `peer`, the server end; like
+    MySQLdb, it closes itself when collected."""
+    def __init__(self):
+        self._sock, self.peer = socket.socketpair()
+        self.closed = False
+
+    def cursor(self):
+        return _Cursor()
+
+    def commit(self):
+        self._sock.sendall(b"COMMIT")
+
+    def rollback(self):
+        self._sock.sendall(b"ROLLBACK")
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._sock.sendall(b"QUIT")
+            self._sock.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class _Cursor(object):
+    description = None
+    rowcount = 0
+
+    def execute(self, query, params=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Driver(object):
+    threadsafety = 1
+    OperationalError = InternalError = type("Error", (Exception, ), {})
+    opened = []
+
+    @classmethod
+    def connect(cls, **params):
+        conn = _Connection()
+        cls.opened.append(conn)
+        return conn
+
+
+def _received(peer):
+    """Returns what reached the server end so far."""
+    peer.setblocking(False)
+    out = b""
+    try:
+        while True:
+            data = peer.recv(64)
+            if not data:
+                break
+            out += data
+    except socket.error:
+        pass
+    peer.setblocking(True)
+    return out
+
+
+def _fork(check):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = check()
+        except Exception:
+            ok = False
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    return os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+class TestForkSafe(object):
+    def test_child_drops_inherited_connection(self):
+        warmed = []
+        db = DB(_Driver, {}, after_fork=lambda handle: warmed.append(handle))
+        conn = db.ctx.db
+        pid = os.fork()
+        if pid == 0:
+            # the inherited socket now points to /dev/null.
+            mode = os.fstat(conn._sock.fileno()).st_mode
+            ok = not stat.S_ISSOCK(mode) and db.ctx.db is not conn and \
+                warmed == [db] and len(db._conns) == 1
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+        # nothing reached the server from the child.
+        conn.peer.setblocking(False)
+        with pytest.raises(socket.error):
+            conn.peer.recv(16)
+        assert db.ctx.db is conn
+        conn.close()
+        assert conn.peer.recv(16) == b"QUIT"
+
+    @pytest.mark.parametrize("pool", [False, True])
+    def test_fork_during_transaction_of_other_thread(self, pool):
+        del _Driver.opened[:]
+        db = DB(_Driver, {}, pool=pool)
+        started, done = threading.Event(), threading.Event()
+
+        def work():
+            with db.transaction():
+                db.query("UPDATE user SET age = 1")
+                started.set()
+                done.wait(5)
+
+        worker = threading.Thread(target=work)
+        worker.start()
+        started.wait(5)
+        try:
+            conn, = _Driver.opened
+            _received(conn.peer)
+            # the child frees the worker's transaction, without a
+            # ROLLBACK or QUIT reaching its session.
+            assert _fork(lambda: db.query("SELECT 1") is not None)
+            assert _received(conn.peer) == b""
+        finally:
+            done.set()
+            worker.join()
+        assert _received(conn.peer) == b"COMMIT"
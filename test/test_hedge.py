@@ -0,0 +1,107 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import time
+import itertools
+import threading
+from crystaldb.db import DB
+from crystaldb.hedge import Hedger
+
+
+class _Driver(object):
+    """Reads on the hosts of `slow` block until killed by KILL QUERY."""
+    def __init__(self, slow=()):
+        self.slow = set(slow)
+        self.kills = []
+        self.connections = {}
+        self._ids = itertools.count(1)
+
+    def connect(self, host=None, **params):
+        conn = _Connection(self, host, next(self._ids))
+        self.connections[conn.id] = conn
+        return conn
+
+
+class _Connection(object):
+    def __init__(self, driver, host, id):
+        self.driver = driver
+        self.host = host
+        self.id = id
+        self.killed = threading.Event()
+        self.description = None
+        self.rows = []
+        self.rowcount = 0
+
+    def thread_id(self):
+        return self.id
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        self.description, self.rows = None, []
+        if query.startswith("KILL QUERY"):
+            target = int(query.split()[-1])
+            self.driver.kills.append(target)
+            self.driver.connections[target].killed.set()
+            return
+        if self.host in self.driver.slow:
+            if self.killed.wait(2):
+                self.killed.clear()
+                raise IOError("Query execution was interrupted")
+        self.description = (("host", ), )
+        self.rows = [(self.host, )]
+
+    def fetchall(self):
+        return self.rows
+
+    def ping(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestHedge(object):
+    def test_hedged_first(self):
+        driver = _Driver(slow=["r1"])
+        db = DB(driver, dict(host="primary"), replicas=["r1", "r2"],
+                hedge=True, hedge_delay=0.02, hedge_budget=1)
+        r1, r2 = db._replicas()
+        # r1 looks faster, the read starts there.
+        r1.ewma, r2.ewma = 0.1, 5.0
+        start = time.time()
+        row = db.select("user").first()
+        assert row.host == "r2" and time.time() - start < 1
+        deadline = time.time() + 2
+        while not driver.kills and time.time() < deadline:
+            time.sleep(0.01)
+        killed = [driver.connections[id].host for id in driver.kills]
+        assert killed == ["r1"]
+        stats = db.hedge_stats()
+        assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+        # the cancelled read is not a failure of r1.
+        deadline = time.time() + 2
+        while r1.inflight and time.time() < deadline:
+            time.sleep(0.01)
+        assert r1.failures == 0
+
+    def test_budget(self):
+        hedger = Hedger(workers=2, delay=0, budget=0)
+        calls = []
+
+        def fetch(replica, task):
+            calls.append(replica)
+            time.sleep(0.01)
+            return replica
+
+        for _ in range(5):
+            assert hedger.read("r1", "r2", fetch) == "r1"
+        assert calls == ["r1"] * 5
+        assert hedger.snapshot()["hedged"] == 0
@@ -0,0 +1,110 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import sqlite3
+import threading
+import pytest
+from crystaldb.db import DB
+from crystaldb.idgen import Snowflake, HiLo
+from crystaldb.exception import ClockMovedBackwards
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "ids.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE crystaldb_sequence "
+                 "(name VARCHAR(64) PRIMARY KEY, next_id BIGINT NOT NULL)")
+    for name in ("user_0", "user_1", "event"):
+        conn.execute("CREATE TABLE %s (id INTEGER PRIMARY KEY, name TEXT)" %
+                     name)
+    conn.commit()
+    conn.close()
+    database = DB(sqlite3, dict(database=path))
+    database.paramstyle = "qmark"
+    return database
+
+
+class TestSnowflake(object):
+    def test_unique_and_ordered(self):
+        ids = Snowflake(worker_id=5, sequence_bits=4)
+        generated = []
+
+        def run():
+            generated.extend(ids.next_ids(500))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(generated)) == 2000
+        # 16 ids per millisecond at most, then the next millisecond.
+        first, last = ids.decode(min(generated)), ids.decode(max(generated))
+        assert first[1] == last[1] == 5
+        assert last[0] - first[0] >= 2000 // 16 - 1
+        assert ids.next_id() > max(generated)
+
+    def test_clock_backwards(self):
+        ids = Snowflake(worker_id=1, max_backwards=0.05)
+        now = [ids._now()]
+        ids._now = lambda: now[0]
+        before = ids.next_id()
+        # a small step back is waited out, a large one raises.
+        now[0] -= 20
+        restore = threading.Timer(0.01, lambda: now.__setitem__(0, now[0] +
+                                                                  21))
+        restore.start()
+        assert ids.next_id() > before
+        now[0] -= 1000
+        with pytest.raises(ClockMovedBackwards):
+            ids.next_id()
+        with pytest.raises(ValueError):
+            Snowflake(worker_id=1024)
+
+
+class TestHiLo(object):
+    def test_blocks(self, database):
+        a = HiLo(database, "user", block=10)
+        b = HiLo(database, "user", block=10)
+        ids = [a.next_id() for _ in range(3)] + b.next_ids(4) + \
+            a.next_ids(12)
+        assert ids[:3] == [1, 2, 3] and ids[3:7] == [11, 12, 13, 14]
+        # 7 left in a's block, then a block of 10 more.
+        assert ids[7:] == list(range(4, 11)) + list(range(21, 26))
+        assert a.blocks == 2 and b.blocks == 1
+        row = database.select("crystaldb_sequence").first()
+        assert (row.name, row.next_id) == ("user", 31)
+
+    def test_sequence_row_errors(self, database):
+        ids = HiLo(database, "user")
+        database.query("CREATE TRIGGER broken BEFORE INSERT ON "
+                       "crystaldb_sequence BEGIN SELECT no_such_function(); "
+                       "END")
+        # only a duplicate row is taken for a concurrent insert.
+        with pytest.raises(sqlite3.OperationalError):
+            ids.next_id()
+        database.query("DROP TRIGGER broken")
+        database.query("CREATE TRIGGER dropped BEFORE INSERT ON "
+                       "crystaldb_sequence BEGIN SELECT RAISE(IGNORE); END")
+        with pytest.raises(ValueError):
+            ids.next_id()
+        assert ids.blocks == 0
+
+    def test_insert_fills_key(self, database):
+        ids = HiLo(database, "user", block=100, start=1000)
+        database.id_generators = {"user_*": ("id", ids),
+                                  "event": ("id", Snowflake(worker_id=2))}
+        assert database.insert("user_0", seqname=True, name="a") == 1000
+        assert database.insert("user_1", seqname=True, name="b") == 1001
+        # a key given is kept.
+        assert database.insert("user_1", seqname=True, id=7, name="c") == 7
+        rows = [dict(name="d"), dict(name="e")]
+        assert list(database.multiple_insert("user_0", rows,
+                                             seqname=True)) == [1002, 1003]
+        assert rows == [dict(name="d"), dict(name="e")]
+        names = dict((row.id, row.name)
+                     for row in database.select("user_0").all())
+        assert names == {1000: "a", 1002: "d", 1003: "e"}
+        event = database.insert("event", seqname=True, name="login")
+        assert database.select("event").first().id == event > 1 << 22
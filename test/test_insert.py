@@ -82,7 +82,6 @@ class TestInsert(object):
         SQL:
             INSERT INTO user (age, birthday, gender, name) VALUES \
                     (36, '1982-08-02', 'girl', 'orm_return_id');
-            SELECT last_insert_id();
         """
         values = {
             'gender': 'girl',
@@ -125,7 +124,6 @@ class TestInsert(object):
                 (35, '1981-08-02', 'girl', 'orm_multiple_insert_return_ids'), \
                 (36, '1981-08-02', 'girl', 'orm_multiple_insert_return_ids'), \
                 (37, '1981-08-02', 'girl', 'orm_multiple_insert_return_ids')
-            SELECT last_insert_id();
 
         result:  range(116, 119)
         """
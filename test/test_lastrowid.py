@@ -0,0 +1,96 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import sys
+import types
+import pytest
+from crystaldb.db import MySQLDB
+
+
+class _Connection(object):
+    """Auto-increment ids from 1, spaced by `increment`."""
+    def __init__(self, increment):
+        self.increment = increment
+        self.next_id = 1
+        self.statements = []
+        self.lastrowid = 0
+        self.rowcount = 0
+        self.rows = []
+        self.lost = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        self.rows = []
+        if query.startswith("SELECT @@auto_increment_increment"):
+            self.rows = [(self.increment, )]
+        elif query.startswith("INSERT"):
+            self.rowcount = query.count("(") - 1 - self.lost
+            self.lastrowid = 0 if "(id, " in query else self.next_id
+            if self.lastrowid:
+                self.next_id += self.rowcount * self.increment
+        return self.rowcount
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def ping(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    conn = _Connection(increment=2)
+    driver = types.ModuleType("fake_mysql_driver")
+    driver.paramstyle = "format"
+    driver.threadsafety = 1
+    driver.OperationalError = driver.InternalError = type(
+        "Error", (Exception, ), {})
+    driver.connect = lambda **params: conn
+    monkeypatch.setitem(sys.modules, "fake_mysql_driver", driver)
+    return conn
+
+
+class TestLastRowId(object):
+    def test_no_round_trip(self, connection):
+        db = MySQLDB(driver="fake_mysql_driver", host="primary")
+        assert db.insert("user", seqname=True, name="a") == 1
+        ids = db.multiple_insert("user", [dict(name="b"), dict(name="c")],
+                                 seqname=True)
+        assert list(ids) == [3, 5]
+        ids = db.multiple_insert("user", [dict(name="d")] * 3, seqname=True)
+        assert isinstance(ids, range) and list(ids) == [7, 9, 11]
+        # the increment is read once per handle, no SELECT last_insert_id.
+        statements = [sql.split(" (")[0] for sql in connection.statements]
+        assert statements == ["INSERT INTO user"] * 2 + \
+            ["SELECT @@auto_increment_increment", "INSERT INTO user"]
+
+    def test_explicit_ids(self, connection):
+        db = MySQLDB(driver="fake_mysql_driver", host="primary")
+        rows = [dict(id=10, name="a"), dict(id=11, name="b")]
+        assert db.multiple_insert("user", rows, seqname=True) is None
+        assert db.multiple_insert("user", rows) == 2
+
+    def test_unknown_ids_release(self, connection):
+        db = MySQLDB(driver="fake_mysql_driver", host="primary", pool=True)
+        connection.lost = 1
+        with pytest.raises(ValueError):
+            db.multiple_insert("user", [dict(name="a"), dict(name="b")],
+                               seqname=True)
+        # rolled back, and the connection is back in the pool.
+        assert connection.rollbacks >= 1
+        stats = db.pool_stats()
+        assert stats["checkouts"] == stats["checkins"] == 1
+        assert stats["in_use"] == 0
@@ -0,0 +1,40 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import pytest
+from crystaldb.config import FIELD_TYPE
+from crystaldb.utils import LazyRows, LazyRow, row_converter
+
+DESCRIPTION = (("id", FIELD_TYPE.LONG), ("doc", FIELD_TYPE.JSON),
+               ("body", FIELD_TYPE.BLOB), ("name", FIELD_TYPE.VAR_STRING))
+
+
+class TestLazyRow(object):
+    def test_default_types(self):
+        names = [d[0] for d in DESCRIPTION]
+        make_row = row_converter("lazy", names, DESCRIPTION)
+        body = bytearray(b"x" * 100)
+        row = make_row((1, '{"a": [1, 2]}', body, "joe"))
+        assert isinstance(row, LazyRow)
+        assert isinstance(row.body, memoryview) and row.body.obj is body
+        assert row.doc == {"a": [1, 2]} and row["doc"] is row.doc
+        assert row.name == "joe" and row.get("missing") is None
+
+    def test_columns(self):
+        calls = []
+
+        def upper(value):
+            calls.append(value)
+            return value.upper()
+
+        make_row = LazyRows(columns={"body": "text", "name": upper}) \
+            .converter(["id", "body", "name"])
+        row = make_row((1, b"caf\xc3\xa9", "joe"))
+        assert calls == []
+        assert row.name == "JOE" and row.name == "JOE" and len(calls) == 1
+        assert dict(row.decode_all()) == dict(id=1, body=u"caf\xe9",
+                                              name="JOE")
+
+    def test_unknown_decoder(self):
+        with pytest.raises(ValueError):
+            LazyRows(columns={"body": "yaml"})
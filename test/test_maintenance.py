@@ -0,0 +1,82 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import time
+import threading
+from crystaldb.db import DB
+
+
+class _Connection(object):
+    closed = False
+
+    def ping(self):
+        pass
+
+    def commit(self):
+        assert not self.closed, "commit on closed connection"
+
+    def close(self):
+        self.closed = True
+
+
+class _Driver(object):
+    @staticmethod
+    def connect(**params):
+        return _Connection()
+
+
+class TestMaintenance(object):
+    def test_reap_dead_threads(self):
+        db = DB(_Driver, {})
+        conns = []
+        barrier = threading.Barrier(3)
+
+        def work():
+            conns.append(db.ctx.db)
+            barrier.wait()
+
+        workers = [threading.Thread(target=work) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert len(db._conns) == 3
+        assert db.maintain() == dict(dead=3, idle=0)
+        assert not db._conns and all(conn.closed for conn in conns)
+
+    def test_idle_cap(self):
+        db = DB(_Driver, {}, max_idle=1, idle_timeout=0)
+        db.ctx.db
+        release = threading.Event()
+        conns = []
+
+        def parked():
+            conns.append(db.ctx.db)
+            release.wait()
+            db._checkout()
+            conns.append(db.ctx.db)
+
+        workers = [threading.Thread(target=parked) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.05)
+        db._pin_record(True)  # in a transaction, never closed
+        assert db.maintain() == dict(dead=0, idle=1)
+        release.set()
+        for worker in workers:
+            worker.join()
+        assert not db.ctx.db.closed
+        # the closed connection was reopened by its thread.
+        assert sum(conn.closed for conn in conns) == 1 and len(conns) == 4
+
+    def test_transaction_reopens(self):
+        db = DB(_Driver, {}, max_idle=0, idle_timeout=0)
+        conn = db.ctx.db
+        time.sleep(0.01)
+        assert db.maintain() == dict(dead=0, idle=1) and conn.closed
+        with db.transaction():
+            assert db.ctx.db is not conn and not db.ctx.db.closed
+            time.sleep(0.01)
+            # pinned by the transaction, never closed.
+            assert db.maintain() == dict(dead=0, idle=0)
+        assert not db.ctx.db.closed
@@ -0,0 +1,126 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import sqlite3
+import pytest
+from crystaldb.db import DB, Table
+from crystaldb.idgen import Snowflake
+from crystaldb.shard import ShardRouter, DualTable
+from crystaldb.migrate import Migration, rebalance
+
+
+def _database(path, tables, rows=()):
+    conn = sqlite3.connect(path)
+    for name in tables:
+        conn.execute("CREATE TABLE %s (id INTEGER PRIMARY KEY, name TEXT)" %
+                     name)
+    conn.executemany("INSERT INTO %s VALUES (?, ?)" % tables[0], rows)
+    conn.commit()
+    conn.close()
+    database = DB(sqlite3, dict(database=path))
+    database.paramstyle = "qmark"
+    return database
+
+
+@pytest.fixture
+def layouts(tmp_path):
+    """user_0 with 50 rows on one database, moving to 2 shards."""
+    old = _database(str(tmp_path / "old.db"), ["user_0"],
+                    [(id, "user-%d" % id) for id in range(50)])
+    new = [_database(str(tmp_path / ("new%d.db" % i)), ["user_%d" % i])
+           for i in range(2)]
+    return (ShardRouter([old], key="id"),
+            ShardRouter(new, key="id", shards=2))
+
+
+def _ids(database, name):
+    return [row.id for row in database.select(name).order_by("id").all()]
+
+
+class TestMigration(object):
+    def test_rebalance(self, layouts):
+        router, new_router = layouts
+        migration, = rebalance(router, new_router, "user", chunk_size=8,
+                               batch_size=3)
+        assert migration.run()
+        assert migration.stats["rows"] == 50
+        assert migration.stats["chunks"] == 7
+        assert migration.stats["mismatches"] == 0
+        (db_0, name_0), (db_1, name_1) = new_router.routes("user")
+        assert _ids(db_0, name_0) == list(range(0, 50, 2))
+        assert _ids(db_1, name_1) == list(range(1, 50, 2))
+
+    def test_resume(self, layouts, tmp_path):
+        router, new_router = layouts
+        path = str(tmp_path / "user_0.json")
+        source = router.table("user", id=0)
+        target = Table(*new_router.route("user", 1))
+        migration = Migration(source, target, chunk_size=10,
+                              checkpoint=path)
+        assert not migration.run(max_chunks=2)
+        assert migration.stats["last"] == 19
+        # a restart goes on after the last checkpointed key; copying a
+        # chunk again replaces its rows.
+        target.insert(id=20, name="stale")
+        resumed = Migration(source, target, chunk_size=10, checkpoint=path)
+        assert resumed.run()
+        assert resumed.stats["rows"] == 50 and resumed.stats["chunks"] == 5
+        assert _ids(target.database, target.tables) == list(range(50))
+        assert target.select().filter(id=20).first().name == "user-20"
+
+    def test_dual_write(self, layouts):
+        router, new_router = layouts
+        router.dual_write(new_router)
+        table = router.table("user", id=51)
+        assert isinstance(table, DualTable)
+        table.insert(id=51, name="new")
+        table.update(dict(id=51), name="renamed")
+        db_1, name_1 = new_router.route("user", 51)
+        assert db_1.select(name_1).filter(id=51).first().name == "renamed"
+        table.delete(dict(id=51))
+        assert _ids(db_1, name_1) == []
+        router.dual_write(None)
+        assert type(router.table("user", id=51)) is Table
+        with pytest.raises(ValueError):
+            router.dual_write(ShardRouter(new_router.databases(),
+                                          key="user_id", shards=4))
+
+    def test_dual_write_generated_key(self, layouts):
+        router, new_router = layouts
+        # sharded by name, the id comes from the generators.
+        router = ShardRouter(router.databases(), key="name", method="hash")
+        new_router = ShardRouter(new_router.databases(), key="name",
+                                 method="hash", shards=2)
+        for i, database in enumerate(router.databases() +
+                                     new_router.databases()):
+            database.id_generators = {
+                "user_*": ("id", Snowflake(worker_id=i))
+            }
+        router.dual_write(new_router)
+        table = router.table("user", name="ann")
+        assert isinstance(table, DualTable)
+        id = table.insert(seqname=True, name="ann")
+        assert id > 1 << 22
+        database, name = new_router.route("user", "ann")
+        assert database.select(name).filter(name="ann").first().id == id
+        assert table.select().filter(name="ann").first().id == id
+
+    def test_dual_write_during_copy(self, layouts):
+        router, new_router = layouts
+        router.dual_write(new_router)
+        source = router.table("user", id=0)
+        target = Table(*new_router.route("user", 3))
+        migration = Migration(source, target, chunk_size=10)
+        write = migration._write
+
+        def dual_written(groups):
+            # row 3 changes after the read of its chunk, before its copy:
+            # the update of the target finds no row yet.
+            if not migration.stats["batches"]:
+                router.table("user", id=3).update(dict(id=3), name="new")
+            write(groups)
+
+        migration._write = dual_written
+        assert migration.run()
+        assert target.select().filter(id=3).first().name == "new"
+        assert migration.stats["mismatches"] == 1
@@ -0,0 +1,122 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import sqlite3
+import datetime
+import pytest
+from crystaldb.db import DB
+from crystaldb.partition import PartitionedTable
+
+
+class _SqlitePartitions(PartitionedTable):
+    """Lists and creates the partitions the sqlite way."""
+    def _list_tables(self):
+        rows = self.database.query(
+            "SELECT name FROM sqlite_master WHERE type = 'table'",
+            row_factory="tuple")
+        return [row[0] for row in rows]
+
+    def _create_table(self, name, like):
+        self.database.query(
+            "CREATE TABLE IF NOT EXISTS %s AS SELECT * FROM %s WHERE 0" %
+            (name, like))
+
+
+class _Driver(object):
+    """Logs the host of every query, a replica lists no table."""
+    def __init__(self):
+        self.hosts = []
+
+    def connect(self, host=None, **params):
+        return _Connection(self, host)
+
+
+class _Connection(object):
+    def __init__(self, driver, host):
+        self.driver = driver
+        self.host = host
+        self.description = (("name", ), )
+        self.rows = []
+        self.rowcount = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        self.driver.hosts.append(self.host)
+        self.rows = [("events_202601", )] if self.host == "primary" else []
+        self.rowcount = len(self.rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def ping(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def events(tmp_path):
+    """events_202601 to events_202604, ids 1-40 in time order."""
+    path = str(tmp_path / "events.db")
+    conn = sqlite3.connect(path)
+    for month in range(1, 5):
+        conn.execute(
+            "CREATE TABLE events_2026%02d (id INTEGER, created_at TEXT)" %
+            month)
+    conn.commit()
+    conn.close()
+    database = DB(sqlite3, dict(database=path))
+    database.paramstyle = "qmark"
+    table = _SqlitePartitions(database, "events", key="created_at")
+    id = 0
+    for month in range(1, 5):
+        for day in range(1, 29, 3):
+            id += 1
+            table.insert(id=id,
+                         created_at="2026-%02d-%02d 10:00:00" % (month, day))
+    return table
+
+
+class TestPartition(object):
+    def test_pruning(self, events):
+        select = events.select().between(
+            created_at=["2026-01-15", "2026-02-20"])
+        assert [name for _, name in select._routes()] == \
+            ["events_202601", "events_202602"]
+        rows = select.order_by("created_at", True).all()
+        assert [row.id for row in rows] == list(range(17, 5, -1))
+        # `lt` on a month start leaves that month out.
+        select = events.select().gte(created_at="2026-02-10").lt(
+            created_at="2026-04-01")
+        assert [name for _, name in select._routes()] == \
+            ["events_202602", "events_202603"]
+
+    @pytest.mark.parametrize("parallel", [False, True])
+    def test_order_limit(self, events, parallel):
+        select = events.select(parallel=parallel).gte(
+            created_at="2026-02-10").order_by("created_at")
+        assert [row.id for row in select.offset(2).limit(3)] == [16, 17, 18]
+        assert events.select(parallel=parallel).gte(
+            created_at="2026-03-01").count() == 20
+
+    def test_create_ahead(self, events):
+        created = events.create_ahead(2, now=datetime.datetime(2026, 4, 5))
+        assert created == ["events_202605", "events_202606"]
+        assert len(events.existing(force=True)) == 6
+        assert events.create_ahead(2, now=datetime.datetime(2026, 4, 5)) == []
+
+    def test_listed_on_primary(self):
+        driver = _Driver()
+        database = DB(driver, dict(host="primary"), replicas=["r1"])
+        table = PartitionedTable(database, "events", key="created_at")
+        assert table._list_tables() == ["events_202601"]
+        assert driver.hosts == ["primary"]
@@ -0,0 +1,160 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import threading
+import pytest
+from DBUtils.PooledDB import TooManyConnections
+from crystaldb.db import DB
+from crystaldb.pool import SharedPool, PoolStats
+
+
+class _Driver(object):
+    threadsafety = 1
+    OperationalError = InternalError = type("Error", (Exception, ), {})
+
+    def __init__(self):
+        self.opened = 0
+
+    def connect(self):
+        self.opened += 1
+        return _Connection()
+
+
+class _Connection(object):
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        pass
+
+    def ping(self, *args):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _SessionDriver(_Driver):
+    """Connections with a server side session: with `SET AUTOCOMMIT = 1`,
+    a statement outside `begin()` commits on its own."""
+    def __init__(self):
+        _Driver.__init__(self)
+        self.rows = []
+        self.commits = 0
+
+    def connect(self):
+        self.opened += 1
+        return _SessionConnection(self)
+
+
+class _SessionConnection(_Connection):
+    def __init__(self, driver):
+        self.driver = driver
+        self.autocommit = False
+        self.in_transaction = False
+        self.pending = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        if query == "SET AUTOCOMMIT = 1":
+            self.autocommit = True
+        elif query.startswith("INSERT"):
+            self.pending.append(params)
+            self.rowcount = 1
+            if self.autocommit and not self.in_transaction:
+                self.commit()
+
+    def fetchone(self):
+        return None
+
+    def begin(self):
+        self.in_transaction = True
+
+    def commit(self):
+        if self.pending:
+            self.driver.rows.extend(self.pending)
+            self.driver.commits += 1
+        self.pending, self.in_transaction = [], False
+
+    def rollback(self):
+        self.pending, self.in_transaction = [], False
+
+
+class TestSharedPool(object):
+    def test_shared_by_threads(self):
+        driver = _Driver()
+        pool = SharedPool(driver, maxconnections=2, blocking=True)
+
+        def work():
+            for _ in range(50):
+                pool.connection().close()
+
+        workers = [threading.Thread(target=work) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert driver.opened <= 2
+        assert pool._connections == 0
+
+    def test_thread_affinity(self):
+        pool = SharedPool(_Driver())
+        held = {}
+
+        def checkout(name):
+            held[name] = pool.connection()
+
+        def release(name):
+            held.pop(name).close()
+
+        def run(func, *args):
+            worker = threading.Thread(target=func, args=args)
+            worker.start()
+            worker.join()
+
+        mine = pool.connection()
+        run(checkout, "other")
+        raw = mine._con
+        mine.close()
+        run(release, "other")
+        # the other thread released last, this thread still gets its own.
+        assert pool.connection()._con is raw
+
+    def test_stats(self):
+        events = []
+        stats = PoolStats(lambda event, value: events.append(event))
+        pool = SharedPool(_Driver(), maxconnections=1, maxusage=2,
+                          stats=stats)
+        conn = pool.connection()
+        with pytest.raises(TooManyConnections):
+            pool.connection()
+        for _ in range(3):
+            conn.cursor().execute("SELECT 1")
+        conn.close()
+        out = stats.snapshot()
+        assert (out["checkouts"], out["checkins"], out["exhausted"]) == \
+            (1, 1, 1)
+        assert out["created"] == 2 and out["recycled"] == 1
+        assert out["destroyed"] == 1 and pool.usage() == (0, 1)
+        assert events.count("create") == 2
+
+    def test_transaction_on_autocommit_session(self):
+        driver = _SessionDriver()
+        db = DB(driver, {}, pool=True, autocommit=True)
+        with pytest.raises(ValueError):
+            with db.transaction():
+                db.insert("t", x=1)
+                db.insert("t", x=2)
+                raise ValueError("undo")
+        # nothing committed by the statements on their own.
+        assert driver.rows == []
+        with db.transaction():
+            for x in range(10):
+                db.insert("t", x=x)
+        assert len(driver.rows) == 10 and driver.commits == 1
@@ -0,0 +1,132 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+from crystaldb.db import DB
+
+
+class _Cursor(object):
+    """A driver cursor logging its statements, with one row per query."""
+    rowcount = 1
+
+    def __init__(self, conn, prepared):
+        self.conn = conn
+        self.prepared = prepared
+        self.closed = False
+        self.description = None
+        conn.cursors.append(self)
+
+    def execute(self, query, params=None):
+        assert not self.closed
+        self.conn.executed.append((self, query, params))
+        self.description = (("id", ), )
+        self.rows = [(len(self.conn.executed), )]
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class _Connection(object):
+    def __init__(self):
+        self.cursors = []
+        self.executed = []
+
+    def cursor(self, prepared=False):
+        return _Cursor(self, prepared)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _PlainConnection(_Connection):
+    """A connection of a driver without prepared cursors."""
+    def cursor(self):
+        return _Cursor(self, False)
+
+
+class _Driver(object):
+    def __init__(self, connection=_Connection):
+        self.connection = connection
+
+    def connect(self, **params):
+        self.conn = self.connection()
+        return self.conn
+
+
+class TestPreparedCursor(object):
+    def test_qmark(self):
+        driver = _Driver()
+        db = DB(driver, {}, prepared=True)
+        db.query("SELECT id FROM user WHERE id = $id AND name = $name",
+                 dict(id=1, name="bob"))
+        cursor, query, params = driver.conn.executed[-1]
+        assert cursor.prepared
+        assert query == "SELECT id FROM user WHERE id = ? AND name = ?"
+        assert list(params) == [1, "bob"]
+
+    def test_cached(self):
+        driver = _Driver()
+        db = DB(driver, {}, prepared=True)
+        for i in range(3):
+            db.query("SELECT id FROM user WHERE id = $id", dict(id=i))
+        cursors = set(cursor for cursor, _, _ in driver.conn.executed)
+        assert len(cursors) == 1
+        assert [params[0] for _, _, params in driver.conn.executed] \
+            == [0, 1, 2]
+
+    def test_eviction(self):
+        driver = _Driver()
+        db = DB(driver, {}, prepared=True, statement_cache_size=2)
+        for table in ("a", "b", "c"):
+            db.query("SELECT id FROM %s" % table)
+        first = driver.conn.executed[0][0]
+        assert first.closed
+        assert not any(cursor.closed
+                       for cursor, _, _ in driver.conn.executed[1:])
+        # prepared again once evicted.
+        db.query("SELECT id FROM a")
+        assert driver.conn.executed[-1][0] is not first
+
+    def test_busy(self):
+        driver = _Driver()
+        db = DB(driver, {}, prepared=True)
+        db.query("SELECT 1")
+        conn = db.ctx.db
+        outer = db._cursor(conn)
+        outer.execute("SELECT id FROM user")
+        cached = driver.conn.executed[-1][0]
+        # the same statement, run while the outer result is still read.
+        inner = db._cursor(conn)
+        inner.execute("SELECT id FROM user")
+        fresh = driver.conn.executed[-1][0]
+        assert fresh is not cached
+        assert inner.fetchall() == [(3, )]
+        inner.close()
+        assert fresh.closed and not cached.closed
+        assert outer.fetchall() == [(2, )]
+        outer.close()
+        # released, the cached cursor is used again.
+        again = db._cursor(conn)
+        again.execute("SELECT id FROM user")
+        assert driver.conn.executed[-1][0] is cached
+        again.close()
+
+    def test_fallback(self):
+        driver = _Driver(_PlainConnection)
+        db = DB(driver, {}, prepared=True)
+        out = db.query("SELECT id FROM user WHERE id = $id", dict(id=5))
+        assert db.prepared is False
+        cursor, query, params = driver.conn.executed[-1]
+        assert not cursor.prepared
+        assert query == "SELECT id FROM user WHERE id = %s"
+        assert list(params) == [5]
+        assert out[0].id == 1
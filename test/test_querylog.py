@@ -0,0 +1,40 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import logging
+from crystaldb.querylog import QueryLog, fingerprint
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.events = []
+
+    def emit(self, record):
+        self.events.append(record.query_event)
+
+
+class _Cursor(object):
+    rowcount = 1
+
+
+class TestQueryLog(object):
+    def test_fingerprint(self):
+        assert fingerprint("select * from user_37 where id = 5 and "
+                           "name = 'a b'") == \
+            "select * from user_37 where id = ? and name = ?"
+
+    def test_sampling(self):
+        handler = _Collect()
+        query_log = QueryLog(sample_rate=0, slow_ms=100,
+                             logger="crystaldb.test").start(handler)
+        try:
+            query_log.emit("select 1", [], 5, _Cursor())
+            query_log.emit("select %s", [2], 150, _Cursor())
+        finally:
+            query_log.stop()
+        assert len(handler.events) == 1
+        event = handler.events[0]
+        assert event.params == [2]
+        assert event.rowcount == 1
+        assert event.as_dict()["fingerprint"] == "select ?"
@@ -0,0 +1,154 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import time
+import pytest
+from crystaldb.db import DB
+from crystaldb.replica import is_read
+
+
+class _Driver(object):
+    """Every connection logs (host, query) into `log`, and answers reads
+    with `answers[host]`."""
+    def __init__(self):
+        self.log = []
+        self.answers = {}
+        self.failing = set()
+
+    def connect(self, host=None, **params):
+        return _Connection(self, host)
+
+
+class _Connection(object):
+    def __init__(self, driver, host):
+        self.driver = driver
+        self.host = host
+        self.description = None
+        self.rows = []
+        self.rowcount = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        self.driver.log.append((self.host, query))
+        if self.host in self.driver.failing:
+            raise IOError("down")
+        if is_read(query):
+            self.description, self.rows = self.driver.answers.get(
+                self.host, ((("id", ), ), [(1, )]))
+        else:
+            self.description, self.rows = None, []
+        self.rowcount = len(self.rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def ping(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _hosts(driver):
+    hosts = [host for host, _ in driver.log]
+    del driver.log[:]
+    return hosts
+
+
+class TestReplica(object):
+    def test_read_write_split(self):
+        driver = _Driver()
+        db = DB(driver, dict(host="primary"), replicas=["r1", "r2"],
+                read_your_writes=0.1)
+        db.query("SELECT * FROM user")
+        db.query("SELECT * FROM user")
+        assert sorted(_hosts(driver)) == ["r1", "r2"]
+
+        db.query("UPDATE user SET age = 2")
+        db.query("SELECT * FROM user")
+        # read your writes
+        assert _hosts(driver) == ["primary", "primary"]
+        time.sleep(0.1)
+        db.query("SELECT * FROM user")
+        assert _hosts(driver) != ["primary"]
+
+        with db.transaction():
+            db.query("SELECT * FROM user")
+        db.query("SELECT * FROM user FOR UPDATE")
+        with db.primary():
+            db.query("SELECT * FROM user")
+        assert set(_hosts(driver)) == set(["primary"])
+
+    def test_lag_ejection(self):
+        driver = _Driver()
+        status = ((("Seconds_Behind_Source", ), ), )
+        driver.answers["r1"] = status + ([(30, )], )
+        driver.answers["r2"] = status + ([(0, )], )
+        db = DB(driver, dict(host="primary"), replicas=["r1", "r2"],
+                max_replica_lag=10)
+        for _ in range(4):
+            db.query("SELECT * FROM user")
+        replicas = list(db._replicas())
+        assert replicas[0].ejected and not replicas[1].ejected
+        reads = [host for host, query in driver.log
+                 if not query.startswith("SHOW")]
+        assert reads == ["r2"] * 4
+
+    def test_gtid_caught_up(self):
+        driver = _Driver()
+        driver.answers["primary"] = ((("gtid", ), ), [("uuid:1-5", )])
+        driver.answers["r1"] = ((("done", ), ), [(0, )])
+        driver.answers["r2"] = ((("done", ), ), [(1, )])
+        db = DB(driver, dict(host="primary"), replicas=["r1", "r2"],
+                replica_gtid=True)
+        db.query("UPDATE user SET age = 2")
+        db.query("SELECT * FROM user")
+        db.query("SELECT * FROM user")
+        reads = [(host, query.split()[1]) for host, query in driver.log]
+        # r1 never applied the write, r2 is asked once.
+        assert reads[1] == ("primary", "@@GLOBAL.gtid_executed")
+        assert len([read for read in reads
+                    if read[1].startswith("GTID_SUBSET")]) <= 2
+        assert reads[-1] == ("r2", "*") and \
+            ("r1", "*") not in reads
+
+    def test_latency_outlier(self):
+        driver = _Driver()
+        db = DB(driver, dict(host="primary"), replicas=["r1", "r2"],
+                eject_time=0.05)
+        r1, r2 = db._replicas()
+        for _ in range(10):
+            for replica, ms in ((r2, 1.0), (r1, 50.0)):
+                replica.begin()
+                replica.end(ms, True)
+        assert r1.ejected and not r2.ejected
+        for _ in range(3):
+            db.query("SELECT * FROM user")
+        assert _hosts(driver) == ["r2"] * 3
+        time.sleep(0.05)
+        # back without average, probed first.
+        db.query("SELECT * FROM user")
+        assert _hosts(driver) == ["r1"]
+        assert r1.ewma is not None and not r1.ejected
+
+    def test_error_ejection(self):
+        driver = _Driver()
+        db = DB(driver, dict(host="primary"), replicas=["r1"],
+                eject_errors=2)
+        driver.failing.add("r1")
+        for _ in range(2):
+            with pytest.raises(IOError):
+                db.query("SELECT * FROM user")
+        stats = db.replica_stats()[0]
+        assert stats["name"] == "r1:3306" and stats["ejected"]
+        assert stats["failures"] == 2 and stats["inflight"] == 0
+        db.query("SELECT * FROM user")
+        assert _hosts(driver)[-1] == "primary"
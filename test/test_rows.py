@@ -0,0 +1,112 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import pytest
+from crystaldb.db import DB
+from crystaldb.utils import Row, Storage, row_class, row_converter
+
+
+class _Cursor(object):
+    """A driver cursor returning the same two rows for every select."""
+    description = (("id", ), ("name", ))
+    rowcount = 2
+
+    def execute(self, query, params=None):
+        self.query = query
+
+    def fetchall(self):
+        return [(1, "joe"), (2, "ann")]
+
+    def close(self):
+        pass
+
+
+class _Connection(object):
+    def cursor(self):
+        return _Cursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Driver(object):
+    def connect(self, **params):
+        return _Connection()
+
+
+class TestRowConverter(object):
+    names = ["id", "name"]
+
+    def test_storage(self):
+        for kind in (None, "storage"):
+            row = row_converter(kind, self.names)((1, "joe"))
+            assert isinstance(row, Storage)
+            assert row.name == "joe" and row["id"] == 1
+
+    def test_dict(self):
+        row = row_converter("dict", self.names)((1, "joe"))
+        assert type(row) is dict and row == {"id": 1, "name": "joe"}
+
+    def test_tuple(self):
+        row = row_converter("tuple", self.names)((1, "joe"))
+        assert type(row) is tuple and row == (1, "joe")
+
+    def test_row(self):
+        row = row_converter("row", self.names)((1, "joe"))
+        assert isinstance(row, Row) and row == (1, "joe")
+        assert row.name == "joe" and row["id"] == 1 and row[1] == "joe"
+        assert row.keys() == self.names and row._asdict()["name"] == "joe"
+        assert type(row) is row_class(tuple(self.names))
+
+    def test_callable(self):
+        make_row = row_converter(lambda names: lambda row: names[0],
+                                 self.names)
+        assert make_row((1, "joe")) == "id"
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            row_converter("list", self.names)
+
+
+class TestRowClass(object):
+    def test_duplicate_names(self):
+        # the last column of a name wins, as in `Storage` rows.
+        row = row_class(("id", "name", "id"))((1, "joe", 2))
+        assert row["id"] == 2 and row.id == 2 and row[0] == 1
+        assert len(row) == 3
+        assert row["id"] == Storage(zip(("id", "name", "id"),
+                                        (1, "joe", 2)))["id"]
+
+    def test_invalid_names(self):
+        names = ("count(*)", "class", "_hidden", "keys", "get")
+        row = row_class(names)((10, "a", "b", "c", "d"))
+        # no attribute for these, the key access still works.
+        assert [row[name] for name in names] == [10, "a", "b", "c", "d"]
+        assert not hasattr(row, "class") and not hasattr(row, "_hidden")
+        assert row.keys() == list(names) and row.get("get") == "d"
+        with pytest.raises(KeyError):
+            row["missing"]
+
+
+class TestRowFactory(object):
+    def test_handle(self):
+        db = DB(_Driver(), {}, row_factory="row")
+        rows = db.query("SELECT id, name FROM user")
+        assert isinstance(rows[0], Row) and rows[0].name == "joe"
+
+    def test_override(self):
+        db = DB(_Driver(), {}, row_factory="row")
+        rows = db.query("SELECT id, name FROM user", row_factory="dict")
+        assert type(rows[0]) is dict and rows[1]["name"] == "ann"
+        rows = db.select("user", row_factory="tuple").all()
+        assert rows == [(1, "joe"), (2, "ann")]
+        rows = db.select("user", row_factory="storage").all()
+        assert isinstance(rows[0], Storage) and rows[0].id == 1
+        # the handle's default is left alone.
+        assert isinstance(db.select("user").all()[0], Row)
@@ -0,0 +1,135 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import time
+import sqlite3
+import threading
+import pytest
+from crystaldb.db import DB
+from crystaldb.shard import ShardRouter
+
+
+class _CountingDriver(object):
+    """sqlite3, counting the connections opened and closed."""
+    def __init__(self):
+        self.opened = 0
+        self.closed = 0
+
+    def connect(self, **params):
+        self.opened += 1
+        return _CountedConnection(self, sqlite3.connect(**params))
+
+
+class _CountedConnection(object):
+    def __init__(self, driver, conn):
+        self.driver = driver
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def close(self):
+        self.driver.closed += 1
+        self.conn.close()
+
+
+@pytest.fixture
+def router(tmp_path):
+    """6 shards of `user` over 3 sqlite databases, 300 rows."""
+    databases = []
+    for i in range(3):
+        path = str(tmp_path / ("shard%d.db" % i))
+        conn = sqlite3.connect(path)
+        for shard in range(2 * i, 2 * i + 2):
+            conn.execute("CREATE TABLE user_%d (id INTEGER, age INTEGER)" %
+                         shard)
+            conn.executemany("INSERT INTO user_%d VALUES (?, ?)" % shard,
+                             [(id, id * 7 % 50)
+                              for id in range(shard, 300, 6)])
+        conn.commit()
+        conn.close()
+        database = DB(sqlite3, dict(database=path))
+        database.paramstyle = "qmark"
+        databases.append(database)
+    return ShardRouter(databases, key="id", shards=6)
+
+
+class TestScatter(object):
+    def test_ordered_limit(self, router):
+        ages = sorted(id * 7 % 50 for id in range(300) if id * 7 % 50 > 10)
+        select = router.select("user").gt(age=10).order_by("age")
+        rows = select.offset(5).limit(10)
+        assert [row.age for row in rows] == ages[5:15]
+        # every shard read offset + limit rows at most.
+        assert all(timing["rows"] <= 15 for timing in select.timings)
+        assert len(select.timings) == 6
+        oldest = router.select("user").order_by("age", True).first()
+        assert oldest.age == 49
+
+    def test_order_by_columns(self, router):
+        rows = router.select("user").order_by("age, id", True).all()
+        keys = [(row.age, row.id) for row in rows]
+        assert keys == sorted(keys, reverse=True) and len(keys) == 300
+        rows = router.select("user").order_by(["age", "id"]).limit(3)
+        assert [row.id for row in rows] == [0, 50, 100]
+        with pytest.raises(ValueError):
+            router.select("user", row_factory="tuple").order_by("age").all()
+
+    def test_unordered_and_single_shard(self, router):
+        rows = router.select("user").all()
+        assert sorted(row.id for row in rows) == list(range(300))
+        select = router.select("user").filter(id=7)
+        assert [row.id for row in select.all()] == [7]
+        assert [timing["table"] for timing in select.timings] == ["user_1"]
+
+    def test_aggregates(self, router):
+        ages = [id * 7 % 50 for id in range(300)]
+        select = router.select("user")
+        assert select.count() == 300
+        assert select.count(distinct="age") == len(set(ages))
+        assert select.sum("age") == sum(ages)
+        assert select.avg("age") == sum(ages) / 300.0
+        assert (select.min("age"), select.max("age")) == (0, 49)
+
+    def test_reused_workers(self, router, tmp_path):
+        driver = _CountingDriver()
+        databases = []
+        for database in router.databases():
+            database = DB(driver, dict(database=database.params["database"]))
+            database.paramstyle = "qmark"
+            databases.append(database)
+        counted = ShardRouter(databases, key="id", shards=6, workers=2)
+        before = threading.active_count()
+        for _ in range(5):
+            assert len(counted.select("user").gt(age=10).all()) == \
+                len([id for id in range(300) if id * 7 % 50 > 10])
+            assert counted.select("user").count() == 300
+        # one connection per shard read, all closed; the worker threads
+        # are kept across the selects.
+        assert driver.opened == driver.closed == 6 * 10
+        assert threading.active_count() - before == 6
+
+    def test_select_while_streaming(self, router):
+        counts = []
+
+        def run():
+            rows = router.select("user").order_by("age").stream(
+                batch_size=5)
+            for row in rows:
+                if row.id % 100 == 0:
+                    counts.append(router.select("user").count())
+
+        before = threading.active_count()
+        reader = threading.Thread(target=run)
+        reader.daemon = True
+        reader.start()
+        reader.join(10)
+        assert not reader.is_alive()
+        assert counts == [300] * 3
+        # the threads started for the counts end, `workers` stay.
+        kept = router.executor.workers
+        for _ in range(50):
+            if threading.active_count() - before <= kept:
+                break
+            time.sleep(0.01)
+        assert threading.active_count() - before == kept
@@ -4,6 +4,7 @@
 # Created Time: 2019-01-29 21:33:24
 
 import pytest
+import crystaldb
 from .dbmodule import TestDB
 
 
@@ -419,3 +420,38 @@ class TestSelect(object):
         assert result.__len__() > 0
         print(dbmodule.get_debug_queries_info)
         #print(result.list())
+
+    @pytest.mark.skipif(False, reason="skipped")
+    def test_orm_compile(self, dbmodule):
+        """
+        SQL:
+            SELECT user.name, user.age FROM user WHERE user.gender = 'girl' \
+                    AND user.age > 35 LIMIT 10;
+        """
+        select = dbmodule.select("user", ["name", "age"]).filter(
+            gender=crystaldb.bindparam("gender"))
+        stmt = select.clone().gt(age=crystaldb.bindparam("age")).compile(
+            limit=10)
+        result = stmt.execute(gender="girl", age=35)
+        print(result)
+        assert result.__len__() > 0
+        assert stmt.first(gender="girl", age=35) == result[0]
+        result = select.compile().execute(gender="girl")
+        assert result.__len__() > 0
+
+    @pytest.mark.skipif(False, reason="skipped")
+    def test_orm_stream(self, dbmodule):
+        """
+        SQL:
+            SELECT user.* FROM user WHERE user.gender = 'girl';
+        """
+        total = dbmodule.select("user").filter(gender="girl").count()
+        result = dbmodule.select("user").filter(gender="girl").stream(
+            batch_size=2)
+        count = 0
+        for item in result:
+            assert item.gender == "girl"
+            count += 1
+        assert count == total
+        with dbmodule.query("select * from user", stream=True) as result:
+            assert result.first() is not None
@@ -0,0 +1,56 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import pytest
+from crystaldb.db import DB
+from crystaldb.shard import ShardRouter
+
+
+class _Driver(object):
+    @staticmethod
+    def connect(**params):
+        return None
+
+
+class TestShardRouter(object):
+    def test_modulo(self):
+        db_a, db_b = DB(_Driver, {}), DB(_Driver, {})
+        router = ShardRouter([db_a, db_b], key="user_id", shards=64)
+        table = router.table("user", user_id=123)
+        assert table.database is db_b and table.tables == "user_59"
+        assert router.route("user", 5) == (db_a, "user_5")
+        sql = table.insert(test=True, user_id=123, name="x")
+        assert str(sql).startswith("INSERT INTO user_59 ")
+        with pytest.raises(ValueError):
+            router.table("user", id=123)
+
+    def test_consistent(self):
+        db = DB(_Driver, {})
+        router = ShardRouter([db], key="name", shards=8,
+                             method="consistent",
+                             tables=dict(user="u_{shard:02d}"))
+        shards = [router.shard("user-%d" % i) for i in range(2000)]
+        assert set(shards) == set(range(8))
+        grown = ShardRouter([db], key="name", shards=9, method="consistent")
+        moved = sum(shard != grown.shard("user-%d" % i)
+                    for i, shard in enumerate(shards))
+        # about 1/9 of the keys move to the new shard.
+        assert moved < 2000 * 0.25
+        assert router.table("user", name="x").tables.startswith("u_0")
+
+    def test_one_handle_per_host(self):
+        made = []
+
+        def factory(**params):
+            made.append(params)
+            return DB(_Driver, {})
+
+        router = ShardRouter([dict(host="h1", db="shop_0"),
+                              dict(host="h1", db="shop_1"),
+                              dict(host="h2", db="shop_2")],
+                             key="user_id", factory=factory)
+        assert len(made) == 2 and len(router.databases()) == 2
+        routes = router.routes("order")
+        assert [name for _, name in routes] == \
+            ["shop_0.order_0", "shop_1.order_1", "shop_2.order_2"]
+        assert routes[0][0] is routes[1][0]
@@ -0,0 +1,150 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import pytest
+from crystaldb.utils import LazyRows
+from crystaldb.exception import MemoryLimitExceeded
+from crystaldb.spill import fetch_budgeted, SpilledResult, MemoryStats
+
+
+class _Cursor(object):
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        out, self.rows = self.rows[:size], self.rows[size:]
+        return out
+
+
+class TestSpill(object):
+    rows = [(i, "name%d" % i) for i in range(1000)]
+
+    def test_within_budget(self):
+        out, nbytes = fetch_budgeted(_Cursor(self.rows), list, 10**8)
+        assert out == [list(row) for row in self.rows]
+        assert nbytes > 0
+
+    def test_raise(self):
+        with pytest.raises(MemoryLimitExceeded) as e:
+            fetch_budgeted(_Cursor(self.rows), tuple, 1000, batch_size=64)
+        assert 0 < e.value.rows < 64
+
+    def test_spill(self):
+        out, nbytes = fetch_budgeted(_Cursor(self.rows), list, 5000,
+                                     policy="spill", batch_size=100)
+        assert isinstance(out, SpilledResult)
+        assert 0 < len(out.rows) < 100 and nbytes < 6000
+        assert len(out) == 1000 and out.spilled_rows == 1000 - len(out.rows)
+        assert list(out) == [list(row) for row in self.rows]
+        assert out[999] == [999, "name999"] and out[-1000] == [0, "name0"]
+        assert out[500:502] == [[500, "name500"], [501, "name501"]]
+        out.close()
+
+    def test_stats(self):
+        stats = MemoryStats()
+        stats.record("select * from user where id = 1", 100, 1, 0)
+        stats.record("select * from user where id = 2", 300, 1, 0)
+        stats.record("select 1", 200, 1, 0)
+        top = stats.top(1)[0]
+        assert top["fingerprint"] == "select * from user where id = ?"
+        assert (top["calls"], top["bytes"], top["max_bytes"]) == (2, 400, 300)
+
+
+class _Rows(object):
+    """A driver with 100000 rows: its default cursor reads them all at
+    `execute`, its `cursors.SSCursor` as they are fetched."""
+    def __init__(self, count=100000):
+        self.produced = 0
+        self.opened = 0
+        self.count = count
+        driver = self
+
+        class SSCursor(_BufferedCursor):
+            def execute(self, query, params=None):
+                self.rows = driver.rows()
+
+            def fetchmany(self, size):
+                return [row for _, row in zip(range(size), self.rows)]
+
+        self.cursors = type("cursors", (object, ), dict(SSCursor=SSCursor))
+
+    def rows(self):
+        for i in range(self.count):
+            self.produced += 1
+            yield (i, "name%d" % i)
+
+    def connect(self, **params):
+        self.opened += 1
+        return _Connection(self)
+
+
+class _BufferedCursor(object):
+    description = (("id", ), ("name", ))
+    rowcount = -1
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def execute(self, query, params=None):
+        self.rows = list(self.driver.rows())
+
+    def fetchmany(self, size):
+        out, self.rows = self.rows[:size], self.rows[size:]
+        return out
+
+    def close(self):
+        pass
+
+
+class _Connection(object):
+    def __init__(self, driver):
+        self.driver = driver
+
+    def cursor(self, cursor_class=_BufferedCursor):
+        return cursor_class(self.driver)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestBudgetedQuery(object):
+    def test_counted_as_read(self):
+        from crystaldb.db import DB
+        driver = _Rows()
+        db = DB(driver, {}, memory_limit=5000)
+        with pytest.raises(MemoryLimitExceeded):
+            db.query("SELECT id, name FROM user", batch_size=100)
+        # the budget stopped the read, the result was never all in memory.
+        assert driver.produced <= 200
+        driver.produced = 0
+        out = db.query("SELECT id, name FROM user", memory_policy="spill",
+                       batch_size=1000)
+        assert len(out) == 100000 and out[-1].name == "name99999"
+        out.close()
+
+    def test_thread_connection(self):
+        from crystaldb.db import DB
+        driver = _Rows(count=10)
+        db = DB(driver, {}, memory_limit=10**6)
+        for _ in range(5):
+            assert len(db.query("SELECT id, name FROM user")) == 10
+        assert driver.opened == 1
+
+    def test_lazy_rows_sized_raw(self):
+        calls = []
+
+        def decode(value):
+            calls.append(value)
+            return value.upper()
+
+        make_row = LazyRows(columns={"name": decode}).converter(
+            ["id", "name"])
+        out, nbytes = fetch_budgeted(_Cursor(TestSpill.rows), make_row,
+                                     10**8)
+        assert len(out) == 1000 and nbytes > 0 and calls == []
@@ -0,0 +1,35 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+from crystaldb.db import SQLQuery, sqlparam
+
+
+class TestSQLQuery(object):
+    def test_add_does_not_alias(self):
+        a = SQLQuery(["x = ", sqlparam(1)])
+        b = a + " AND y = " + sqlparam(2)
+        a += " AND z = 3"
+        a.append(" AND w = 4")
+        assert b.query() == "x = %s AND y = %s"
+        assert b.values() == [1, 2]
+        assert a.values() == [1]
+
+    def test_items_mutation_invalidates_cache(self):
+        q = SQLQuery(["a"]) + "b"
+        assert q.query() == "ab"
+        q.items.append(sqlparam(3))
+        assert q.query() == "ab%s"
+        assert q.values() == [3]
+
+    def test_long_chain(self):
+        q = SQLQuery("SELECT * FROM user WHERE 1 = 1")
+        for i in range(5000):
+            q = q + " AND id != " + sqlparam(i)
+        assert len(q.values()) == 5000
+        assert q.values()[-1] == 4999
+        assert len(q.items) == 10001
+
+    def test_bool(self):
+        assert not SQLQuery()
+        assert not SQLQuery([""]) + ""
+        assert SQLQuery([""]) + sqlparam(None)
@@ -0,0 +1,133 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import pytest
+from crystaldb.db import DB
+
+
+class _Driver(object):
+    """A driver whose connections log what happens to them in `log`, and
+    whose cursors read `count` rows as they are fetched."""
+    class Error(Exception):
+        pass
+
+    def __init__(self, count=10):
+        self.count = count
+        self.log = []
+        self.connections = []
+        self.fail = None
+        self.cursors = type("cursors", (object, ), dict(SSCursor=_Cursor))
+
+    def connect(self, **params):
+        conn = _Connection(self, len(self.connections))
+        self.connections.append(conn)
+        return conn
+
+
+class _Cursor(object):
+    description = (("id", ), )
+    rowcount = -1
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        driver = self.conn.driver
+        driver.log.append((self.conn.number, query))
+        if driver.fail is not None and driver.fail in query:
+            raise driver.Error(query)
+        self.rows = iter([(i, ) for i in range(driver.count)])
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchmany(self, size):
+        return [row for _, row in zip(range(size), self.rows)]
+
+    def close(self):
+        self.conn.driver.log.append((self.conn.number, "CLOSE CURSOR"))
+
+
+class _Connection(object):
+    def __init__(self, driver, number):
+        self.driver = driver
+        self.number = number
+        self.closed = False
+
+    def cursor(self, cursor_class=_Cursor):
+        return cursor_class(self)
+
+    def ping(self):
+        pass
+
+    def commit(self):
+        self.driver.log.append((self.number, "COMMIT"))
+
+    def rollback(self):
+        self.driver.log.append((self.number, "ROLLBACK"))
+
+    def close(self):
+        self.closed = True
+
+
+class TestStream(object):
+    @pytest.fixture
+    def db(self):
+        driver = _Driver()
+        db = DB(driver, {})
+        # the thread's connection, opened by its first query.
+        db.query("SELECT 1")
+        del driver.log[:]
+        return db
+
+    def test_close(self, db):
+        driver = db.db_module
+        result = db.query("SELECT id FROM user", stream=True)
+        stream = driver.connections[-1]
+        assert stream.number == 1 and not stream.closed
+        assert next(iter(result)).id == 0
+        # the unread rows are discarded.
+        result.close()
+        result.close()
+        assert stream.closed and not driver.connections[0].closed
+        assert driver.log == [(1, "SELECT id FROM user"),
+                              (1, "CLOSE CURSOR"), (1, "COMMIT")]
+
+    def test_slice(self, db):
+        driver = db.db_module
+        with db.query("SELECT id FROM user", stream=True,
+                      batch_size=3) as result:
+            assert [row.id for row in result[2:5]] == [2, 3, 4]
+            assert result[6].id == 6
+            assert not driver.connections[-1].closed
+        assert driver.connections[-1].closed
+        # exhausting the rows releases the connection too.
+        result = db.query("SELECT id FROM user", stream=True)
+        assert len(list(result)) == 10
+        assert driver.connections[-1].closed
+
+    def test_failure(self, db):
+        driver = db.db_module
+        driver.fail = "broken"
+        with pytest.raises(driver.Error):
+            db.query("SELECT broken FROM user", stream=True)
+        # neither rolled back nor replaced: only the stream is dropped.
+        assert driver.log == [(1, "SELECT broken FROM user")]
+        assert driver.connections[1].closed
+        thread = driver.connections[0]
+        assert not thread.closed and db.ctx.db is thread
+
+    def test_transaction(self, db):
+        driver = db.db_module
+        with db.transaction():
+            db.query("INSERT INTO user (id) VALUES (10)")
+            del driver.log[:]
+            rows = db.query("SELECT id FROM user", stream=True)
+            assert len(list(rows)) == 10
+            # on the transaction's connection, which the stream neither
+            # commits nor closes.
+            assert driver.log == [(0, "SELECT id FROM user"),
+                                  (0, "CLOSE CURSOR")]
+        assert driver.log[-1] == (0, "COMMIT")
+        assert len(driver.connections) == 1
+        assert not driver.connections[0].closed
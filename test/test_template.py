@@ -0,0 +1,33 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+from crystaldb.db import reparam, template_cache, SQLQuery
+
+
+class TestTemplate(object):
+    def test_cache_hit(self):
+        template_cache.clear()
+        sql = "select * from user where id>:id and gender=:gender"
+        first = reparam(sql, dict(id=80, gender="girl"))
+        second = reparam(sql, dict(id=81, gender="boy"))
+        assert first.query() == second.query()
+        assert second.values() == [81, "boy"]
+        stats = template_cache.stats()
+        assert stats["misses"] == 1
+        assert stats["hits"] == 1
+
+    def test_no_marker_skips_parser(self):
+        template_cache.clear()
+        result = reparam("select * from user", {})
+        assert result == SQLQuery(["select * from user"])
+        assert template_cache.stats()["size"] == 0
+
+    def test_resize(self):
+        template_cache.clear()
+        template_cache.resize(2)
+        try:
+            for i in range(5):
+                reparam("select %d from user where id=$id" % i, dict(id=i))
+            assert len(template_cache) == 2
+        finally:
+            template_cache.resize(512)
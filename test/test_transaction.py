@@ -0,0 +1,52 @@
+# !/usr/bin/python
+# -*- coding:utf-8 -*-
+
+import pytest
+from .dbmodule import TestDB
+
+
+class TestTransaction(object):
+    """
+    Table: `user`, see test_insert.py.
+    """
+    @pytest.fixture(scope="module")
+    def dbmodule(self):
+        return TestDB.db_handle()
+
+    values = {
+        'gender': 'girl',
+        'name': 'transaction',
+        'birthday': '1981-08-02',
+        'age': 37
+    }
+
+    def count(self, dbmodule, name):
+        return dbmodule.select("user").filter(name=name).count()
+
+    def test_pinned_connection(self, dbmodule):
+        with dbmodule.transaction():
+            pinned = dbmodule.ctx.pinned
+            assert pinned is not None
+            for _ in range(10):
+                dbmodule.operator("user").insert(**self.values)
+                assert dbmodule.ctx.pinned is pinned
+            count = self.count(dbmodule, "transaction")
+        assert dbmodule.ctx.pinned is None
+        assert self.count(dbmodule, "transaction") == count
+        dbmodule.operator("user").delete(dict(name="transaction"))
+
+    def test_rollback_savepoint(self, dbmodule):
+        values = dict(self.values, name="savepoint")
+        with dbmodule.transaction():
+            dbmodule.operator("user").insert(**values)
+            with pytest.raises(ValueError):
+                with dbmodule.transaction():
+                    dbmodule.operator("user").insert(**values)
+                    raise ValueError()
+        assert self.count(dbmodule, "savepoint") == 1
+        with pytest.raises(ValueError):
+            with dbmodule.transaction():
+                dbmodule.operator("user").delete(dict(name="savepoint"))
+                raise ValueError()
+        assert self.count(dbmodule, "savepoint") == 1
+        dbmodule.operator("user").delete(dict(name="savepoint"))